@@ -0,0 +1,272 @@
+"""
+StockFlow Stock Adjustments
+---------------------------
+Relative changes to number fields ("+3", "-1") for POST /products/adjust,
+so concurrent scanners add up instead of overwriting each other.
+
+apply_adjustments() locks the products and then the values it changes, in
+id order (as ProductBatchUpdater does), adds the deltas to the current
+values and writes them back with one upsert, all in one transaction. An
+adjustment to a value that is unset starts from 0. Several adjustments to
+the same product and field in one call are summed first.
+
+With coalescing, requests hand their adjustments to an AdjustmentBuffer
+instead. Each worker's flusher thread waits ADJUST_FLUSH_MS after the first
+pending adjustment, sums everything that arrived for the same product and
+field meanwhile, and applies the lot in one transaction. Requests are
+answered only after that transaction commits (or fails), so an
+acknowledged adjustment is durable; a burst of scans on one item costs one
+write.
+"""
+
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future
+from decimal import Decimal, InvalidOperation
+
+from analytics import to_number
+from bulk import RecordError
+from changes import ChangeSet, load_fields
+from db import get_background_pool, insert_many
+from versions import folder_scope, bump_versions
+
+log = logging.getLogger("stockflow.adjust")
+
+ADJUST_MAX_ITEMS = int(os.getenv("ADJUST_MAX_ITEMS", 1000))
+ADJUST_FLUSH_MS = int(os.getenv("ADJUST_FLUSH_MS", 50))
+ADJUST_FLUSH_MAX = int(os.getenv("ADJUST_FLUSH_MAX", 500))
+ADJUST_ACK_TIMEOUT = float(os.getenv("ADJUST_ACK_TIMEOUT", 10))
+
+
+def parse_adjustment(item):
+    """(product_id, field_id, delta) from one request item; raises RecordError."""
+    if not isinstance(item, dict):
+        raise RecordError("Each adjustment must be an object")
+    try:
+        product_id = int(item.get('product_id'))
+        field_id = int(item.get('field_id'))
+    except (TypeError, ValueError):
+        raise RecordError("Missing or invalid product_id or field_id")
+    delta = item.get('delta')
+    if isinstance(delta, bool):
+        delta = None
+    try:
+        delta = Decimal(str(delta).strip())
+    except InvalidOperation:
+        raise RecordError(f"delta must be a number, got {item.get('delta')!r}")
+    if to_number(delta) is None:
+        raise RecordError(f"delta must be a number, got {item.get('delta')!r}")
+    return product_id, field_id, to_number(delta)
+
+
+def format_number(number):
+    """Decimal -> the text stored in field_values.value ("13", "2.5")."""
+    text = format(number.normalize(), 'f')
+    return "0" if text == "-0" else text
+
+
+def apply_adjustments(db, totals):
+    """Add {(product_id, field_id): delta} to the current values.
+
+    Runs in the caller's transaction. Returns (values, errors): the new value
+    text, or an error message, for each key.
+    """
+    values, errors = {}, {}
+    if not totals:
+        return values, errors
+    cur = db.cursor()
+    try:
+        product_ids = sorted({product_id for product_id, _ in totals})
+        field_ids = sorted({field_id for _, field_id in totals})
+        marks = ", ".join(["%s"] * len(product_ids))
+        cur.execute(f"SELECT id, folder_id FROM products WHERE id IN ({marks}) ORDER BY id FOR UPDATE",
+                    product_ids)
+        folders = dict(cur.fetchall())
+        cur.execute(f"""
+            SELECT product_id, field_id, value FROM field_values
+            WHERE product_id IN ({marks}) AND field_id IN ({', '.join(['%s'] * len(field_ids))})
+            ORDER BY product_id, field_id FOR UPDATE
+        """, product_ids + field_ids)
+        old_values = {(pid, fid): value for pid, fid, value in cur.fetchall()}
+        fields = load_fields(db, *sorted(set(folders.values()))) if folders else {}
+
+        changes = ChangeSet(fields)
+        rows, scopes = [], set()
+        for key in sorted(totals):
+            product_id, field_id = key
+            folder_id = folders.get(product_id)
+            field = fields.get(field_id)
+            if folder_id is None:
+                errors[key] = "Product not found"
+                continue
+            if field is None or field['folder_id'] != folder_id:
+                errors[key] = f"Field {field_id} does not belong to folder {folder_id}"
+                continue
+            if field['field_type'] != 'number':
+                errors[key] = f"'{field['name']}' is not a number field"
+                continue
+            old = old_values.get(key)
+            current = to_number(old)
+            if current is None and old is not None and old.strip():
+                errors[key] = f"'{field['name']}' holds {old!r}, which is not a number"
+                continue
+            new = to_number((current or Decimal(0)) + totals[key])
+            if new is None:
+                errors[key] = f"'{field['name']}' would be out of range"
+                continue
+            text = format_number(new)
+            rows.append((product_id, field_id, text, new))
+            changes.record(product_id, field_id, old, text)
+            scopes.add(folder_scope(folder_id))
+            values[key] = text
+
+        insert_many(cur, "field_values", ("product_id", "field_id", "value", "num_value"), rows,
+                    update=("value", "num_value"))
+        changes.apply(db)
+        if scopes:
+            bump_versions(db, *scopes)
+    finally:
+        cur.close()
+    return values, errors
+
+
+def sum_adjustments(adjustments):
+    totals = {}
+    for product_id, field_id, delta in adjustments:
+        key = (product_id, field_id)
+        totals[key] = totals.get(key, Decimal(0)) + delta
+    return totals
+
+
+# --- WRITE-BEHIND ---
+class AdjustmentBuffer:
+    """Coalesces a worker's pending adjustments into one transaction per flush.
+
+    submit() returns a Future per adjustment. It resolves to the new value
+    once the flush that wrote it has committed, or raises RecordError (a bad
+    adjustment) or the database error that rolled the flush back.
+    """
+
+    def __init__(self, acquire, window=0.05, max_keys=500):
+        self._acquire = acquire
+        self.window = window
+        self.max_keys = max_keys
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._thread_pid = None
+        self.submitted = 0
+        self.writes = 0
+        self.flushes = 0
+        self.failed = 0
+        self.last_error = None
+
+    @property
+    def enabled(self):
+        return self.window > 0
+
+    def ensure_started(self):
+        """Start this process's flusher thread (once per worker, after fork)."""
+        if not self.enabled:
+            return
+        pid = os.getpid()
+        if self._thread_pid == pid:
+            return
+        with self._lock:
+            if self._thread_pid == pid:
+                return
+            # Adjustments queued in the parent never reach this process's thread.
+            self._pending = {}
+            self._thread = threading.Thread(target=self._loop, name="adjust-flusher", daemon=True)
+            self._thread_pid = pid
+            self._thread.start()
+
+    def submit(self, adjustments):
+        self.ensure_started()
+        futures = []
+        with self._lock:
+            for product_id, field_id, delta in adjustments:
+                future = Future()
+                entry = self._pending.setdefault((product_id, field_id), [Decimal(0), []])
+                entry[0] += delta
+                entry[1].append(future)
+                futures.append(future)
+            self.submitted += len(futures)
+        self._wake.set()
+        return futures
+
+    def _loop(self):
+        while True:
+            self._wake.wait()
+            # Let a burst gather before writing it.
+            time.sleep(self.window)
+            self._wake.clear()
+            try:
+                while self.flush_once():
+                    pass
+            except Exception as err:
+                self.last_error = str(err)
+                log.warning("Adjustment flusher failed: %s", err)
+
+    def flush_once(self):
+        """Write up to max_keys pending adjustments. Returns False if there were none."""
+        with self._lock:
+            if not self._pending:
+                return False
+            keys = sorted(self._pending)[:self.max_keys]
+            batch = {key: self._pending.pop(key) for key in keys}
+        # Every future in the batch is resolved, whatever fails (including
+        # borrowing the connection); a request is never left to time out.
+        conn = None
+        try:
+            conn = self._acquire()
+            values, errors = apply_adjustments(conn, {key: total for key, (total, _) in batch.items()})
+            conn.commit()
+        except Exception as err:
+            self.failed += 1
+            self.last_error = str(err)
+            log.warning("Adjustment flush of %s keys failed: %s", len(batch), err)
+            for _, futures in batch.values():
+                for future in futures:
+                    future.set_exception(err)
+            if conn is not None:
+                try:
+                    conn.rollback()
+                except Exception:
+                    pass  # the pool discards a connection it can't roll back
+            return True
+        finally:
+            if conn is not None:
+                conn.close()
+        self.flushes += 1
+        self.writes += len(values)
+        for key, (_, futures) in batch.items():
+            for future in futures:
+                if key in values:
+                    future.set_result(values[key])
+                else:
+                    future.set_exception(RecordError(errors[key]))
+        return True
+
+    def stats(self):
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            "window_ms": round(self.window * 1000),
+            "pending": pending,
+            "submitted": self.submitted,
+            "writes": self.writes,
+            "flushes": self.flushes,
+            "failed": self.failed,
+            "last_error": self.last_error,
+        }
+
+
+buffer = AdjustmentBuffer(
+    lambda: get_background_pool().acquire(),
+    window=ADJUST_FLUSH_MS / 1000.0,
+    max_keys=ADJUST_FLUSH_MAX,
+)
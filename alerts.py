@@ -0,0 +1,266 @@
+"""
+StockFlow Alerts
+----------------
+Threshold rules on number fields ("Quantity < 10") and the alerts they
+raise, kept current as values are written instead of by scanning.
+
+A rule names a metric (a number field name, as in the analytics) and applies
+to that field in one folder, or in every folder when folder_id is NULL. The
+`alerts` table holds one row per rule, product and field:
+
+    active = 1    the product's value currently breaks the rule
+    active = 0    it did, and has since been fixed (or the product,
+                  field or folder was deleted)
+
+ChangeSet.apply() passes the number values it changed to evaluate_alerts(),
+which checks them against the rules for their metric and opens, updates or
+resolves just those rows. Creating a rule scans its fields once through
+idx_field_num; deleting one resolves its alerts.
+
+GET /alerts serves the active set, then changes since a cursor, in the same
+(updated_at, id) order and cursor format as GET /sync (see sync.py), with the
+same settle window. Changes made while the active set is being paged
+through are sent again afterwards. Resolved alerts are kept for
+ALERT_RETENTION_DAYS; an older cursor must start over.
+"""
+
+import operator
+import os
+from datetime import timedelta
+from decimal import Decimal
+
+from analytics import to_number
+from db import dialect, insert_many
+from retention import register as register_retention
+from sync import encode_cursor, decode_cursor, SyncReset, SYNC_SETTLE_SECONDS
+
+ALERT_PAGE_SIZE = int(os.getenv("ALERT_PAGE_SIZE", 500))
+ALERT_RETENTION = timedelta(days=int(os.getenv("ALERT_RETENTION_DAYS", 30)))
+
+register_retention("alerts", "resolved_at", ALERT_RETENTION, "active = 0")
+
+LAST_ID = 2 ** 63 - 1
+OPERATORS = {"<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge}
+RULE_FIELDS = ("id", "metric", "folder_id", "operator", "threshold", "created_at")
+ALERT_SELECT = """
+    SELECT a.id, a.rule_id, a.product_id, p.name AS product, a.field_id, a.folder_id,
+           a.value, a.active, a.opened_at, a.resolved_at, a.updated_at
+    FROM alerts a
+    LEFT JOIN products p ON p.id = a.product_id
+"""
+
+
+class RuleError(ValueError):
+    """A rule that cannot be created; the message is reported back."""
+
+
+def _breaks(rule, value):
+    return value is not None and OPERATORS[rule['operator']](value, rule['threshold'])
+
+
+# --- RULES ---
+def list_rules(db):
+    cur = db.cursor(dictionary=True)
+    cur.execute(f"SELECT {', '.join(RULE_FIELDS)} FROM alert_rules ORDER BY id")
+    rules = cur.fetchall()
+    cur.close()
+    return rules
+
+
+def create_rule(db, data):
+    """Add a rule and open alerts for the values that already break it. Returns the rule id.
+
+    Runs in the caller's transaction.
+    """
+    metric = (data.get('metric') or '').strip()
+    if not metric:
+        raise RuleError("metric is required")
+    op = data.get('operator')
+    if op not in OPERATORS:
+        raise RuleError(f"operator must be one of {', '.join(OPERATORS)}")
+    # Parsed like a stored value, so it fits alert_rules.threshold (DECIMAL(30,4)).
+    threshold = to_number(data.get('threshold'))
+    if threshold is None:
+        raise RuleError("threshold must be a number below 10^26 in magnitude")
+    folder_id = data.get('folder_id')
+    if folder_id is not None:
+        try:
+            folder_id = int(folder_id)
+        except (TypeError, ValueError):
+            raise RuleError("folder_id must be an integer")
+
+    cur = db.cursor()
+    if folder_id is not None:
+        cur.execute("SELECT id FROM folders WHERE id = %s AND deleted_at IS NULL", (folder_id,))
+        if cur.fetchone() is None:
+            cur.close()
+            raise RuleError("Folder not found")
+    cur.execute(
+        "INSERT INTO alert_rules (metric, folder_id, operator, threshold) VALUES (%s, %s, %s, %s)",
+        (metric, folder_id, op, threshold)
+    )
+    rule_id = cur.lastrowid
+
+    where = ["fl.name = %s", "fl.field_type = 'number'", "fl.deleted_at IS NULL", f"v.num_value {op} %s"]
+    params = [metric, threshold]
+    if folder_id is not None:
+        where.append("fl.folder_id = %s")
+        params.append(folder_id)
+    cur.execute(f"""
+        INSERT INTO alerts (rule_id, product_id, field_id, folder_id, value, active, opened_at)
+        SELECT %s, v.product_id, v.field_id, fl.folder_id, v.num_value, 1, %s
+        FROM fields fl
+        JOIN field_values v ON v.field_id = fl.id
+        WHERE {' AND '.join(where)}
+    """, [rule_id, dialect().now(cur)] + params)
+    cur.close()
+    return rule_id
+
+
+def delete_rule(db, rule_id):
+    """Remove a rule and resolve its alerts. Returns False if there was no such rule."""
+    cur = db.cursor()
+    cur.execute("DELETE FROM alert_rules WHERE id = %s", (rule_id,))
+    if cur.rowcount == 0:
+        cur.close()
+        return False
+    resolve_alerts(cur, "rule_id = %s", (rule_id,))
+    cur.close()
+    return True
+
+
+def resolve_alerts(cur, where, params):
+    """Resolve the active alerts matching `where` (products, fields or folders going away)."""
+    cur.execute(
+        f"UPDATE alerts SET active = 0, resolved_at = %s WHERE active = 1 AND {where}",
+        [dialect().now(cur)] + list(params)
+    )
+
+
+# --- EVALUATION ---
+def evaluate_alerts(db, entries, fields):
+    """Open, update or resolve alerts for changed number values.
+
+    `entries` are the ChangeSet's (field_id, folder_id, product_id, old, new)
+    history entries and `fields` its field map. Runs in the same transaction.
+    """
+    if not entries:
+        return
+    metrics = sorted({fields[entry[0]]['name'] for entry in entries})
+    folders = sorted({entry[1] for entry in entries})
+    cur = db.cursor(dictionary=True)
+    cur.execute(
+        "SELECT id, metric, folder_id, operator, threshold FROM alert_rules WHERE metric IN ("
+        + ", ".join(["%s"] * len(metrics)) + ") AND (folder_id IS NULL OR folder_id IN ("
+        + ", ".join(["%s"] * len(folders)) + "))",
+        metrics + folders
+    )
+    rules = {}
+    for rule in cur.fetchall():
+        rule['threshold'] = Decimal(str(rule['threshold']))
+        rules.setdefault(rule['metric'], []).append(rule)
+    if not rules:
+        cur.close()
+        return
+
+    # The latest value per (rule, product, field) wins.
+    wanted = {}
+    for field_id, folder_id, product_id, _, new in entries:
+        for rule in rules.get(fields[field_id]['name'], ()):
+            if rule['folder_id'] is None or rule['folder_id'] == folder_id:
+                wanted[(rule['id'], product_id, field_id)] = (folder_id, new, _breaks(rule, new))
+    if not wanted:
+        cur.close()
+        return
+
+    product_ids = sorted({key[1] for key in wanted})
+    rule_ids = sorted({key[0] for key in wanted})
+    cur.execute(
+        "SELECT rule_id, product_id, field_id, active FROM alerts WHERE product_id IN ("
+        + ", ".join(["%s"] * len(product_ids)) + ") AND rule_id IN ("
+        + ", ".join(["%s"] * len(rule_ids)) + ")",
+        product_ids + rule_ids
+    )
+    active = {(row['rule_id'], row['product_id'], row['field_id']): row['active'] for row in cur.fetchall()}
+    cur.close()
+
+    cur = db.cursor()
+    now = dialect().now(cur)
+    opened, kept, resolved = [], [], []
+    for (rule_id, product_id, field_id), (folder_id, value, breaks) in sorted(wanted.items()):
+        was_active = active.get((rule_id, product_id, field_id))
+        row = (rule_id, product_id, field_id, folder_id, value)
+        if breaks and not was_active:
+            opened.append(row + (1, now, None))
+        elif breaks:
+            kept.append(row)
+        elif was_active:
+            resolved.append(row + (0, now))
+
+    columns = ("rule_id", "product_id", "field_id", "folder_id", "value")
+    if opened:
+        insert_many(cur, "alerts", columns + ("active", "opened_at", "resolved_at"), opened,
+                    update=("value", "active", "opened_at", "resolved_at"))
+    if kept:
+        insert_many(cur, "alerts", columns, kept, update=("value",))
+    if resolved:
+        insert_many(cur, "alerts", columns + ("active", "resolved_at"), resolved,
+                    update=("value", "active", "resolved_at"))
+    cur.close()
+
+
+# --- FEED ---
+def alerts_since(db, token, limit=ALERT_PAGE_SIZE):
+    """Active alerts (no cursor) or alerts changed after `token`, one page.
+
+    Raises SyncCursorError or SyncReset, like changes_since().
+    """
+    positions, issued = decode_cursor(token)
+    cur = db.cursor()
+    try:
+        now = dialect().now(cur)
+    finally:
+        cur.close()
+    if issued is not None and issued < now - ALERT_RETENTION:
+        raise SyncReset("Cursor is older than the alert retention period")
+    horizon = now - timedelta(seconds=SYNC_SETTLE_SECONDS)
+
+    # The first pass pages through the active alerts ("active"), remembering
+    # where it began ("start"); later calls read every change from there on.
+    initial = "alerts" not in positions
+    where, params = ["a.updated_at <= %s"], [horizon]
+    if initial:
+        where.append("a.active = 1")
+        start = positions.get("start", (horizon, LAST_ID))
+        after = positions.get("active")
+    else:
+        after = positions["alerts"]
+    if after is not None:
+        where.append("(a.updated_at, a.id) > (%s, %s)")
+        params += list(after)
+    cur = db.cursor(dictionary=True)
+    cur.execute(
+        f"{ALERT_SELECT} WHERE {' AND '.join(where)} ORDER BY a.updated_at, a.id LIMIT %s",
+        params + [limit + 1]
+    )
+    rows = cur.fetchall()
+    cur.close()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    last = (rows[-1]['updated_at'], rows[-1]['id']) if has_more else None
+    if initial:
+        positions = {"active": last, "start": start} if has_more else {"alerts": start}
+    else:
+        # Without more rows, everything up to the horizon has been seen.
+        positions = {"alerts": last or (horizon, LAST_ID)}
+    for row in rows:
+        row['active'] = bool(row['active'])
+        row['value'] = float(row['value']) if row['value'] is not None else None
+    return {
+        "alerts": rows,
+        "cursor": encode_cursor(
+            {name: [stamp.isoformat(" "), row_id] for name, (stamp, row_id) in positions.items()},
+            horizon
+        ),
+        "has_more": has_more,
+    }
@@ -0,0 +1,238 @@
+"""
+StockFlow Analytics Aggregates
+------------------------------
+Keeps a running sum/count/min/max of every number field in
+`metric_aggregates`, so the dashboard no longer scans field_values.
+
+Rows are keyed by field id (which fixes both the folder and the metric
+name), so renaming a field needs no work and deleting a field or folder
+removes its aggregates through ON DELETE CASCADE. Write paths report the
+old and new values they touched and apply_metric_changes() folds them in
+inside the same transaction.
+"""
+
+from decimal import Decimal, InvalidOperation
+
+
+# field_values.num_value and metric_aggregates are DECIMAL(30,4).
+SCALE = Decimal("0.0001")
+MAX_NUMBER = Decimal(10) ** 26
+
+
+def to_number(value):
+    """Parse a field value the way it is stored in field_values.num_value.
+
+    Returns a Decimal rounded to the column's scale, or None if the value is
+    not numeric or does not fit DECIMAL(30,4).
+    """
+    if value is None:
+        return None
+    try:
+        number = Decimal(str(value).strip())
+    except InvalidOperation:
+        return None
+    if not number.is_finite() or abs(number) >= MAX_NUMBER:
+        return None
+    return number.quantize(SCALE)
+
+
+def apply_metric_changes(db, changes):
+    """Fold value changes into metric_aggregates.
+
+    `changes` maps field_id -> (folder_id, added, removed), where added and
+    removed are lists of Decimals. Must run after the field_values rows have
+    been written, in the same transaction.
+    """
+    cur = db.cursor()
+    for field_id, (folder_id, added, removed) in changes.items():
+        if not added and not removed:
+            continue
+        cur.execute("""
+            INSERT INTO metric_aggregates
+                (field_id, folder_id, value_sum, value_count, value_min, value_max)
+            VALUES (%s, %s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE
+                value_sum = value_sum + VALUES(value_sum),
+                value_count = value_count + VALUES(value_count),
+                value_min = LEAST(COALESCE(value_min, VALUES(value_min)), COALESCE(VALUES(value_min), value_min)),
+                value_max = GREATEST(COALESCE(value_max, VALUES(value_max)), COALESCE(VALUES(value_max), value_max))
+        """, (
+            field_id, folder_id,
+            sum(added, Decimal(0)) - sum(removed, Decimal(0)),
+            len(added) - len(removed),
+            min(added) if added else None,
+            max(added) if added else None,
+        ))
+        if removed:
+            cur.execute(
+                "SELECT value_min, value_max FROM metric_aggregates WHERE field_id = %s",
+                (field_id,)
+            )
+            low, high = cur.fetchone()
+            # Only a removed bound forces a rescan of the field.
+            if any(low is None or high is None or v <= low or v >= high for v in removed):
+                _refresh_bounds(cur, field_id)
+    cur.close()
+
+
+def _refresh_bounds(cur, field_id):
+    # Served from the (field_id, num_value) index.
+    cur.execute(
+        "SELECT MIN(num_value), MAX(num_value) FROM field_values WHERE field_id = %s",
+        (field_id,)
+    )
+    low, high = cur.fetchone()
+    cur.execute(
+        "UPDATE metric_aggregates SET value_min = %s, value_max = %s WHERE field_id = %s",
+        (low, high, field_id)
+    )
+
+
+# --- READS ---
+def dashboard(cur, folder_id=None, metric=None):
+    """Chart data for every number metric, from a single query.
+
+    Globally each metric is charted per folder (from metric_aggregates);
+    for one folder it is charted per product. Returns
+    {metric: {"labels": [...], "values": [...], "total": float}}, optionally
+    restricted to one metric. `cur` must be a dictionary cursor.
+    """
+    params = []
+    if folder_id is None:
+        query = """
+            SELECT fl.name AS metric, f.name AS label, COALESCE(SUM(a.value_sum), 0) AS value
+            FROM folders f
+            JOIN fields fl ON f.id = fl.folder_id
+            LEFT JOIN metric_aggregates a ON a.field_id = fl.id
+            WHERE fl.field_type = 'number' AND f.deleted_at IS NULL AND fl.deleted_at IS NULL
+              AND EXISTS (SELECT 1 FROM products p WHERE p.folder_id = f.id)
+              {metric_filter}
+            GROUP BY fl.name, f.id, f.name
+            ORDER BY fl.name, f.id
+        """
+    else:
+        query = """
+            SELECT fl.name AS metric, p.name AS label, COALESCE(v.num_value, 0) AS value
+            FROM products p
+            JOIN fields fl ON p.folder_id = fl.folder_id
+            LEFT JOIN field_values v ON p.id = v.product_id AND v.field_id = fl.id
+            WHERE p.folder_id = %s AND fl.field_type = 'number' AND fl.deleted_at IS NULL
+              {metric_filter}
+            ORDER BY fl.name, fl.id, p.id
+        """
+        params.append(folder_id)
+    if metric is not None:
+        params.append(metric)
+    cur.execute(
+        query.format(metric_filter="AND fl.name = %s" if metric is not None else ""),
+        params
+    )
+
+    charts = {}
+    for row in cur.fetchall():
+        chart = charts.setdefault(row['metric'], {"labels": [], "values": [], "total": 0.0})
+        val = float(row['value'])
+        chart['labels'].append(row['label'])
+        chart['values'].append(val)
+        chart['total'] += val
+    return charts
+
+
+def metric_chart(cur, metric, folder_id=None):
+    """Chart data for one metric, in the shape /analytics/data has always returned."""
+    return dashboard(cur, folder_id, metric).get(metric, {"labels": [], "values": [], "total": 0.0})
+
+
+# --- REBUILD / VERIFY ---
+def compute_aggregates(db):
+    """Recompute every aggregate from field_values, keyed by field id."""
+    cur = db.cursor()
+    cur.execute("""
+        SELECT fl.id, fl.folder_id, SUM(v.num_value), COUNT(v.num_value),
+               MIN(v.num_value), MAX(v.num_value)
+        FROM fields fl
+        JOIN field_values v ON v.field_id = fl.id
+        WHERE fl.field_type = 'number' AND v.num_value IS NOT NULL
+        GROUP BY fl.id, fl.folder_id
+    """)
+    totals = {
+        field_id: {"folder_id": folder_id, "sum": total, "count": count, "min": low, "max": high}
+        for field_id, folder_id, total, count, low, high in cur.fetchall()
+    }
+    cur.close()
+    return totals
+
+
+def find_drift(db, expected):
+    """Compare stored aggregates with `expected`; return a list of differences."""
+    cur = db.cursor()
+    cur.execute(
+        "SELECT field_id, folder_id, value_sum, value_count, value_min, value_max FROM metric_aggregates"
+    )
+    stored = {
+        row[0]: {"folder_id": row[1], "sum": row[2], "count": row[3], "min": row[4], "max": row[5]}
+        for row in cur.fetchall()
+    }
+    cur.close()
+
+    empty = {"sum": Decimal(0), "count": 0, "min": None, "max": None}
+    drift = []
+    for field_id in sorted(set(stored) | set(expected)):
+        have = stored.get(field_id, empty)
+        want = expected.get(field_id, empty)
+        for key in ("sum", "count", "min", "max"):
+            if _differs(have[key], want[key]):
+                drift.append({"field_id": field_id, "key": key, "stored": have[key], "expected": want[key]})
+    return drift
+
+
+def _differs(a, b):
+    if a is None or b is None:
+        return a is not b
+    return Decimal(a).quantize(SCALE) != Decimal(b).quantize(SCALE)
+
+
+def rebuild_aggregates(db):
+    """Replace the contents of metric_aggregates with freshly computed values.
+
+    One transaction. The number fields' rows are locked first: inserting a
+    value takes a shared lock on its field (the foreign key check), so no
+    new values arrive meanwhile. The upsert then reads field_values with
+    locking reads, waiting for writers still in flight, before it touches
+    any aggregate row. That is the order writers lock in, so a change
+    committed during the rebuild is either counted by it or applied on top
+    of it, never lost.
+    """
+    cur = db.cursor()
+    try:
+        cur.execute("SELECT id FROM fields WHERE field_type = 'number' ORDER BY id FOR UPDATE")
+        cur.fetchall()
+        cur.execute("""
+            INSERT INTO metric_aggregates
+                (field_id, folder_id, value_sum, value_count, value_min, value_max)
+            SELECT fl.id, fl.folder_id, SUM(v.num_value), COUNT(v.num_value),
+                   MIN(v.num_value), MAX(v.num_value)
+            FROM fields fl
+            JOIN field_values v ON v.field_id = fl.id
+            WHERE fl.field_type = 'number' AND v.num_value IS NOT NULL
+            GROUP BY fl.id, fl.folder_id
+            ON DUPLICATE KEY UPDATE
+                folder_id = VALUES(folder_id),
+                value_sum = VALUES(value_sum),
+                value_count = VALUES(value_count),
+                value_min = VALUES(value_min),
+                value_max = VALUES(value_max)
+        """)
+        cur.execute("""
+            DELETE FROM metric_aggregates
+            WHERE NOT EXISTS (
+                SELECT 1 FROM field_values v
+                WHERE v.field_id = metric_aggregates.field_id AND v.num_value IS NOT NULL
+            )
+        """)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        cur.close()
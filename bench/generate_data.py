@@ -0,0 +1,115 @@
+"""
+Synthetic data generator for the StockFlow benchmark suite.
+
+Fills the schema with folders, fields and products using multi-row
+INSERTs, then rebuilds the analytics aggregates and the search index so the
+server starts from a consistent state. Point it at a local, disposable
+database (MySQL, or the SQLite file when DB_BACKEND=sqlite):
+
+    python bench/generate_data.py --folders 20 --fields 8 --products 5000
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import connect, insert_many
+from analytics import rebuild_aggregates, to_number
+from bulk import insert_products
+from search import rebuild_search_index
+from versions import bump_versions, folder_scope, FOLDERS
+
+load_dotenv()
+
+WORDS = [
+    "steel", "copper", "oak", "pine", "cotton", "wool", "red", "blue", "green", "large",
+    "small", "bolt", "screw", "panel", "cable", "filter", "valve", "bracket", "sensor", "lamp",
+]
+NUMBER_FIELDS = ["Quantity", "Price", "Weight", "Reorder Level", "Cost", "Width", "Height", "Depth"]
+TEXT_FIELDS = ["Supplier", "Colour", "Location", "Notes", "SKU", "Material"]
+
+
+def product_name(rng):
+    return " ".join(rng.choice(WORDS) for _ in range(3)).title()
+
+
+def generate(conn, folders, fields_per_folder, products_per_folder, number_ratio, batch_size, seed):
+    rng = random.Random(seed)
+    cur = conn.cursor()
+    totals = {"folders": 0, "fields": 0, "products": 0, "field_values": 0}
+
+    for f in range(folders):
+        cur.execute("INSERT INTO folders (name) VALUES (%s)", (f"Bench Folder {f + 1}",))
+        folder_id = cur.lastrowid
+        totals["folders"] += 1
+
+        fields = []
+        for i in range(fields_per_folder):
+            is_number = rng.random() < number_ratio
+            pool = NUMBER_FIELDS if is_number else TEXT_FIELDS
+            name = pool[i % len(pool)] if i < len(pool) else f"{pool[i % len(pool)]} {i}"
+            cur.execute(
+                "INSERT INTO fields (name, field_type, folder_id) VALUES (%s, %s, %s)",
+                (name, "number" if is_number else "text", folder_id)
+            )
+            fields.append((cur.lastrowid, is_number))
+        totals["fields"] += len(fields)
+        conn.commit()
+
+        for start in range(0, products_per_folder, batch_size):
+            count = min(batch_size, products_per_folder - start)
+            product_ids = insert_products(cur, folder_id, [product_name(rng) for _ in range(count)])
+            rows = []
+            for pid in product_ids:
+                for field_id, is_number in fields:
+                    if is_number:
+                        value = str(rng.randint(0, 500))
+                        rows.append((pid, field_id, value, to_number(value)))
+                    else:
+                        rows.append((pid, field_id, rng.choice(WORDS), None))
+            insert_many(cur, "field_values", ("product_id", "field_id", "value", "num_value"), rows)
+            conn.commit()
+            totals["products"] += count
+            totals["field_values"] += len(rows)
+
+        bump_versions(conn, FOLDERS, folder_scope(folder_id))
+        conn.commit()
+        print(f"   📦 Folder {f + 1}/{folders}: {products_per_folder} products")
+
+    cur.close()
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fill a local StockFlow database with synthetic data.")
+    parser.add_argument("--folders", type=int, default=10)
+    parser.add_argument("--fields", type=int, default=6, help="fields per folder")
+    parser.add_argument("--products", type=int, default=1000, help="products per folder")
+    parser.add_argument("--number-ratio", type=float, default=0.6, help="share of fields that are numeric")
+    parser.add_argument("--batch-size", type=int, default=1000, help="products per INSERT batch")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    print("🔧 StockFlow Benchmark Data Generator")
+    print("=" * 50)
+    conn = connect()
+    started = time.monotonic()
+    totals = generate(conn, args.folders, args.fields, args.products,
+                      args.number_ratio, args.batch_size, args.seed)
+    print("\n📊 Rebuilding analytics aggregates...")
+    rebuild_aggregates(conn)
+    print("🔎 Building the search index...")
+    rebuild_search_index(conn, args.batch_size)
+    conn.close()
+    elapsed = time.monotonic() - started
+    print(f"\n✅ Inserted {totals} in {elapsed:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,543 @@
+"""
+Load driver for the StockFlow API.
+
+Runs a weighted mix of every API route (auth, CRUD, bulk, analytics) from
+a pool of keep-alive client threads against a running server, then reports
+p50/p95/p99 latency and requests per second per route and overall. When it
+can reach the database (same .env as the server) it also reports database
+queries per request, from the server's `Questions` status counter, so run
+it against a local instance that nothing else is using.
+
+    python bench/generate_data.py --folders 10 --products 2000
+    gunicorn server:app &
+    python bench/load_test.py --url http://127.0.0.1:5000 --concurrency 16 --duration 60
+    python bench/load_test.py ... --compare bench/results/<earlier run>.json
+
+Results are written to bench/results/<timestamp>.json. Writes are confined
+to a scratch folder that is created at start-up and deleted at the end.
+"""
+
+import argparse
+import http.client
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+from urllib.parse import urlsplit, quote
+
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+load_dotenv()
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+
+class Client:
+    """A keep-alive HTTP connection owned by one thread."""
+
+    def __init__(self, base_url, token=None):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == "https" else 80)
+        self.https = parts.scheme == "https"
+        self.token = token
+        self.conn = None
+
+    def request(self, method, path, body=None, content_type="application/json", headers=None):
+        headers = dict(headers or {})
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        if body is not None:
+            if not isinstance(body, (bytes, str)):
+                body = json.dumps(body)
+            headers["Content-Type"] = content_type
+        for attempt in range(2):
+            if self.conn is None:
+                cls = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+                self.conn = cls(self.host, self.port, timeout=60)
+            started = time.perf_counter()
+            try:
+                self.conn.request(method, path, body=body, headers=headers)
+                response = self.conn.getresponse()
+                data = response.read()
+                return response.status, data, time.perf_counter() - started
+            except (http.client.HTTPException, ConnectionError, OSError):
+                self.conn.close()
+                self.conn = None
+                if attempt:
+                    raise
+
+    def json(self, method, path, body=None):
+        status, data, _ = self.request(method, path, body)
+        return status, (json.loads(data) if data else None)
+
+
+class Workload:
+    """Shared state the operations read from and write to."""
+
+    def __init__(self, base_url, username, password):
+        self.base_url = base_url
+        self.username = username
+        self.password = password
+        self.lock = threading.Lock()
+        self.token = None
+        self.folders = []
+        self.metrics = []
+        self.scratch_folder = None
+        self.scratch_fields = []
+        self.scratch_products = []
+        self.sync_cursor = None
+        self.alerts_cursor = None
+        self.scratch_rule = None
+
+    def setup(self):
+        client = Client(self.base_url)
+        status, body = client.json("POST", "/auth/login", {"username": self.username, "password": self.password})
+        if status != 200:
+            raise SystemExit(f"Login failed ({status}): {body}")
+        self.token = body["token"]
+        client.token = self.token
+
+        _, folders = client.json("GET", "/folders")
+        self.folders = [f["id"] for f in folders]
+        _, self.metrics = client.json("GET", "/analytics/metrics")
+
+        name = f"Bench Scratch {datetime.now():%Y%m%d-%H%M%S}"
+        client.json("POST", "/folders", {"name": name})
+        _, folders = client.json("GET", "/folders")
+        self.scratch_folder = max(f["id"] for f in folders if f["name"] == name)
+        for field_name, field_type in (("Quantity", "number"), ("Supplier", "text")):
+            client.json("POST", "/fields", {"name": field_name, "type": field_type, "folder_id": self.scratch_folder})
+        _, fields = client.json("GET", f"/fields?folder_id={self.scratch_folder}")
+        self.scratch_fields = fields
+        # Scratch writes then open and resolve alerts (values are 0-100).
+        _, rule = client.json("POST", "/alerts/rules", {"metric": "Quantity", "operator": "<", "threshold": 20,
+                                                        "folder_id": self.scratch_folder})
+        self.scratch_rule = rule.get("id")
+        if not self.folders:
+            raise SystemExit("No folders to read from; run bench/generate_data.py first.")
+
+    def teardown(self):
+        client = Client(self.base_url, self.token)
+        if self.scratch_rule:
+            client.request("DELETE", f"/alerts/rules/{self.scratch_rule}")
+        if self.scratch_folder:
+            client.request("DELETE", f"/folders/{self.scratch_folder}")
+        client.request("POST", "/auth/logout")
+
+    def folder(self):
+        return random.choice(self.folders)
+
+    def metric(self):
+        return random.choice(self.metrics) if self.metrics else "Quantity"
+
+    def scratch_values(self):
+        return {str(f["id"]): (str(random.randint(0, 100)) if f["field_type"] == "number" else "bench")
+                for f in self.scratch_fields}
+
+    def take_product(self):
+        with self.lock:
+            return self.scratch_products.pop() if self.scratch_products else None
+
+    def pick_product(self):
+        with self.lock:
+            return random.choice(self.scratch_products) if self.scratch_products else None
+
+    def pick_products(self, count):
+        with self.lock:
+            return random.sample(self.scratch_products, min(count, len(self.scratch_products)))
+
+
+# --- OPERATIONS ---
+# Each returns (route label, HTTP status, seconds), or a list of them. Labels
+# use the route pattern so results group by endpoint rather than by id.
+
+def _get(c, label, path):
+    status, _, elapsed = c.request("GET", path)
+    return label, status, elapsed
+
+def op_list_folders(w, c):
+    return _get(c, "GET /folders", "/folders")
+
+def op_list_fields(w, c):
+    return _get(c, "GET /fields", f"/fields?folder_id={w.folder()}")
+
+def op_list_products(w, c):
+    return _get(c, "GET /products", f"/products?folder_id={w.folder()}")
+
+def op_list_products_columnar(w, c):
+    # What the app sends for a full folder: compact format, gzip on the wire.
+    status, _, elapsed = c.request("GET", f"/products?folder_id={w.folder()}&format=columnar",
+                                   headers={"Accept-Encoding": "gzip"})
+    return "GET /products?format=columnar", status, elapsed
+
+def op_product_page(w, c):
+    sort = random.choice(["name", "-name", "created_at", "id"])
+    return _get(c, "GET /products?limit", f"/products?folder_id={w.folder()}&limit=50&sort={sort}")
+
+def op_sync(w, c):
+    # A shared client position: the first calls page through everything,
+    # later ones fetch the deltas written since.
+    path = "/sync" + (f"?cursor={w.sync_cursor}" if w.sync_cursor else "")
+    status, data, elapsed = c.request("GET", path)
+    if status == 200:
+        w.sync_cursor = json.loads(data)["cursor"]
+    return "GET /sync", status, elapsed
+
+def op_alerts(w, c):
+    # Like op_sync: one shared position in the alert feed.
+    path = "/alerts" + (f"?cursor={w.alerts_cursor}" if w.alerts_cursor else "")
+    status, data, elapsed = c.request("GET", path)
+    if status == 200:
+        w.alerts_cursor = json.loads(data)["cursor"]
+    return "GET /alerts", status, elapsed
+
+# Words from bench/generate_data.py: whole words, prefixes, typos and pairs.
+SEARCH_QUERIES = ["steel", "cop", "valve", "senosr", "brakcet", "oak panel", "green cab", "bench"]
+
+def op_search(w, c):
+    query = random.choice(SEARCH_QUERIES)
+    scope = f"&folder_id={w.folder()}" if random.random() < 0.3 else ""
+    return _get(c, "GET /search", f"/search?q={quote(query)}&limit=20{scope}")
+
+def op_metrics(w, c):
+    return _get(c, "GET /analytics/metrics", "/analytics/metrics")
+
+def op_metric_data(w, c):
+    return _get(c, "GET /analytics/data", f"/analytics/data?metric={quote(w.metric())}")
+
+def op_metric_history(w, c):
+    grain = random.choice(["hour", "day"])
+    return _get(c, "GET /analytics/history", f"/analytics/history?metric={quote(w.metric())}&grain={grain}")
+
+def op_dashboard(w, c):
+    return _get(c, "GET /analytics/dashboard", "/analytics/dashboard")
+
+def op_folder_dashboard(w, c):
+    return _get(c, "GET /analytics/dashboard?folder_id", f"/analytics/dashboard?folder_id={w.folder()}")
+
+def op_folder_metrics(w, c):
+    return _get(c, "GET /analytics/folder/<id>/metrics", f"/analytics/folder/{w.folder()}/metrics")
+
+def op_folder_metric_data(w, c):
+    path = f"/analytics/folder/{w.folder()}/data?metric={quote(w.metric())}"
+    return _get(c, "GET /analytics/folder/<id>/data", path)
+
+def op_export(w, c):
+    return _get(c, "GET /folders/<id>/export", f"/folders/{w.folder()}/export?format=ndjson")
+
+def op_verify(w, c):
+    return _get(c, "GET /auth/verify", "/auth/verify")
+
+def op_create_product(w, c):
+    body = {"name": f"bench-{random.randint(0, 10**9)}", "folder_id": w.scratch_folder, "values": w.scratch_values()}
+    status, _, elapsed = c.request("POST", "/products", body)
+    return "POST /products", status, elapsed
+
+def op_update_product(w, c):
+    pid = w.pick_product()
+    if pid is None:
+        return op_create_product(w, c)
+    status, _, elapsed = c.request("PUT", f"/products/{pid}", {"values": w.scratch_values()})
+    return "PUT /products/<id>", status, elapsed
+
+def op_batch_update(w, c):
+    pids = w.pick_products(50)
+    if not pids:
+        return op_create_product(w, c)
+    body = {"products": [{"id": pid, "values": w.scratch_values()} for pid in pids]}
+    status, _, elapsed = c.request("PUT", "/products/batch", body)
+    return "PUT /products/batch", status, elapsed
+
+def op_scan(w, c):
+    # A barcode scan: -1 on a scratch product's Quantity, coalesced server-side.
+    pid = w.pick_product()
+    if pid is None:
+        return op_create_product(w, c)
+    quantity = next(f["id"] for f in w.scratch_fields if f["name"] == "Quantity")
+    body = {"adjustments": [{"product_id": pid, "field_id": quantity, "delta": -1}], "coalesce": True}
+    status, _, elapsed = c.request("POST", "/products/adjust", body)
+    return "POST /products/adjust", status, elapsed
+
+def op_delete_product(w, c):
+    pid = w.take_product()
+    if pid is None:
+        return op_create_product(w, c)
+    status, _, elapsed = c.request("DELETE", f"/products/{pid}")
+    return "DELETE /products/<id>", status, elapsed
+
+def op_import(w, c):
+    names = ",".join(["name"] + [f["name"] for f in w.scratch_fields])
+    rows = [",".join([f"bench-import-{i}"] + list(w.scratch_values().values())) for i in range(50)]
+    body = "\n".join([names] + rows) + "\n"
+    status, _, elapsed = c.request("POST", f"/products/import?folder_id={w.scratch_folder}&format=csv",
+                                   body, content_type="text/csv")
+    return "POST /products/import", status, elapsed
+
+def op_folder_crud(w, c):
+    # Create, rename and delete a folder; each step is timed under its own label.
+    results = []
+    name = f"bench-folder-{random.randint(0, 10**9)}"
+    status, _, elapsed = c.request("POST", "/folders", {"name": name})
+    results.append(("POST /folders", status, elapsed))
+    _, folders = c.json("GET", "/folders")
+    ids = [f["id"] for f in folders if f["name"] == name]
+    if ids:
+        status, _, elapsed = c.request("PUT", f"/folders/{ids[0]}", {"name": name + "-renamed"})
+        results.append(("PUT /folders/<id>", status, elapsed))
+        status, _, elapsed = c.request("DELETE", f"/folders/{ids[0]}")
+        results.append(("DELETE /folders/<id>", status, elapsed))
+    return results
+
+def op_field_crud(w, c):
+    results = []
+    name = f"bench-field-{random.randint(0, 10**9)}"
+    status, _, elapsed = c.request("POST", "/fields", {"name": name, "type": "number", "folder_id": w.scratch_folder})
+    results.append(("POST /fields", status, elapsed))
+    _, fields = c.json("GET", f"/fields?folder_id={w.scratch_folder}")
+    ids = [f["id"] for f in fields if f["name"] == name]
+    if ids:
+        status, _, elapsed = c.request("PUT", f"/fields/{ids[0]}", {"name": name + "-renamed"})
+        results.append(("PUT /fields/<id>", status, elapsed))
+        status, _, elapsed = c.request("DELETE", f"/fields/{ids[0]}")
+        results.append(("DELETE /fields/<id>", status, elapsed))
+    return results
+
+def op_login_logout(w, c):
+    results = []
+    client = Client(w.base_url)
+    status, data, elapsed = client.request("POST", "/auth/login", {"username": w.username, "password": w.password})
+    results.append(("POST /auth/login", status, elapsed))
+    if status == 200:
+        client.token = json.loads(data)["token"]
+        status, _, elapsed = client.request("POST", "/auth/logout")
+        results.append(("POST /auth/logout", status, elapsed))
+    return results
+
+def op_stats(w, c):
+    path = random.choice(["/stats/pool", "/stats/sessions", "/stats/cache"])
+    return _get(c, f"GET {path}", path)
+
+
+# (operation, weight). Reads dominate, as they do for the mobile app.
+OPERATIONS = [
+    (op_list_folders, 10),
+    (op_list_fields, 10),
+    (op_list_products, 12),
+    (op_list_products_columnar, 6),
+    (op_product_page, 6),
+    (op_sync, 4),
+    (op_search, 6),
+    (op_alerts, 3),
+    (op_metrics, 6),
+    (op_metric_data, 8),
+    (op_dashboard, 4),
+    (op_metric_history, 3),
+    (op_folder_dashboard, 4),
+    (op_folder_metrics, 4),
+    (op_folder_metric_data, 6),
+    (op_export, 1),
+    (op_verify, 4),
+    (op_create_product, 8),
+    (op_update_product, 8),
+    (op_batch_update, 1),
+    (op_scan, 6),
+    (op_delete_product, 3),
+    (op_import, 1),
+    (op_folder_crud, 1),
+    (op_field_crud, 1),
+    (op_login_logout, 1),
+    (op_stats, 1),
+]
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100.0 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+def summarize(latencies, errors, elapsed):
+    values = sorted(latencies)
+    return {
+        "count": len(values),
+        "errors": errors,
+        "rps": round(len(values) / elapsed, 2) if elapsed else None,
+        "mean_ms": round(sum(values) / len(values) * 1000, 3) if values else None,
+        "p50_ms": round(percentile(values, 50) * 1000, 3) if values else None,
+        "p95_ms": round(percentile(values, 95) * 1000, 3) if values else None,
+        "p99_ms": round(percentile(values, 99) * 1000, 3) if values else None,
+    }
+
+
+def db_questions():
+    """The server's global Questions counter, or None if the DB is unreachable
+    or has no such counter (SQLite)."""
+    try:
+        from db import connect, dialect
+        conn = connect()
+        cur = conn.cursor()
+        value = dialect().query_count(cur)
+        cur.close()
+        conn.close()
+        return value
+    except Exception:
+        return None
+
+
+def run(workload, concurrency, duration, max_requests, seed):
+    random.seed(seed)
+    ops, weights = zip(*OPERATIONS)
+    latencies = {}
+    errors = {}
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+    issued = [0]
+
+    def record(label, status, elapsed):
+        with lock:
+            latencies.setdefault(label, []).append(elapsed)
+            if status >= 400:
+                errors[label] = errors.get(label, 0) + 1
+            else:
+                errors.setdefault(label, 0)
+
+    def worker():
+        client = Client(workload.base_url, workload.token)
+        while time.monotonic() < deadline:
+            with lock:
+                if max_requests and issued[0] >= max_requests:
+                    return
+                issued[0] += 1
+            op = random.choices(ops, weights)[0]
+            try:
+                result = op(workload, client)
+            except Exception:
+                record(op.__name__, 599, 0.0)
+                continue
+            for label, status, elapsed in (result if isinstance(result, list) else [result]):
+                record(label, status, elapsed)
+            if op is op_create_product:
+                refresh_scratch_products(workload, client)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.monotonic()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return latencies, errors, time.monotonic() - started
+
+
+def refresh_scratch_products(workload, client):
+    # Cheap enough at bench scale, and keeps update/delete targets real.
+    if random.random() > 0.1:
+        return
+    status, body = client.json("GET", f"/products?folder_id={workload.scratch_folder}")
+    if status == 200 and isinstance(body, list):
+        with workload.lock:
+            workload.scratch_products = [p["id"] for p in body]
+
+
+def compare(current, baseline_path, max_regression):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\n📈 Compared with {baseline_path} (regression threshold {max_regression:g}%)")
+    regressions = 0
+    for label in sorted(current["routes"]):
+        old = baseline["routes"].get(label)
+        new = current["routes"][label]
+        if not old or not old.get("p95_ms") or not new.get("p95_ms"):
+            continue
+        change = (new["p95_ms"] - old["p95_ms"]) / old["p95_ms"] * 100
+        flag = "⚠️ " if change > max_regression else "  "
+        regressions += change > max_regression
+        print(f"   {flag}{label:40s} p95 {old['p95_ms']:9.2f} -> {new['p95_ms']:9.2f} ms ({change:+.1f}%)")
+    old_rps, new_rps = baseline["overall"]["rps"], current["overall"]["rps"]
+    if old_rps:
+        change = (new_rps - old_rps) / old_rps * 100
+        regressions += change < -max_regression
+        print(f"   overall rps {old_rps} -> {new_rps} ({change:+.1f}%)")
+    return regressions
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test a running StockFlow server.")
+    parser.add_argument("--url", default="http://127.0.0.1:5000")
+    parser.add_argument("--username", default="admin")
+    parser.add_argument("--password", default="admin123")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds to run")
+    parser.add_argument("--requests", type=int, default=0, help="stop after this many operations (0 = no limit)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="results file (default: bench/results/<timestamp>.json)")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    parser.add_argument("--max-regression", type=float, default=10.0, help="allowed p95/rps regression in percent")
+    args = parser.parse_args()
+
+    print("🔧 StockFlow Load Test")
+    print("=" * 50)
+    workload = Workload(args.url, args.username, args.password)
+    workload.setup()
+    questions_before = db_questions()
+    try:
+        latencies, errors, elapsed = run(workload, args.concurrency, args.duration, args.requests, args.seed)
+    finally:
+        questions_after = db_questions()
+        workload.teardown()
+
+    all_latencies = [v for values in latencies.values() for v in values]
+    overall = summarize(all_latencies, sum(errors.values()), elapsed)
+    if questions_before is not None and questions_after is not None and overall["count"]:
+        # Subtract the driver's own SHOW STATUS query.
+        overall["db_queries_per_request"] = round((questions_after - questions_before - 1) / overall["count"], 2)
+    results = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "url": args.url,
+            "concurrency": args.concurrency,
+            "duration_seconds": round(elapsed, 2),
+            "seed": args.seed,
+            "git_revision": git_revision(),
+        },
+        "overall": overall,
+        "routes": {label: summarize(values, errors.get(label, 0), elapsed) for label, values in latencies.items()},
+    }
+
+    print(f"\n{'route':42s} {'count':>7s} {'err':>5s} {'p50':>9s} {'p95':>9s} {'p99':>9s}")
+    for label in sorted(results["routes"]):
+        r = results["routes"][label]
+        print(f"{label:42s} {r['count']:7d} {r['errors']:5d} {r['p50_ms']:9.2f} {r['p95_ms']:9.2f} {r['p99_ms']:9.2f}")
+    print(f"\n✅ {overall['count']} requests in {elapsed:.1f}s = {overall['rps']} req/s, "
+          f"p50 {overall['p50_ms']} ms, p95 {overall['p95_ms']} ms, p99 {overall['p99_ms']} ms")
+    if "db_queries_per_request" in overall:
+        print(f"   {overall['db_queries_per_request']} DB queries per request")
+
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"{datetime.now():%Y%m%d-%H%M%S}.json")
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"   Results saved to {output}")
+
+    if args.compare and compare(results, args.compare, args.max_regression):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
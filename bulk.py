@@ -0,0 +1,436 @@
+"""
+StockFlow Bulk Import / Export
+------------------------------
+Streams CSV or NDJSON product records into and out of a folder.
+
+Imports read the request body one line at a time and write it in chunked
+transactions: one multi-row INSERT for the chunk's products and multi-row
+INSERTs for their field values. Exports read from an unbuffered cursor in
+chunks and yield one encoded record at a time. Either way only the current
+chunk is held in memory, so the size of the folder does not matter.
+
+Batch updates (PUT /products/batch) work the same way in the other
+direction: one UPDATE for the chunk's names and one multi-row upsert for
+its values, with a result reported per item.
+"""
+
+import csv
+import io
+import json
+import os
+
+from analytics import to_number
+from changes import ChangeSet, load_fields
+from db import insert_many
+from versions import bump_versions, folder_scope
+
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", 1000))
+IMPORT_MAX_ERRORS = int(os.getenv("IMPORT_MAX_ERRORS", 1000))
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", 2000))
+BATCH_UPDATE_CHUNK = int(os.getenv("BATCH_UPDATE_CHUNK", 500))
+BATCH_UPDATE_MAX_ITEMS = int(os.getenv("BATCH_UPDATE_MAX_ITEMS", 5000))
+
+
+class RecordError(Exception):
+    """A record that cannot be imported; the message is reported back."""
+
+
+def insert_products(cur, folder_id, names):
+    """Insert products into a folder with one multi-row INSERT. Returns their ids, in order.
+
+    A multi-row INSERT is not guaranteed consecutive ids (MySQL's default
+    innodb_autoinc_lock_mode=2 interleaves concurrent inserts), so the ids
+    are read back: the folder row is locked first, as POST /products does,
+    and the folder's products above the previous highest id are then the
+    ones just inserted. Runs in the caller's transaction.
+    """
+    cur.execute("SELECT id FROM folders WHERE id = %s FOR UPDATE", (folder_id,))
+    if cur.fetchone() is None:
+        raise RecordError("Folder not found")
+    cur.execute("SELECT COALESCE(MAX(id), 0) FROM products")
+    last_id = cur.fetchone()[0]
+    insert_many(cur, "products", ("name", "folder_id"), [(name, folder_id) for name in names],
+                chunk_size=len(names))
+    cur.execute("SELECT id, name FROM products WHERE folder_id = %s AND id > %s ORDER BY id",
+                (folder_id, last_id))
+    rows = cur.fetchall()
+    if [name for _, name in rows] != list(names):
+        raise RuntimeError("Inserted products could not be read back")
+    return [product_id for product_id, _ in rows]
+
+
+def decode_lines(stream):
+    """Yield text lines from a binary stream, dropping a leading BOM."""
+    first = True
+    for raw in stream:
+        line = raw.decode('utf-8')
+        if first:
+            line = line.lstrip('\ufeff')
+            first = False
+        yield line
+
+
+def iter_csv(lines):
+    """Yield (row_number, {column: value}) from CSV text lines with a header row."""
+    reader = csv.reader(lines)
+    header = next(reader, None)
+    if header is None:
+        return
+    header = [h.strip() for h in header]
+    for number, row in enumerate(reader, start=1):
+        if not any(cell.strip() for cell in row):
+            continue
+        yield number, dict(zip(header, row))
+
+
+def iter_ndjson(lines):
+    """Yield (row_number, record) from NDJSON lines.
+
+    A record is either flat ({"name": ..., "<field>": value}) or shaped like
+    the POST /products body ({"name": ..., "values": {field: value}}).
+    """
+    for number, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as err:
+            yield number, RecordError(f"Invalid JSON: {err}")
+            continue
+        if not isinstance(record, dict):
+            yield number, RecordError("Each line must be a JSON object")
+            continue
+        values = record.pop('values', None)
+        if isinstance(values, dict):
+            record.update(values)
+        yield number, record
+
+
+class ProductImporter:
+    """Maps records onto a folder's fields and writes them in batches."""
+
+    def __init__(self, db, folder_id, fields, batch_size=IMPORT_BATCH_SIZE):
+        self.db = db
+        self.folder_id = folder_id
+        self.batch_size = batch_size
+        # Columns may name a field either by its name (case-insensitive) or its id.
+        self.fields = {field['id']: field for field in fields}
+        self.columns = {}
+        for field in fields:
+            self.columns[field['name'].strip().lower()] = field
+            self.columns[str(field['id'])] = field
+        self.batch = []
+        self.imported = 0
+        self.failed = 0
+        self.batches = 0
+        self.errors = []
+        self.ignored_columns = set()
+        self.aborted = None
+
+    def run(self, records):
+        """Import `records`; returns the summary.
+
+        An upload that stops parsing (bad UTF-8 or CSV) ends the import at
+        that row: the rows before it are still written, and the summary
+        reports them along with the error in `aborted`.
+        """
+        number = 0
+        records = iter(records)
+        while True:
+            try:
+                number, record = next(records)
+            except StopIteration:
+                break
+            except (UnicodeDecodeError, csv.Error) as err:
+                number += 1
+                self.aborted = {"row": number, "error": f"Could not parse upload: {err}"}
+                self._error(number, self.aborted["error"])
+                break
+            if isinstance(record, Exception):
+                self._error(number, str(record))
+                continue
+            try:
+                self.batch.append((number, self._map(record)))
+            except RecordError as err:
+                self._error(number, str(err))
+                continue
+            if len(self.batch) >= self.batch_size:
+                self._flush()
+        self._flush()
+        return self.summary()
+
+    def summary(self):
+        return {
+            "imported": self.imported,
+            "failed": self.failed,
+            "batches": self.batches,
+            "errors": self.errors,
+            "errors_truncated": self.failed > len(self.errors),
+            "ignored_columns": sorted(self.ignored_columns),
+            "aborted": self.aborted,
+        }
+
+    def _map(self, record):
+        name = None
+        values = []
+        for column, value in record.items():
+            key = str(column).strip()
+            if key.lower() == 'name':
+                name = value
+                continue
+            field = self.columns.get(key.lower())
+            if field is None:
+                self.ignored_columns.add(key)
+                continue
+            if value is None or str(value).strip() == '':
+                continue
+            if field['field_type'] == 'number' and to_number(value) is None:
+                raise RecordError(f"'{field['name']}' must be a number, got {value!r}")
+            values.append((field['id'], str(value)))
+        if name is None or str(name).strip() == '':
+            raise RecordError("Missing product name")
+        return str(name).strip(), values
+
+    def _flush(self):
+        if not self.batch:
+            return
+        batch, self.batch = self.batch, []
+        cur = self.db.cursor()
+        try:
+            product_ids = insert_products(cur, self.folder_id, [name for _, (name, _) in batch])
+            rows = []
+            changes = ChangeSet(self.fields)
+            for pid, (_, (name, values)) in zip(product_ids, batch):
+                changes.record_name(pid, self.folder_id, name)
+                for fid, val in values:
+                    rows.append((pid, fid, val, changes.num_value(fid, val)))
+                    changes.record(pid, fid, None, val)
+            insert_many(cur, "field_values", ("product_id", "field_id", "value", "num_value"), rows)
+            changes.apply(self.db)
+            bump_versions(self.db, folder_scope(self.folder_id))
+            self.db.commit()
+            self.imported += len(batch)
+        except Exception as err:
+            self.db.rollback()
+            for number, _ in batch:
+                self._error(number, f"Batch failed: {err}")
+        finally:
+            cur.close()
+            self.batches += 1
+
+    def _error(self, number, message):
+        self.failed += 1
+        if len(self.errors) < IMPORT_MAX_ERRORS:
+            self.errors.append({"row": number, "error": message})
+
+
+# --- BATCH UPDATE ---
+class ProductBatchUpdater:
+    """Applies name/value changes to many products, chunk_size per transaction.
+
+    Items are checked against their product's folder before anything is
+    written; an invalid item is reported and skipped without affecting the
+    rest. Each chunk locks its products and their current values (in id
+    order, so concurrent batches cannot deadlock), then writes every name
+    with one UPDATE and every value with one multi-row upsert.
+    """
+
+    def __init__(self, db, chunk_size=BATCH_UPDATE_CHUNK):
+        self.db = db
+        self.chunk_size = chunk_size
+
+    def run(self, items):
+        results = [None] * len(items)
+        pending = []
+        seen = set()
+        for index, item in enumerate(items):
+            try:
+                pending.append((index, self._parse(item, seen)))
+            except RecordError as err:
+                item_id = item.get('id') if isinstance(item, dict) else None
+                results[index] = {"id": item_id, "status": "error", "error": str(err)}
+        for start in range(0, len(pending), self.chunk_size):
+            self._apply(pending[start:start + self.chunk_size], results)
+        updated = sum(1 for result in results if result['status'] == 'updated')
+        return {"updated": updated, "failed": len(results) - updated, "results": results}
+
+    @staticmethod
+    def _parse(item, seen):
+        if not isinstance(item, dict):
+            raise RecordError("Each item must be an object")
+        try:
+            product_id = int(item.get('id'))
+        except (TypeError, ValueError):
+            raise RecordError("Missing or invalid product id")
+        if product_id in seen:
+            raise RecordError("Product appears more than once in the batch")
+        seen.add(product_id)
+
+        name = item.get('name')
+        if name is not None:
+            name = str(name).strip()
+            if not name:
+                raise RecordError("Product name cannot be empty")
+        values = item.get('values') or {}
+        if not isinstance(values, dict):
+            raise RecordError("values must be an object of field id -> value")
+        if name is None and not values:
+            raise RecordError("Nothing to update")
+        return product_id, name, values
+
+    @staticmethod
+    def _check_values(values, folder_id, fields):
+        checked = []
+        for key, value in values.items():
+            try:
+                field = fields.get(int(key))
+            except (TypeError, ValueError):
+                field = None
+            if field is None or field['folder_id'] != folder_id:
+                raise RecordError(f"Field {key} does not belong to folder {folder_id}")
+            value = None if value is None else str(value)
+            if (field['field_type'] == 'number' and value and value.strip()
+                    and to_number(value) is None):
+                raise RecordError(f"'{field['name']}' must be a number, got {value!r}")
+            checked.append((field['id'], value))
+        return checked
+
+    def _apply(self, chunk, results):
+        cur = self.db.cursor()
+        written = []
+        try:
+            ids = sorted(product_id for _, (product_id, _, _) in chunk)
+            marks = ", ".join(["%s"] * len(ids))
+            cur.execute(f"SELECT id, folder_id FROM products WHERE id IN ({marks}) ORDER BY id FOR UPDATE", ids)
+            folders = dict(cur.fetchall())
+            cur.execute(f"""
+                SELECT product_id, field_id, value FROM field_values
+                WHERE product_id IN ({marks}) ORDER BY product_id, field_id FOR UPDATE
+            """, ids)
+            old_values = {(pid, fid): value for pid, fid, value in cur.fetchall()}
+            fields = load_fields(self.db, *sorted(set(folders.values()))) if folders else {}
+
+            changes = ChangeSet(fields)
+            names, rows, scopes = [], [], set()
+            for index, (product_id, name, values) in chunk:
+                folder_id = folders.get(product_id)
+                if folder_id is None:
+                    results[index] = {"id": product_id, "status": "error", "error": "Product not found"}
+                    continue
+                try:
+                    checked = self._check_values(values, folder_id, fields)
+                except RecordError as err:
+                    results[index] = {"id": product_id, "status": "error", "error": str(err)}
+                    continue
+                if name is not None:
+                    names.append((product_id, name))
+                    changes.record_name(product_id, folder_id, name)
+                for field_id, value in checked:
+                    rows.append((product_id, field_id, value, changes.num_value(field_id, value)))
+                    changes.record(product_id, field_id, old_values.get((product_id, field_id)), value)
+                scopes.add(folder_scope(folder_id))
+                written.append((index, product_id))
+
+            if names:
+                cases = " ".join(["WHEN %s THEN %s"] * len(names))
+                params = [p for pair in names for p in pair] + [product_id for product_id, _ in names]
+                cur.execute(
+                    f"UPDATE products SET name = CASE id {cases} END "
+                    f"WHERE id IN ({', '.join(['%s'] * len(names))})",
+                    params
+                )
+            insert_many(cur, "field_values", ("product_id", "field_id", "value", "num_value"), rows,
+                        update=("value", "num_value"))
+            changes.apply(self.db)
+            if scopes:
+                bump_versions(self.db, *scopes)
+            self.db.commit()
+            for index, product_id in written:
+                results[index] = {"id": product_id, "status": "updated"}
+        except Exception as err:
+            self.db.rollback()
+            for index, (product_id, _, _) in chunk:
+                if results[index] is None:
+                    results[index] = {"id": product_id, "status": "error", "error": f"Batch failed: {err}"}
+        finally:
+            cur.close()
+
+
+# --- EXPORT ---
+def iter_products(db, folder_id, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield (id, name, created_at, {field_id: value}) per product, in id order.
+
+    Rows come from an unbuffered cursor, fetched chunk_size at a time. The
+    generator owns `db`: it is closed (returned to its pool) when the
+    generator finishes or is closed, e.g. by a client disconnecting.
+    """
+    cur = None
+    current = None
+    try:
+        cur = db.cursor(buffered=False)
+        cur.execute("""
+            SELECT p.id, p.name, p.created_at, v.field_id, v.value
+            FROM products p
+            LEFT JOIN field_values v ON v.product_id = p.id
+            WHERE p.folder_id = %s
+            ORDER BY p.id
+        """, (folder_id,))
+        while True:
+            rows = cur.fetchmany(chunk_size)
+            if not rows:
+                break
+            for pid, name, created_at, field_id, value in rows:
+                if current is None or current[0] != pid:
+                    if current is not None:
+                        yield current
+                    current = (pid, name, created_at, {})
+                if field_id is not None:
+                    current[3][field_id] = value
+        if current is not None:
+            yield current
+    finally:
+        try:
+            if cur is not None:
+                cur.close()
+        except Exception:
+            # Stopped early: mysql.connector refuses to close a cursor with
+            # unread rows. The pool discards a connection left in that state
+            # rather than draining the rest of the export.
+            pass
+        finally:
+            db.close()
+
+
+def _timestamp(value):
+    return value.isoformat() if hasattr(value, 'isoformat') else value
+
+
+def export_ndjson(products, fields):
+    """Encode products as NDJSON lines that POST /products/import accepts back."""
+    for pid, name, created_at, values in products:
+        record = {
+            "id": pid,
+            "name": name,
+            "created_at": _timestamp(created_at),
+            "values": {f['name']: values.get(f['id']) for f in fields},
+        }
+        yield json.dumps(record, default=str) + "\n"
+
+
+def export_csv(products, fields):
+    """Encode products as CSV with one column per field, header first."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def flush():
+        data = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return data
+
+    writer.writerow(["id", "name", "created_at"] + [f['name'] for f in fields])
+    yield flush()
+    for pid, name, created_at, values in products:
+        writer.writerow([pid, name, _timestamp(created_at)] + [values.get(f['id'], '') for f in fields])
+        yield flush()
@@ -0,0 +1,96 @@
+"""
+StockFlow Change Tracking
+-------------------------
+Write paths describe what they changed in a ChangeSet and apply it before
+committing, so every derived table (metric aggregates, metric history and
+its rollups, the search index, low-stock alerts) is updated in the same
+transaction as the field_values rows themselves.
+"""
+
+from alerts import evaluate_alerts
+from analytics import apply_metric_changes, to_number
+from history import record_history
+from search import NAME_FIELD, index_changes
+
+
+def load_fields(db, folder_id, *more_folder_ids):
+    """Map field id -> {id, name, field_type, folder_id} for one or more folders.
+
+    Fields being deleted are left out, so writes no longer touch their aggregates.
+    """
+    folder_ids = (folder_id,) + more_folder_ids
+    cur = db.cursor(dictionary=True)
+    cur.execute(
+        "SELECT id, name, field_type, folder_id FROM fields WHERE folder_id IN ("
+        + ", ".join(["%s"] * len(folder_ids)) + ") AND deleted_at IS NULL",
+        folder_ids
+    )
+    fields = {row['id']: row for row in cur.fetchall()}
+    cur.close()
+    return fields
+
+
+class ChangeSet:
+    """Old/new field values touched by one transaction."""
+
+    def __init__(self, fields):
+        self.fields = fields
+        self.metrics = {}
+        self.history = []
+        self.search = {}
+
+    def record(self, product_id, field_id, old, new):
+        """Note that a product's value for field_id went from old to new.
+
+        Either side may be None (value created or removed). Unknown fields are
+        ignored, like the rows the database would reject or not join to.
+        """
+        field = self._field(field_id)
+        if field is None:
+            return
+        if field['field_type'] != 'number':
+            if old != new:
+                self.search[(product_id, field['id'])] = (field['folder_id'], new)
+            return
+        old_number, new_number = to_number(old), to_number(new)
+        if old_number == new_number:
+            return
+        folder_id, added, removed = self.metrics.setdefault(
+            field['id'], (field['folder_id'], [], [])
+        )
+        if old_number is not None:
+            removed.append(old_number)
+        if new_number is not None:
+            added.append(new_number)
+        self.history.append((field['id'], folder_id, product_id, old_number, new_number))
+
+    def record_name(self, product_id, folder_id, name):
+        """Note a product's new (or first) name, for the search index."""
+        self.search[(product_id, NAME_FIELD)] = (folder_id, name)
+
+    def num_value(self, field_id, value):
+        """The typed num_value to store alongside `value` (None for non-number fields)."""
+        if self._number_field(field_id) is None:
+            return None
+        return to_number(value)
+
+    def _field(self, field_id):
+        try:
+            return self.fields.get(int(field_id))
+        except (TypeError, ValueError):
+            return None
+
+    def _number_field(self, field_id):
+        field = self._field(field_id)
+        if field is None or field['field_type'] != 'number':
+            return None
+        return field
+
+    def apply(self, db):
+        apply_metric_changes(db, self.metrics)
+        record_history(db, self.history)
+        evaluate_alerts(db, self.history, self.fields)
+        index_changes(db, self.search)
+        self.metrics = {}
+        self.history = []
+        self.search = {}
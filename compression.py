@@ -0,0 +1,76 @@
+"""
+StockFlow Compression
+---------------------
+Compresses JSON, CSV and NDJSON responses for clients that accept it.
+
+The encoding is negotiated from Accept-Encoding: brotli when the optional
+`brotli` package is installed and the client prefers it at least as much as
+gzip, otherwise gzip. Bodies under COMPRESS_MIN_BYTES go out as they are;
+streamed responses (exports) are never buffered to compress them.
+
+A compressed body is a different representation of the same data, so its
+ETag is marked weak and the response varies on Accept-Encoding. Bodies with
+an ETag (the cached GET routes) are compressed once per encoding and kept in
+the response cache next to the plain body.
+"""
+
+import gzip
+import os
+
+try:
+    import brotli
+except ImportError:  # optional; gzip only
+    brotli = None
+
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", 1024))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", 6))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", 5))
+
+COMPRESSIBLE = ("application/json", "text/csv", "application/x-ndjson")
+ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def choose_encoding(accept_encodings):
+    """The encoding to use for a request's Accept-Encoding, or None."""
+    return accept_encodings.best_match(ENCODINGS)
+
+
+def compress(body, encoding):
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def compress_response(response, accept_encodings, cache=None):
+    """Compress `response` in place when it is worth it. Returns the response.
+
+    `cache` (a ResponseCache) keeps compressed bodies of responses with a
+    strong ETag, keyed by ETag and encoding.
+    """
+    if response.status_code == 304:
+        response.vary.add('Accept-Encoding')
+        return response
+    if (response.mimetype not in COMPRESSIBLE or response.is_streamed
+            or response.direct_passthrough or 'Content-Encoding' in response.headers):
+        return response
+    response.vary.add('Accept-Encoding')
+    if response.status_code != 200:
+        return response
+    encoding = choose_encoding(accept_encodings)
+    if encoding is None or response.content_length is None or response.content_length < COMPRESS_MIN_BYTES:
+        return response
+
+    etag, weak = response.get_etag()
+    key = f"{etag}.{encoding}" if etag and not weak and cache is not None else None
+    entry = cache.get(key) if key else None
+    if entry is not None:
+        body = entry[0]
+    else:
+        body = compress(response.get_data(), encoding)
+        if key:
+            cache.put(key, body, response.mimetype)
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    if etag:
+        response.set_etag(etag, weak=True)
+    return response
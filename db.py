@@ -0,0 +1,307 @@
+"""
+StockFlow Database Connections
+------------------------------
+A small per-worker connection pool for the MySQL/TiDB backend.
+
+Connections are health-checked when they are borrowed, recycled once they
+get too old, and handed back to the pool when the caller closes them.
+Gunicorn forks its workers after importing the app, so the pool is created
+lazily and re-created whenever the process id changes.
+
+Background threads (job runner, retention sweeper, replica checker,
+adjustment flusher) borrow
+from a second, smaller pool, so a long job can't take the connections the
+request threads need.
+
+Read replicas get pools of their own; see replicas.py.
+
+DB_BACKEND=sqlite swaps in the embedded backend from db_sqlite.py. The app
+keeps writing MySQL SQL either way; the few statements with no portable
+spelling go through dialect().
+"""
+
+import os
+import threading
+import time
+
+import mysql.connector
+
+import db_sqlite
+from metrics import InstrumentedCursor
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection became free within the borrow timeout."""
+
+
+def _env_int(name, default):
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+def _env_float(name, default):
+    value = os.getenv(name)
+    return float(value) if value else default
+
+
+def backend_name():
+    return os.getenv("DB_BACKEND", "mysql").strip().lower()
+
+
+def is_sqlite():
+    return backend_name() == "sqlite"
+
+
+class MySQLDialect:
+    """Backend-specific statements; see db_sqlite.SQLiteDialect for the other side."""
+
+    name = "mysql"
+
+    def try_lock(self, cur, name):
+        cur.execute("SELECT GET_LOCK(%s, 0)", (name,))
+        return cur.fetchone()[0] == 1
+
+    def release_lock(self, cur, name):
+        cur.execute("SELECT RELEASE_LOCK(%s)", (name,))
+        cur.fetchall()
+
+    def query_count(self, cur):
+        cur.execute("SHOW GLOBAL STATUS LIKE 'Questions'")
+        return int(cur.fetchone()[1])
+
+    def now(self, cur):
+        cur.execute("SELECT CURRENT_TIMESTAMP(6)")
+        return cur.fetchone()[0]
+
+
+_DIALECTS = {"mysql": MySQLDialect(), "sqlite": db_sqlite.SQLiteDialect()}
+
+
+def dialect():
+    return _DIALECTS["sqlite" if is_sqlite() else "mysql"]
+
+
+def connect(host=None, port=None, timeout=None):
+    """Connect to the primary, or to another server (a replica) with the same credentials."""
+    if is_sqlite():
+        return db_sqlite.connect()
+    extra = {"connection_timeout": timeout} if timeout else {}
+    return mysql.connector.connect(
+        host=host or os.getenv("MYSQL_HOST"),
+        user=os.getenv("MYSQL_USER"),
+        password=os.getenv("MYSQL_PASSWORD"),
+        database=os.getenv("MYSQL_DB"),
+        port=port or os.getenv("MYSQL_PORT"),
+        **extra
+    )
+
+
+class PooledConnection:
+    """Wraps a raw connection so that close() returns it to the pool."""
+
+    def __init__(self, pool, raw, created_at):
+        self._pool = pool
+        self._raw = raw
+        self.created_at = created_at
+        self.last_used = time.monotonic()
+        self.closed = False
+
+    def cursor(self, *args, **kwargs):
+        return InstrumentedCursor(self._raw.cursor(*args, **kwargs))
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self._pool.release(self)
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+
+class ConnectionPool:
+    """Bounded pool of database connections shared by a worker's threads."""
+
+    def __init__(self, connect, size=5, timeout=10.0, recycle=1800.0, ping_after=30.0):
+        self._connect = connect
+        self.size = size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.ping_after = ping_after
+        self._idle = []
+        self._cond = threading.Condition()
+        self._open = 0
+        self._in_use = 0
+        self._waiting = 0
+        self._created = 0
+        self._recycled = 0
+        self._timeouts = 0
+
+    def acquire(self):
+        deadline = time.monotonic() + self.timeout
+        with self._cond:
+            while True:
+                if self._idle:
+                    conn = self._idle.pop()
+                    self._in_use += 1
+                    break
+                if self._open < self.size:
+                    # Reserve the slot now, connect outside the lock.
+                    self._open += 1
+                    self._in_use += 1
+                    conn = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeout(
+                        f"No database connection available after {self.timeout:g}s"
+                    )
+                self._waiting += 1
+                try:
+                    self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+
+        try:
+            if conn is not None and not self._healthy(conn):
+                self._discard(conn._raw, count_recycle=True)
+                conn = None
+            if conn is None:
+                conn = self._new_connection()
+        except Exception:
+            with self._cond:
+                self._open -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+        return conn
+
+    def release(self, conn):
+        raw = conn._raw
+        reusable = True
+        try:
+            if raw.unread_result:
+                reusable = False
+            elif raw.in_transaction:
+                raw.rollback()
+        except Exception:
+            reusable = False
+
+        with self._cond:
+            self._in_use -= 1
+            if reusable:
+                self._idle.append(PooledConnection(self, raw, conn.created_at))
+            else:
+                self._open -= 1
+            self._cond.notify()
+
+        if not reusable:
+            self._close_quietly(raw)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "size": self.size,
+                "open": self._open,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "waiting": self._waiting,
+                "created": self._created,
+                "recycled": self._recycled,
+                "timeouts": self._timeouts,
+            }
+
+    def _new_connection(self):
+        raw = self._connect()
+        with self._cond:
+            self._created += 1
+        return PooledConnection(self, raw, time.monotonic())
+
+    def _healthy(self, conn):
+        now = time.monotonic()
+        if self.recycle and now - conn.created_at > self.recycle:
+            return False
+        if now - conn.last_used < self.ping_after:
+            return True
+        try:
+            conn._raw.ping(reconnect=False)
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, raw, count_recycle=False):
+        if count_recycle:
+            with self._cond:
+                self._recycled += 1
+        self._close_quietly(raw)
+
+    @staticmethod
+    def _close_quietly(raw):
+        try:
+            raw.close()
+        except Exception:
+            pass
+
+
+_pool = None
+_pool_pid = None
+_background_pool = None
+_background_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def _create_pool(size):
+    return ConnectionPool(
+        connect,
+        size=size,
+        timeout=_env_float("DB_POOL_TIMEOUT", 10.0),
+        recycle=_env_float("DB_POOL_RECYCLE", 1800.0),
+        ping_after=_env_float("DB_POOL_PING_AFTER", 30.0),
+    )
+
+
+def get_pool():
+    """Return this process's pool, creating it after a fork if needed."""
+    global _pool, _pool_pid
+    pid = os.getpid()
+    if _pool is None or _pool_pid != pid:
+        with _pool_lock:
+            if _pool is None or _pool_pid != pid:
+                if is_sqlite():
+                    _pool = db_sqlite.create_pool()
+                else:
+                    _pool = _create_pool(_env_int("DB_POOL_SIZE", 5))
+                _pool_pid = pid
+    return _pool
+
+
+def get_background_pool():
+    """This process's pool for background threads (the request pool on SQLite)."""
+    global _background_pool, _background_pool_pid
+    if is_sqlite():
+        return get_pool()
+    pid = os.getpid()
+    if _background_pool is None or _background_pool_pid != pid:
+        with _pool_lock:
+            if _background_pool is None or _background_pool_pid != pid:
+                _background_pool = _create_pool(_env_int("DB_BACKGROUND_POOL_SIZE", 4))
+                _background_pool_pid = pid
+    return _background_pool
+
+
+def insert_many(cur, table, columns, rows, chunk_size=1000, update=()):
+    """Insert rows with multi-row INSERT statements of up to chunk_size rows.
+
+    Columns listed in `update` are overwritten when a row hits an existing
+    unique key instead of failing (an upsert).
+    """
+    placeholder = "(" + ", ".join(["%s"] * len(columns)) + ")"
+    prefix = f"INSERT INTO {table} ({', '.join(columns)}) VALUES "
+    suffix = ""
+    if update:
+        suffix = " ON DUPLICATE KEY UPDATE " + ", ".join(f"{col}=VALUES({col})" for col in update)
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        params = [value for row in chunk for value in row]
+        cur.execute(prefix + ", ".join([placeholder] * len(chunk)) + suffix, params)
@@ -0,0 +1,311 @@
+"""
+StockFlow SQLite Backend
+------------------------
+Embedded storage for single-node deployments, selected with DB_BACKEND=sqlite.
+
+The rest of the app writes MySQL-flavoured SQL against mysql.connector-style
+connections. SQLiteConnection accepts the same calls and rewrites each
+statement on the way in:
+
+    %s placeholders              -> ?
+    ON DUPLICATE KEY UPDATE      -> ON CONFLICT DO UPDATE SET
+    VALUES(col) in an upsert     -> excluded.col
+    LEAST(...) / GREATEST(...)   -> MIN(...) / MAX(...)
+    SELECT ... FOR UPDATE        -> plain SELECT inside BEGIN IMMEDIATE
+
+Statements that need something other than a rewrite (advisory locks,
+the clock) go through SQLiteDialect instead; see db.dialect().
+
+Every thread keeps one connection open for its whole life. WAL lets readers
+run next to the single writer, and write transactions start with BEGIN
+IMMEDIATE so a read-modify-write never trips over another writer's commit
+halfway through. Reads outside a transaction run in autocommit mode.
+"""
+
+import os
+import re
+import sqlite3
+import threading
+import weakref
+from datetime import datetime
+from decimal import Decimal
+from functools import lru_cache
+
+from metrics import InstrumentedCursor
+
+SCHEMA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schema_sqlite.sql')
+
+# Upserts without a conflict target need SQLite 3.35.
+MIN_VERSION = (3, 35, 0)
+
+sqlite3.register_adapter(Decimal, str)
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(" ", "milliseconds"))
+sqlite3.register_converter("TIMESTAMP", lambda raw: datetime.fromisoformat(raw.decode()))
+sqlite3.register_converter("DECIMAL", lambda raw: Decimal(raw.decode()))
+
+_PLACEHOLDER = re.compile(r"%([s%])")
+_FOR_UPDATE = re.compile(r"\s+FOR\s+UPDATE\b", re.IGNORECASE)
+_UPSERT = re.compile(r"\bON\s+DUPLICATE\s+KEY\s+UPDATE\b", re.IGNORECASE)
+_NEW_VALUE = re.compile(r"\bVALUES\((\w+)\)", re.IGNORECASE)
+_LEAST = re.compile(r"\bLEAST\(", re.IGNORECASE)
+_GREATEST = re.compile(r"\bGREATEST\(", re.IGNORECASE)
+_WRITE = re.compile(r"^\s*(INSERT|UPDATE|DELETE|REPLACE)\b", re.IGNORECASE)
+
+
+@lru_cache(maxsize=2048)
+def translate(sql):
+    """Rewrite one MySQL statement for SQLite. Returns (sql, starts_write)."""
+    locking = _FOR_UPDATE.search(sql) is not None
+    sql = _FOR_UPDATE.sub("", sql)
+    sql = _PLACEHOLDER.sub(lambda m: "?" if m.group(1) == "s" else "%", sql)
+    if _UPSERT.search(sql):
+        sql = _UPSERT.sub("ON CONFLICT DO UPDATE SET", sql)
+        sql = _NEW_VALUE.sub(r"excluded.\1", sql)
+    sql = _LEAST.sub("MIN(", sql)
+    sql = _GREATEST.sub("MAX(", sql)
+    return sql, locking or _WRITE.match(sql) is not None
+
+
+def _env_int(name, default):
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+class SQLiteCursor:
+    """mysql.connector-style cursor over a sqlite3 cursor."""
+
+    def __init__(self, conn, dictionary=False):
+        self._conn = conn
+        self._cur = conn._raw.cursor()
+        self._dictionary = dictionary
+
+    def execute(self, sql, params=None):
+        sql, writes = translate(sql)
+        if writes:
+            self._conn._begin()
+        self._cur.execute(sql, tuple(params or ()))
+
+    def executemany(self, sql, seq_params):
+        sql, writes = translate(sql)
+        if writes:
+            self._conn._begin()
+        self._cur.executemany(sql, [tuple(p) for p in seq_params])
+
+    def _row(self, row):
+        if row is None or not self._dictionary:
+            return row
+        return dict(zip([col[0] for col in self._cur.description], row))
+
+    def fetchone(self):
+        return self._row(self._cur.fetchone())
+
+    def fetchmany(self, size=1):
+        return [self._row(row) for row in self._cur.fetchmany(size)]
+
+    def fetchall(self):
+        if self._cur.description is None:
+            return []
+        return [self._row(row) for row in self._cur.fetchall()]
+
+    def __iter__(self):
+        return (self._row(row) for row in self._cur)
+
+    @property
+    def description(self):
+        return self._cur.description
+
+    @property
+    def rowcount(self):
+        return self._cur.rowcount
+
+    @property
+    def lastrowid(self):
+        return self._cur.lastrowid
+
+    def close(self):
+        self._cur.close()
+
+
+class SQLiteConnection:
+    """One sqlite3 connection with the pragmas and API the app expects."""
+
+    unread_result = False
+
+    def __init__(self, path):
+        if sqlite3.sqlite_version_info < MIN_VERSION:
+            raise RuntimeError(
+                f"SQLite {sqlite3.sqlite_version} is too old, StockFlow needs "
+                + ".".join(map(str, MIN_VERSION))
+            )
+        busy_ms = _env_int("SQLITE_BUSY_TIMEOUT", 5000)
+        self._raw = sqlite3.connect(
+            path,
+            timeout=busy_ms / 1000.0,
+            isolation_level=None,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+        )
+        for pragma in (
+            "journal_mode = WAL",
+            "synchronous = NORMAL",
+            "foreign_keys = ON",
+            f"busy_timeout = {busy_ms}",
+            f"cache_size = -{_env_int('SQLITE_CACHE_KB', 65536)}",
+            "temp_store = MEMORY",
+            f"mmap_size = {_env_int('SQLITE_MMAP_SIZE', 268435456)}",
+        ):
+            self._raw.execute(f"PRAGMA {pragma}")
+
+    def cursor(self, dictionary=False, buffered=None, **_):
+        # sqlite3 cursors step lazily, so buffered/unbuffered is the same thing.
+        return SQLiteCursor(self, dictionary=dictionary)
+
+    def _begin(self):
+        if not self._raw.in_transaction:
+            self._raw.execute("BEGIN IMMEDIATE")
+
+    @property
+    def in_transaction(self):
+        return self._raw.in_transaction
+
+    def commit(self):
+        self._raw.commit()
+
+    def rollback(self):
+        self._raw.rollback()
+
+    def ping(self, reconnect=False):
+        self._raw.execute("SELECT 1")
+
+    def close(self):
+        self._raw.close()
+
+
+class ThreadConnection:
+    """A borrowed handle on the calling thread's connection.
+
+    close() ends any transaction the borrower left open but keeps the
+    connection itself for the thread's next request.
+    """
+
+    def __init__(self, conn):
+        self._raw = conn
+        self.closed = False
+
+    def cursor(self, *args, **kwargs):
+        return InstrumentedCursor(self._raw.cursor(*args, **kwargs))
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            if self._raw.in_transaction:
+                self._raw.rollback()
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+
+class ThreadConnections:
+    """Per-thread SQLite connections, with the same acquire()/stats() as ConnectionPool."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._open = weakref.WeakSet()
+        self._lock = threading.Lock()
+        self._created = 0
+
+    def acquire(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = SQLiteConnection(self.path)
+            self._local.conn = conn
+            with self._lock:
+                self._open.add(conn)
+                self._created += 1
+        return ThreadConnection(conn)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": "sqlite",
+                "path": self.path,
+                "open": len(self._open),
+                "created": self._created,
+            }
+
+
+class SQLiteDialect:
+    """Backend-specific statements that can't be expressed as a rewrite."""
+
+    name = "sqlite"
+
+    def try_lock(self, cur, name):
+        # One node, and every job that takes a lock is safe to run twice.
+        return True
+
+    def release_lock(self, cur, name):
+        pass
+
+    def query_count(self, cur):
+        return None
+
+    def now(self, cur):
+        cur.execute("SELECT strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime')")
+        return datetime.fromisoformat(cur.fetchone()[0])
+
+
+_schema_ready = set()
+_schema_lock = threading.Lock()
+
+# Columns added after a table's first release, with an optional backfill.
+# SQLite cannot add a column with a non-constant default, so updated_at
+# starts NULL and the schema's insert triggers fill it in for new rows.
+COLUMN_MIGRATIONS = [
+    (table, "updated_at", f"ALTER TABLE {table} ADD COLUMN updated_at TIMESTAMP",
+     f"UPDATE {table} SET updated_at = created_at")
+    for table in ("folders", "fields", "products", "field_values")
+] + [
+    (table, "deleted_at", f"ALTER TABLE {table} ADD COLUMN deleted_at TIMESTAMP NULL", None)
+    for table in ("folders", "fields")
+]
+
+
+def _migrate(raw):
+    for table, column, ddl, backfill in COLUMN_MIGRATIONS:
+        columns = [row[1] for row in raw.execute(f"PRAGMA table_info({table})")]
+        if columns and column not in columns:
+            raw.execute(ddl)
+            if backfill:
+                raw.execute(backfill)
+
+
+def ensure_schema(path):
+    """Create the tables in schema_sqlite.sql once per process and file,
+    after adding any columns an older file is missing."""
+    with _schema_lock:
+        if path in _schema_ready:
+            return
+        conn = SQLiteConnection(path)
+        try:
+            _migrate(conn._raw)
+            with open(SCHEMA_FILE, 'r') as f:
+                conn._raw.executescript(f.read())
+        finally:
+            conn.close()
+        _schema_ready.add(path)
+
+
+def sqlite_path():
+    return os.getenv("SQLITE_PATH", "stockflow.db")
+
+
+def connect():
+    path = sqlite_path()
+    ensure_schema(path)
+    return SQLiteConnection(path)
+
+
+def create_pool():
+    path = sqlite_path()
+    ensure_schema(path)
+    return ThreadConnections(path)
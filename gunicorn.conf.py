@@ -0,0 +1,16 @@
+"""
+Gunicorn settings, picked up automatically by `gunicorn server:app`.
+
+Threaded workers let one worker keep serving API calls while another of its
+threads waits on bcrypt (which releases the GIL) or on the database. Keep
+DB_POOL_SIZE above GUNICORN_THREADS; the sizing rule is in the connection pool
+section of docs/SETUP.md.
+"""
+
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", 2))
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", 4))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 120))
@@ -0,0 +1,169 @@
+"""
+StockFlow Metric History
+------------------------
+Keeps number-field changes over time so the analytics can chart trends.
+
+Every change that goes through a ChangeSet is appended to `metric_history`
+(product, field, old and new value) in the same transaction. The same write
+folds it into `metric_rollups`, one row per field and hour and per field and
+day, holding:
+
+    delta_sum   net change of the folder's total for the metric in the bucket
+    changes     number of value changes
+    total_min   lowest folder total seen at the end of a write in the bucket
+    total_max   highest such total
+    total_last  the folder total after the bucket's last write
+
+Totals come from metric_aggregates, which the same transaction has just
+updated (and row-locked), so total_last follows commit order. GET
+/analytics/history reads the rollups only. A bucket with no writes has no
+row; its total is the previous bucket's total_last.
+
+Retention (applied by the retention sweeper): raw history is kept for
+METRIC_HISTORY_DAYS and hourly rollups for METRIC_HOURLY_DAYS. Daily rollups
+are kept indefinitely; they already hold everything the raw rows did.
+"""
+
+import os
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from db import insert_many
+from retention import register as register_retention
+
+HISTORY_RETENTION = timedelta(days=int(os.getenv("METRIC_HISTORY_DAYS", 30)))
+HOURLY_RETENTION = timedelta(days=int(os.getenv("METRIC_HOURLY_DAYS", 90)))
+HISTORY_MAX_BUCKETS = int(os.getenv("METRIC_HISTORY_MAX_BUCKETS", 1000))
+
+register_retention("metric_history", "recorded_at", HISTORY_RETENTION)
+register_retention("metric_rollups", "bucket_start", HOURLY_RETENTION, "grain = 'hour'")
+
+GRAINS = {"hour": timedelta(hours=1), "day": timedelta(days=1)}
+DEFAULT_SPAN = {"hour": timedelta(hours=48), "day": timedelta(days=30)}
+
+
+class HistoryError(ValueError):
+    """A bad history query parameter; the message is reported back."""
+
+
+def bucket_start(moment, grain):
+    if grain == "hour":
+        return moment.replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def record_history(db, entries):
+    """Append value changes and fold them into the rollups.
+
+    `entries` are (field_id, folder_id, product_id, old, new) with Decimal or
+    None values. Must run after apply_metric_changes(), in the same
+    transaction.
+    """
+    if not entries:
+        return
+    now = datetime.now()
+    cur = db.cursor()
+    insert_many(cur, "metric_history",
+                ("field_id", "folder_id", "product_id", "old_value", "new_value", "recorded_at"),
+                [entry + (now,) for entry in entries])
+
+    deltas = {}
+    for field_id, folder_id, _, old, new in entries:
+        folder, delta, count = deltas.get(field_id, (folder_id, Decimal(0), 0))
+        deltas[field_id] = (folder, delta + (new or 0) - (old or 0), count + 1)
+    field_ids = sorted(deltas)
+    cur.execute(
+        "SELECT field_id, value_sum FROM metric_aggregates WHERE field_id IN ("
+        + ", ".join(["%s"] * len(field_ids)) + ")",
+        field_ids
+    )
+    totals = dict(cur.fetchall())
+
+    rows = []
+    for grain in GRAINS:
+        start = bucket_start(now, grain)
+        for field_id in field_ids:
+            folder_id, delta, count = deltas[field_id]
+            total = totals.get(field_id, Decimal(0))
+            rows.append((grain, field_id, start, folder_id, delta, count, total, total, total))
+    cur.execute(
+        "INSERT INTO metric_rollups (grain, field_id, bucket_start, folder_id, delta_sum, changes, "
+        "total_min, total_max, total_last) VALUES "
+        + ", ".join(["(%s, %s, %s, %s, %s, %s, %s, %s, %s)"] * len(rows))
+        + """ ON DUPLICATE KEY UPDATE
+            delta_sum = delta_sum + VALUES(delta_sum),
+            changes = changes + VALUES(changes),
+            total_min = LEAST(total_min, VALUES(total_min)),
+            total_max = GREATEST(total_max, VALUES(total_max)),
+            total_last = VALUES(total_last)""",
+        [p for row in rows for p in row]
+    )
+    cur.close()
+
+
+def _parse_time(raw, name):
+    """An ISO date or datetime as naive local time, the way rows are stamped."""
+    try:
+        moment = datetime.fromisoformat(raw)
+    except ValueError:
+        raise HistoryError(f"{name} must be an ISO date or datetime")
+    if moment.tzinfo is not None:
+        moment = moment.astimezone().replace(tzinfo=None)
+    return moment
+
+
+def history_series(cur, metric, args, folder_id=None):
+    """Rollup series for one metric between ?from= and ?to= at ?grain=hour|day.
+
+    One series per number field with that name (one per folder unless a
+    folder repeats the name). `cur` must be a dictionary cursor.
+    """
+    grain = args.get('grain') or 'day'
+    if grain not in GRAINS:
+        raise HistoryError("grain must be hour or day")
+    end = _parse_time(args['to'], 'to') if args.get('to') else datetime.now()
+    start = _parse_time(args['from'], 'from') if args.get('from') else end - DEFAULT_SPAN[grain]
+    if start >= end:
+        raise HistoryError("from must be before to")
+    if (end - start) / GRAINS[grain] > HISTORY_MAX_BUCKETS:
+        raise HistoryError(f"At most {HISTORY_MAX_BUCKETS} {grain}s per request")
+
+    where = ["r.grain = %s", "fl.name = %s", "fl.field_type = 'number'", "fl.deleted_at IS NULL",
+             "r.bucket_start >= %s", "r.bucket_start < %s"]
+    params = [grain, metric, bucket_start(start, grain), end]
+    if folder_id is not None:
+        where.append("r.folder_id = %s")
+        params.append(folder_id)
+    cur.execute(f"""
+        SELECT r.field_id, r.folder_id, fo.name AS folder, r.bucket_start, r.delta_sum, r.changes,
+               r.total_min, r.total_max, r.total_last
+        FROM metric_rollups r
+        JOIN fields fl ON fl.id = r.field_id
+        JOIN folders fo ON fo.id = r.folder_id
+        WHERE {' AND '.join(where)}
+        ORDER BY r.folder_id, r.field_id, r.bucket_start
+    """, params)
+
+    series = {}
+    for row in cur.fetchall():
+        entry = series.get(row['field_id'])
+        if entry is None:
+            entry = series[row['field_id']] = {
+                "field_id": row['field_id'], "folder_id": row['folder_id'],
+                "folder": row['folder'], "points": []
+            }
+        entry['points'].append({
+            "start": row['bucket_start'].isoformat(),
+            "sum": float(row['delta_sum']),
+            "changes": row['changes'],
+            "min": float(row['total_min']),
+            "max": float(row['total_max']),
+            "last": float(row['total_last']),
+        })
+    return {
+        "metric": metric,
+        "grain": grain,
+        "from": start.isoformat(),
+        "to": end.isoformat(),
+        "series": list(series.values()),
+    }
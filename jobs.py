@@ -0,0 +1,333 @@
+"""
+StockFlow Background Jobs
+-------------------------
+Deleting a folder or field hides it at once and leaves the rows underneath
+to a background job, which removes them in small transactions instead of one
+huge ON DELETE CASCADE.
+
+Jobs live in the `jobs` table, so any worker can pick them up. A JobRunner
+thread in each worker claims one job at a time, runs it chunk by chunk and
+records progress and a heartbeat with every chunk. Each chunk borrows a
+connection from the background pool and returns it before the pause, so a
+long job never holds one for its whole run. Chunks are idempotent,
+so a job whose worker died (heartbeat older than JOB_STALE_SECONDS) is simply
+claimed again and carries on where it stopped. A runner that finds its job
+claimed by someone else drops it. A job that raises is queued again, and
+marked failed after JOB_MAX_ATTEMPTS tries.
+
+Hidden folders and fields carry a `deleted_at` and are filtered out of every
+read; hiding a folder also hides its fields. Finished jobs are kept for
+JOB_RETENTION_DAYS, failed ones until they are deleted by hand.
+"""
+
+import logging
+import os
+import random
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+
+from alerts import resolve_alerts
+from db import get_background_pool
+from retention import register as register_retention
+from sync import tombstone_folder, tombstone_field, tombstone_products
+from versions import FOLDERS, folder_scope, bump_versions
+
+log = logging.getLogger("stockflow.jobs")
+
+
+def _env_float(name, default):
+    value = os.getenv(name)
+    return float(value) if value else default
+
+
+JOB_POLL_INTERVAL = _env_float("JOB_POLL_INTERVAL", 5.0)
+JOB_STALE_SECONDS = _env_float("JOB_STALE_SECONDS", 60.0)
+JOB_BATCH_SIZE = int(_env_float("JOB_BATCH_SIZE", 500))
+JOB_PAUSE = _env_float("JOB_PAUSE", 0.05)
+JOB_MAX_ATTEMPTS = int(_env_float("JOB_MAX_ATTEMPTS", 3))
+JOB_RETENTION = timedelta(days=_env_float("JOB_RETENTION_DAYS", 7))
+
+register_retention("jobs", "finished_at", JOB_RETENTION, "status = 'done'")
+
+JOB_FIELDS = ("id", "kind", "target_id", "status", "rows_deleted", "attempts",
+              "error", "created_at", "heartbeat_at", "finished_at")
+
+
+class JobLost(Exception):
+    """Another runner took the job over (ours stalled past JOB_STALE_SECONDS)."""
+
+
+# --- HIDING ---
+def hide_folder(db, folder_id):
+    """Hide a folder and its fields and queue the job that deletes them.
+
+    Runs in the caller's transaction. Returns the job id, or None if the
+    folder does not exist or is already being deleted.
+    """
+    cur = db.cursor()
+    now = datetime.now()
+    cur.execute("UPDATE folders SET deleted_at = %s WHERE id = %s AND deleted_at IS NULL", (now, folder_id))
+    if cur.rowcount == 0:
+        cur.close()
+        return None
+    tombstone_folder(cur, folder_id)
+    cur.execute("UPDATE fields SET deleted_at = %s WHERE folder_id = %s AND deleted_at IS NULL", (now, folder_id))
+    resolve_alerts(cur, "folder_id = %s", (folder_id,))
+    job_id = _enqueue(cur, "delete_folder", folder_id)
+    bump_versions(db, FOLDERS, folder_scope(folder_id))
+    cur.close()
+    return job_id
+
+
+def hide_field(db, field_id):
+    """Hide a field and queue the job that deletes its values. Same contract as hide_folder."""
+    cur = db.cursor()
+    cur.execute("SELECT folder_id FROM fields WHERE id = %s AND deleted_at IS NULL", (field_id,))
+    row = cur.fetchone()
+    if row is None:
+        cur.close()
+        return None
+    tombstone_field(cur, field_id)
+    cur.execute("UPDATE fields SET deleted_at = %s WHERE id = %s", (datetime.now(), field_id))
+    resolve_alerts(cur, "field_id = %s", (field_id,))
+    job_id = _enqueue(cur, "delete_field", field_id)
+    bump_versions(db, folder_scope(row[0]))
+    cur.close()
+    return job_id
+
+
+def _enqueue(cur, kind, target_id):
+    cur.execute("INSERT INTO jobs (kind, target_id) VALUES (%s, %s)", (kind, target_id))
+    return cur.lastrowid
+
+
+def get_job(db, job_id):
+    cur = db.cursor(dictionary=True)
+    cur.execute(f"SELECT {', '.join(JOB_FIELDS)} FROM jobs WHERE id = %s", (job_id,))
+    job = cur.fetchone()
+    cur.close()
+    return job
+
+
+# --- JOB KINDS ---
+# Each step deletes one batch and returns how many rows it removed, or None
+# once nothing is left. It runs inside the runner's transaction.
+def _delete_folder_step(cur, folder_id, batch_size):
+    cur.execute("SELECT id FROM products WHERE folder_id = %s ORDER BY id LIMIT %s", (folder_id, batch_size))
+    ids = [row[0] for row in cur.fetchall()]
+    if ids:
+        marks = ", ".join(["%s"] * len(ids))
+        tombstone_products(cur, ids)
+        cur.execute(f"DELETE FROM field_values WHERE product_id IN ({marks})", ids)
+        values = cur.rowcount
+        cur.execute(f"DELETE FROM products WHERE id IN ({marks})", ids)
+        return values + cur.rowcount
+    # Only the fields (already emptied along with the products) and the folder remain.
+    cur.execute("DELETE FROM folders WHERE id = %s", (folder_id,))
+    return None
+
+
+def _delete_field_step(cur, field_id, batch_size):
+    cur.execute("SELECT id, product_id FROM field_values WHERE field_id = %s ORDER BY id LIMIT %s",
+                (field_id, batch_size))
+    rows = cur.fetchall()
+    if rows:
+        ids = [row[0] for row in rows]
+        product_ids = sorted({row[1] for row in rows})
+        cur.execute(
+            f"DELETE FROM search_postings WHERE field_id = %s AND product_id IN ({', '.join(['%s'] * len(product_ids))})",
+            [field_id] + product_ids
+        )
+        cur.execute(f"DELETE FROM field_values WHERE id IN ({', '.join(['%s'] * len(ids))})", ids)
+        return cur.rowcount
+    cur.execute("DELETE FROM fields WHERE id = %s", (field_id,))
+    return None
+
+
+STEPS = {
+    "delete_folder": _delete_folder_step,
+    "delete_field": _delete_field_step,
+}
+
+
+# --- RUNNER ---
+class JobRunner:
+    """Claims queued or abandoned jobs and runs them one chunk per transaction."""
+
+    def __init__(self, acquire, interval=5.0, stale_after=60.0, batch_size=500, pause=0.05,
+                 max_attempts=3):
+        self._acquire = acquire
+        self.interval = interval
+        self.stale_after = timedelta(seconds=stale_after)
+        self.batch_size = batch_size
+        self.pause = pause
+        self.max_attempts = max_attempts
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._wake = threading.Event()
+        self._thread = None
+        self._thread_pid = None
+        self._lock = threading.Lock()
+        self.completed = 0
+        self.failed = 0
+        self.lost = 0
+        self.rows_deleted = 0
+        self.last_error = None
+
+    def ensure_started(self):
+        """Start this process's runner thread (once per worker, after fork)."""
+        if not self.interval:
+            return
+        pid = os.getpid()
+        if self._thread_pid == pid:
+            return
+        with self._lock:
+            if self._thread_pid == pid:
+                return
+            self.owner = f"{socket.gethostname()}:{pid}"
+            self._thread = threading.Thread(target=self._loop, name="job-runner", daemon=True)
+            self._thread_pid = pid
+            self._thread.start()
+
+    def wake(self):
+        """Look for work now rather than at the next poll (call after committing a job)."""
+        self._wake.set()
+
+    def _loop(self):
+        while True:
+            try:
+                while self.run_once():
+                    pass
+            except Exception as err:
+                self.last_error = str(err)
+                log.warning("Job runner failed: %s", err)
+            # Jitter so workers started together don't all poll at once.
+            self._wake.wait(self.interval * random.uniform(0.5, 1.0))
+            self._wake.clear()
+
+    def run_once(self):
+        """Claim and run one job to completion. Returns False if there was none."""
+        conn = self._acquire()
+        cur = conn.cursor()
+        try:
+            job = self._claim(conn, cur)
+        finally:
+            cur.close()
+            conn.close()
+        if job is None:
+            return False
+        self._run(*job)
+        return True
+
+    def _claim(self, conn, cur):
+        now = datetime.now()
+        stale = now - self.stale_after
+        cur.execute("""
+            SELECT id, kind, target_id, attempts FROM jobs
+            WHERE status = 'pending' OR (status = 'running' AND heartbeat_at < %s)
+            ORDER BY id LIMIT 1
+        """, (stale,))
+        row = cur.fetchone()
+        if row is None:
+            return None
+        cur.execute("""
+            UPDATE jobs SET status = 'running', owner = %s, heartbeat_at = %s, attempts = attempts + 1
+            WHERE id = %s AND (status = 'pending' OR (status = 'running' AND heartbeat_at < %s))
+        """, (self.owner, now, row[0], stale))
+        conn.commit()
+        # Someone else claimed it between the two statements; try again next round.
+        return row[:3] + (row[3] + 1,) if cur.rowcount == 1 else None
+
+    def _run(self, job_id, kind, target_id, attempt):
+        step = STEPS.get(kind)
+        try:
+            if step is None:
+                raise ValueError(f"Unknown job kind {kind!r}")
+            while True:
+                removed = self._run_chunk(job_id, step, target_id)
+                if removed is None:
+                    self.completed += 1
+                    return
+                self.rows_deleted += removed
+                time.sleep(self.pause)
+        except JobLost:
+            self.lost += 1
+        except Exception as err:
+            self.failed += 1
+            self.last_error = str(err)
+            log.warning("Job %s (%s %s) attempt %s failed: %s", job_id, kind, target_id, attempt, err)
+            self._record_failure(job_id, err, attempt)
+
+    def _run_chunk(self, job_id, step, target_id):
+        """One step and its progress update in one transaction, on a borrowed connection."""
+        conn = self._acquire()
+        cur = conn.cursor()
+        try:
+            self._check_owner(cur, job_id)
+            removed = step(cur, target_id, self.batch_size)
+            if removed is None:
+                cur.execute(
+                    "UPDATE jobs SET status = 'done', finished_at = %s WHERE id = %s",
+                    (datetime.now(), job_id)
+                )
+            else:
+                cur.execute(
+                    "UPDATE jobs SET heartbeat_at = %s, rows_deleted = rows_deleted + %s WHERE id = %s",
+                    (datetime.now(), removed, job_id)
+                )
+            conn.commit()
+            return removed
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+            conn.close()
+
+    def _record_failure(self, job_id, err, attempt):
+        conn = self._acquire()
+        cur = conn.cursor()
+        try:
+            if attempt < self.max_attempts:
+                cur.execute(
+                    "UPDATE jobs SET status = 'pending', error = %s WHERE id = %s AND owner = %s",
+                    (str(err)[:1000], job_id, self.owner)
+                )
+            else:
+                cur.execute(
+                    "UPDATE jobs SET status = 'failed', error = %s, finished_at = %s WHERE id = %s AND owner = %s",
+                    (str(err)[:1000], datetime.now(), job_id, self.owner)
+                )
+            conn.commit()
+        finally:
+            cur.close()
+            conn.close()
+
+    def _check_owner(self, cur, job_id):
+        # Locks the job row for the chunk, so a runner that lost the job
+        # can't commit a chunk after the new owner has started.
+        cur.execute("SELECT owner, status FROM jobs WHERE id = %s FOR UPDATE", (job_id,))
+        row = cur.fetchone()
+        if row is None or row[0] != self.owner or row[1] != 'running':
+            raise JobLost(job_id)
+
+    def stats(self):
+        return {
+            "owner": self.owner,
+            "completed": self.completed,
+            "failed": self.failed,
+            "lost": self.lost,
+            "rows_deleted": self.rows_deleted,
+            "last_error": self.last_error,
+        }
+
+
+runner = JobRunner(
+    lambda: get_background_pool().acquire(),
+    interval=JOB_POLL_INTERVAL,
+    stale_after=JOB_STALE_SECONDS,
+    batch_size=JOB_BATCH_SIZE,
+    pause=JOB_PAUSE,
+    max_attempts=JOB_MAX_ATTEMPTS,
+)
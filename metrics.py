@@ -0,0 +1,273 @@
+"""
+StockFlow Request Metrics
+-------------------------
+Cheap, always-on instrumentation for every request.
+
+Each request gets a RequestTimings on the serving thread. The database
+cursors (see InstrumentedCursor) add their query count and time to it, and
+server.py times pool checkouts, auth lookups and JSON serialisation. At the
+end of the request the totals go out as a Server-Timing header and into the
+per-worker Registry, which /metrics renders in the Prometheus text format.
+
+Queries slower than SLOW_QUERY_MS are logged with their SQL and parameters
+on the `stockflow.slow_query` logger. Statements on the credential tables
+(SENSITIVE_TABLES) log only the type and length of each parameter, so
+session tokens and password hashes stay out of the logs.
+
+The cost per query is two perf_counter() calls and a few additions; the
+registry takes one short lock per request.
+"""
+
+import logging
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+log = logging.getLogger("stockflow.slow_query")
+
+SLOW_QUERY_SECONDS = float(os.getenv("SLOW_QUERY_MS", 200)) / 1000.0
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PHASES = ("connect", "auth", "db", "serialize")
+
+# Tables whose bind parameters are secrets (tokens, password hashes).
+SENSITIVE_TABLES = ("admin_users", "sessions", "session_revocations")
+_SENSITIVE = re.compile(r"\b(?:%s)\b" % "|".join(SENSITIVE_TABLES), re.IGNORECASE)
+
+_local = threading.local()
+
+
+class RequestTimings:
+    """Phase totals (in seconds) for the request on this thread."""
+
+    __slots__ = ("route", "started", "queries", "connect", "auth", "db", "serialize")
+
+    def __init__(self, route):
+        self.route = route
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.connect = 0.0
+        self.auth = 0.0
+        self.db = 0.0
+        self.serialize = 0.0
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self, total):
+        parts = [f'db;dur={self.db * 1000:.2f};desc="{self.queries} queries"']
+        for phase in ("connect", "auth", "serialize"):
+            parts.append(f"{phase};dur={getattr(self, phase) * 1000:.2f}")
+        parts.append(f"total;dur={total * 1000:.2f}")
+        return ", ".join(parts)
+
+
+def begin_request(route):
+    _local.timings = RequestTimings(route)
+    return _local.timings
+
+
+def end_request():
+    return _local.__dict__.pop("timings", None)
+
+
+def current():
+    return getattr(_local, "timings", None)
+
+
+@contextmanager
+def timing(phase):
+    """Add the time spent in the block to the current request's `phase`."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings = current()
+        if timings is not None:
+            setattr(timings, phase, getattr(timings, phase) + time.perf_counter() - started)
+
+
+def _shorten(text, limit):
+    return text if len(text) <= limit else text[:limit] + "..."
+
+
+def _redact(params):
+    """Parameters with each value replaced by its type and length."""
+    if isinstance(params, (list, tuple)):
+        return [_redact(value) for value in params]
+    if isinstance(params, dict):
+        return {key: _redact(value) for key, value in params.items()}
+    if isinstance(params, (str, bytes)):
+        return f"<{type(params).__name__}:{len(params)}>"
+    return f"<{type(params).__name__}>"
+
+
+def format_params(sql, params):
+    """repr() of a statement's parameters for the slow-query log."""
+    if params is not None and _SENSITIVE.search(sql):
+        params = _redact(params)
+    return _shorten(repr(params), 500)
+
+
+def record_query(sql, params, elapsed):
+    timings = current()
+    if timings is not None:
+        timings.queries += 1
+        timings.db += elapsed
+    if elapsed >= SLOW_QUERY_SECONDS:
+        registry.slow_query()
+        log.warning(
+            "Slow query (%.1f ms) on %s: %s params=%s",
+            elapsed * 1000,
+            timings.route if timings is not None else "-",
+            _shorten(" ".join(sql.split()), 1000),
+            format_params(sql, params),
+        )
+
+
+class InstrumentedCursor:
+    """Wraps a DB-API cursor and reports its query and fetch time."""
+
+    __slots__ = ("_cur",)
+
+    def __init__(self, cur):
+        self._cur = cur
+
+    def execute(self, sql, params=None):
+        started = time.perf_counter()
+        try:
+            return self._cur.execute(sql, params)
+        finally:
+            record_query(sql, params, time.perf_counter() - started)
+
+    def executemany(self, sql, seq_params):
+        started = time.perf_counter()
+        try:
+            return self._cur.executemany(sql, seq_params)
+        finally:
+            record_query(sql, seq_params, time.perf_counter() - started)
+
+    # Unbuffered cursors do most of their waiting in the fetch calls.
+    def _fetch(self, fetch, *args):
+        started = time.perf_counter()
+        try:
+            return fetch(*args)
+        finally:
+            timings = current()
+            if timings is not None:
+                timings.db += time.perf_counter() - started
+
+    def fetchone(self):
+        return self._fetch(self._cur.fetchone)
+
+    def fetchmany(self, size=1):
+        return self._fetch(self._cur.fetchmany, size)
+
+    def fetchall(self):
+        return self._fetch(self._cur.fetchall)
+
+    def __iter__(self):
+        return iter(self._cur)
+
+    def __getattr__(self, name):
+        return getattr(self._cur, name)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    return ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items())
+
+
+class Registry:
+    """Per-worker request counters and latency histograms."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._requests = {}    # (method, route, status) -> count
+        self._latency = {}     # (method, route) -> [bucket counts..., +Inf count, sum]
+        self._phases = {}      # (method, route) -> {phase: seconds, "queries": n}
+        self._slow_queries = 0
+
+    def observe(self, method, route, status, elapsed, timings):
+        index = bisect_left(self.buckets, elapsed)
+        with self._lock:
+            key = (method, route, status)
+            self._requests[key] = self._requests.get(key, 0) + 1
+            histogram = self._latency.get((method, route))
+            if histogram is None:
+                histogram = self._latency[(method, route)] = [0] * (len(self.buckets) + 1) + [0.0]
+            histogram[index] += 1
+            histogram[-1] += elapsed
+            if timings is not None:
+                phases = self._phases.get((method, route))
+                if phases is None:
+                    phases = self._phases[(method, route)] = dict.fromkeys(PHASES + ("queries",), 0)
+                for phase in PHASES:
+                    phases[phase] += getattr(timings, phase)
+                phases["queries"] += timings.queries
+
+    def slow_query(self):
+        with self._lock:
+            self._slow_queries += 1
+
+    def render(self, gauges=None):
+        """The registry in the Prometheus text exposition format."""
+        with self._lock:
+            requests = dict(self._requests)
+            latency = {key: list(values) for key, values in self._latency.items()}
+            phases = {key: dict(values) for key, values in self._phases.items()}
+            slow_queries = self._slow_queries
+
+        lines = [
+            "# HELP stockflow_http_requests_total Requests served, by route and status.",
+            "# TYPE stockflow_http_requests_total counter",
+        ]
+        for (method, route, status), count in sorted(requests.items()):
+            lines.append(f"stockflow_http_requests_total{{{_labels(method=method, route=route, status=status)}}} {count}")
+
+        lines += [
+            "# HELP stockflow_http_request_duration_seconds Request latency, by route.",
+            "# TYPE stockflow_http_request_duration_seconds histogram",
+        ]
+        for (method, route), values in sorted(latency.items()):
+            labels = _labels(method=method, route=route)
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), values[:-1]):
+                cumulative += count
+                lines.append(f'stockflow_http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f"stockflow_http_request_duration_seconds_sum{{{labels}}} {values[-1]:.6f}")
+            lines.append(f"stockflow_http_request_duration_seconds_count{{{labels}}} {cumulative}")
+
+        lines += [
+            "# HELP stockflow_request_phase_seconds_total Time spent per request phase, by route.",
+            "# TYPE stockflow_request_phase_seconds_total counter",
+        ]
+        for (method, route), values in sorted(phases.items()):
+            for phase in PHASES:
+                lines.append(
+                    f"stockflow_request_phase_seconds_total{{{_labels(method=method, route=route, phase=phase)}}} {values[phase]:.6f}"
+                )
+        lines += [
+            "# HELP stockflow_db_queries_total Database queries issued, by route.",
+            "# TYPE stockflow_db_queries_total counter",
+        ]
+        for (method, route), values in sorted(phases.items()):
+            lines.append(f"stockflow_db_queries_total{{{_labels(method=method, route=route)}}} {values['queries']}")
+
+        lines += [
+            "# HELP stockflow_db_slow_queries_total Queries slower than SLOW_QUERY_MS.",
+            "# TYPE stockflow_db_slow_queries_total counter",
+            f"stockflow_db_slow_queries_total {slow_queries}",
+        ]
+        for name, (help_text, value) in sorted((gauges or {}).items()):
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
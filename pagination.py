@@ -0,0 +1,311 @@
+"""
+StockFlow Pagination
+--------------------
+Keyset (cursor) pagination, sorting and filtering for the list endpoints.
+
+A page is fetched with `WHERE (sort_key, id) > (last_key, last_id) ORDER BY
+sort_key, id LIMIT n`, so it costs the same on page 1000 as on page 1 as
+long as (sort_key, id) is an index. The position is handed to the client as
+an opaque `next_cursor`; the indexes behind each sort are listed in
+schema.sql.
+
+Query parameters (all optional):
+    limit=<n>             page size (capped at PAGE_MAX_LIMIT)
+    cursor=<token>        next_cursor from the previous page
+    sort=<key>            id, name, created_at or field:<id> (a number
+                          field); prefix with '-' for descending
+    prefix=<text>         name starts with text
+    field=<id>&min=&max=  number field value within [min, max]
+
+Without limit or cursor the endpoints return a plain list as before.
+Products with no value for a sorted number field come after all the others
+in either direction.
+"""
+
+import base64
+import json
+import os
+from datetime import datetime
+from decimal import Decimal
+
+from analytics import to_number
+
+PAGE_DEFAULT_LIMIT = int(os.getenv("PAGE_DEFAULT_LIMIT", 100))
+PAGE_MAX_LIMIT = int(os.getenv("PAGE_MAX_LIMIT", 500))
+
+
+class PageError(ValueError):
+    """A bad pagination, sort or filter parameter; the message is reported back."""
+
+
+def encode_cursor(sort, phase, key, row_id):
+    if isinstance(key, datetime):
+        key = key.isoformat(" ")
+    elif isinstance(key, Decimal):
+        key = str(key)
+    payload = json.dumps([sort, phase, key, row_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token, sort):
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        cursor_sort, phase, key, row_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        row_id = None if row_id is None else int(row_id)
+    except (ValueError, TypeError):
+        raise PageError("Invalid cursor")
+    if cursor_sort != sort:
+        raise PageError("Cursor was issued for a different sort")
+    return phase, key, row_id
+
+
+class PageRequest:
+    """Pagination, sort and filter parameters for one list request."""
+
+    def __init__(self, args, sorts=("id",), field_sort=False, prefix=False, ranges=False):
+        self.sort = args.get('sort') or 'id'
+        self.descending = self.sort.startswith('-')
+        key = self.sort.lstrip('-')
+        self.sort_field = None
+        if field_sort and key.startswith('field:'):
+            try:
+                self.sort_field = int(key[len('field:'):])
+            except ValueError:
+                raise PageError("sort=field:<id> needs a numeric field id")
+            self.column = 'num_value'
+        elif key in sorts:
+            self.column = key
+        else:
+            allowed = list(sorts) + (['field:<id>'] if field_sort else [])
+            raise PageError(f"sort must be one of {', '.join(allowed)} (prefix '-' for descending)")
+
+        token = args.get('cursor')
+        limit = args.get('limit')
+        self.paginated = bool(token) or bool(limit)
+        self.limit = None
+        if self.paginated:
+            try:
+                self.limit = int(limit) if limit else PAGE_DEFAULT_LIMIT
+            except ValueError:
+                raise PageError("limit must be an integer")
+            if self.limit < 1:
+                raise PageError("limit must be at least 1")
+            self.limit = min(self.limit, PAGE_MAX_LIMIT)
+        self.after = self._cursor_position(*decode_cursor(token, self.sort)) if token else None
+
+        self.prefix = (args.get('prefix') or None) if prefix else None
+        self.range_field = None
+        self.minimum = self.maximum = None
+        if ranges:
+            if args.get('field'):
+                try:
+                    self.range_field = int(args.get('field'))
+                except ValueError:
+                    raise PageError("field must be a field id")
+                self.minimum = self._number(args, 'min')
+                self.maximum = self._number(args, 'max')
+            elif args.get('min') or args.get('max'):
+                raise PageError("min/max need field=<id>")
+
+    def _cursor_position(self, phase, key, row_id):
+        """Check a decoded cursor against the sort and convert its key for the query.
+
+        Cursors are opaque but not signed, so anything that reaches the SQL
+        is checked here; a mismatch is PageError("Invalid cursor").
+        """
+        if self.sort_field is not None:
+            # "v": (num_value, field_values id); "n": products without a value, by id.
+            if phase == "v" and row_id is not None and isinstance(key, (str, int, float)):
+                key = to_number(key)
+                if key is not None:
+                    return phase, key, row_id
+            elif phase == "n" and key is None:
+                return phase, key, row_id
+            raise PageError("Invalid cursor")
+        if phase != "k" or row_id is None:
+            raise PageError("Invalid cursor")
+        if self.column == 'created_at':
+            try:
+                key = datetime.fromisoformat(key)
+            except (TypeError, ValueError):
+                raise PageError("Invalid cursor")
+            if key.tzinfo is not None:
+                raise PageError("Invalid cursor")
+        elif self.column == 'id':
+            if not isinstance(key, int) or isinstance(key, bool):
+                raise PageError("Invalid cursor")
+        elif not isinstance(key, str):
+            raise PageError("Invalid cursor")
+        return phase, key, row_id
+
+    @staticmethod
+    def _number(args, name):
+        raw = args.get(name)
+        if raw is None or raw == '':
+            return None
+        number = to_number(raw)
+        if number is None:
+            raise PageError(f"{name} must be a number")
+        return number
+
+    def next_cursor(self, phase, key, row_id):
+        return encode_cursor(self.sort, phase, key, row_id)
+
+
+def _order(desc):
+    return "DESC" if desc else "ASC"
+
+
+def _after_clause(key_column, id_column, desc, key, row_id):
+    op = "<" if desc else ">"
+    if key_column == id_column:
+        return f"{id_column} {op} %s", [row_id]
+    return f"({key_column}, {id_column}) {op} (%s, %s)", [key, row_id]
+
+
+def keyset_page(cur, select, where, params, page, alias=""):
+    """Run `select` with keyset ordering on page.column. Returns (rows, next_cursor)."""
+    id_column = f"{alias}id"
+    key_column = id_column if page.column == 'id' else f"{alias}{page.column}"
+    where, params = list(where), list(params)
+    if page.after is not None:
+        clause, extra = _after_clause(key_column, id_column, page.descending, page.after[1], page.after[2])
+        where.append(clause)
+        params += extra
+    sql = select
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    order = _order(page.descending)
+    sql += f" ORDER BY {id_column} {order}" if key_column == id_column else f" ORDER BY {key_column} {order}, {id_column} {order}"
+    if page.limit is not None:
+        sql += " LIMIT %s"
+        params.append(page.limit + 1)
+    cur.execute(sql, params)
+    rows = cur.fetchall()
+    if page.limit is None or len(rows) <= page.limit:
+        return rows, None
+    rows = rows[:page.limit]
+    last = rows[-1]
+    return rows, page.next_cursor("k", last[page.column], last['id'])
+
+
+def name_prefix_clause(column, prefix):
+    """A LIKE clause matching names that start with prefix (index-friendly)."""
+    if any(ch in prefix for ch in '%_!'):
+        escaped = prefix.replace('!', '!!').replace('%', '!%').replace('_', '!_')
+        return f"{column} LIKE %s ESCAPE '!'", escaped + '%'
+    return f"{column} LIKE %s", prefix + '%'
+
+
+def product_page(cur, folder_id, page, fields):
+    """One page of a folder's product rows. Returns (rows, next_cursor).
+
+    `fields` maps the folder's field ids to their rows; it is used to check
+    that sort and range fields are number fields of this folder.
+    """
+    for field_id in (page.sort_field, page.range_field):
+        if field_id is not None:
+            field = fields.get(field_id)
+            if field is None or field['field_type'] != 'number':
+                raise PageError(f"Field {field_id} is not a number field of this folder")
+
+    where, params = ["p.folder_id = %s"], [folder_id]
+    if page.prefix:
+        clause, pattern = name_prefix_clause("p.name", page.prefix)
+        where.append(clause)
+        params.append(pattern)
+    if page.range_field is not None and page.range_field != page.sort_field:
+        bounds, bound_params = _range_bounds("r.num_value", page)
+        where.append(
+            "EXISTS (SELECT 1 FROM field_values r WHERE r.product_id = p.id AND r.field_id = %s"
+            + "".join(f" AND {b}" for b in bounds) + " AND r.num_value IS NOT NULL)"
+        )
+        params += [page.range_field] + bound_params
+
+    if page.sort_field is None:
+        return keyset_page(cur, "SELECT p.* FROM products p", where, params, page, alias="p.")
+    return _field_sorted_page(cur, page, where, params)
+
+
+def _range_bounds(column, page):
+    bounds, params = [], []
+    if page.minimum is not None:
+        bounds.append(f"{column} >= %s")
+        params.append(page.minimum)
+    if page.maximum is not None:
+        bounds.append(f"{column} <= %s")
+        params.append(page.maximum)
+    return bounds, params
+
+
+def _field_sorted_page(cur, page, where, params):
+    """Products ordered by a number field's value, then those without one.
+
+    The first phase walks idx_field_num (field_id, num_value) and breaks ties
+    on the field_values id, which that index carries; the second walks the
+    products without a value in id order.
+    """
+    order = _order(page.descending)
+    phase, key, row_id = page.after if page.after else ("v", None, None)
+    rows = []
+    limit = page.limit
+
+    if phase == "v":
+        v_where = where + ["v.field_id = %s", "v.num_value IS NOT NULL"]
+        v_params = params + [page.sort_field]
+        if page.range_field == page.sort_field:
+            bounds, bound_params = _range_bounds("v.num_value", page)
+            v_where += bounds
+            v_params += bound_params
+        if row_id is not None:
+            clause, extra = _after_clause("v.num_value", "v.id", page.descending, key, row_id)
+            v_where.append(clause)
+            v_params += extra
+        sql = (
+            "SELECT p.*, v.num_value AS sort_value, v.id AS sort_id FROM field_values v "
+            "JOIN products p ON p.id = v.product_id WHERE " + " AND ".join(v_where)
+            + f" ORDER BY v.num_value {order}, v.id {order}"
+        )
+        if limit is not None:
+            sql += " LIMIT %s"
+            v_params.append(limit + 1)
+        cur.execute(sql, v_params)
+        rows = cur.fetchall()
+        if limit is not None and len(rows) > limit:
+            rows = rows[:limit]
+            cursor = page.next_cursor("v", rows[-1]['sort_value'], rows[-1]['sort_id'])
+            return _strip_sort_columns(rows), cursor
+        row_id = None
+
+    # A range on the sort field excludes products without a value.
+    if page.range_field != page.sort_field:
+        remaining = None if limit is None else limit - len(rows)
+        n_where = where + [
+            "NOT EXISTS (SELECT 1 FROM field_values v WHERE v.product_id = p.id "
+            "AND v.field_id = %s AND v.num_value IS NOT NULL)"
+        ]
+        n_params = params + [page.sort_field]
+        if row_id is not None:
+            clause, extra = _after_clause("p.id", "p.id", page.descending, None, row_id)
+            n_where.append(clause)
+            n_params += extra
+        sql = "SELECT p.* FROM products p WHERE " + " AND ".join(n_where) + f" ORDER BY p.id {order}"
+        if remaining is not None:
+            sql += " LIMIT %s"
+            n_params.append(remaining + 1)
+        cur.execute(sql, n_params)
+        extra_rows = cur.fetchall()
+        if remaining is not None and len(extra_rows) > remaining:
+            # remaining may be 0: the next page then starts this phase from the top.
+            extra_rows = extra_rows[:remaining]
+            last_id = extra_rows[-1]['id'] if extra_rows else row_id
+            return _strip_sort_columns(rows + extra_rows), page.next_cursor("n", None, last_id)
+        rows += extra_rows
+    return _strip_sort_columns(rows), None
+
+
+def _strip_sort_columns(rows):
+    for row in rows:
+        row.pop('sort_value', None)
+        row.pop('sort_id', None)
+    return rows
@@ -0,0 +1,87 @@
+"""
+StockFlow Password Hashing
+--------------------------
+bcrypt hashing and verification on a small bounded thread pool.
+
+bcrypt releases the GIL while it works, so with threaded gunicorn workers
+(see gunicorn.conf.py) a login no longer stalls the other requests a worker
+is serving. At most BCRYPT_MAX_CONCURRENCY hashes run at once and at most
+BCRYPT_MAX_QUEUE more may wait; beyond that, calls fail fast with
+HasherBusy instead of piling up behind each other.
+
+BCRYPT_ROUNDS sets the cost for new hashes. Hashes made with a different
+cost are reported by needs_rehash() so login can upgrade them in place.
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+
+class HasherBusy(Exception):
+    """Raised when the hashing queue is full."""
+
+
+class PasswordHasher:
+    def __init__(self, rounds=12, max_concurrency=2, max_queue=8):
+        self.rounds = rounds
+        self.max_concurrency = max_concurrency
+        self._slots = threading.BoundedSemaphore(max_concurrency + max_queue)
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def hash(self, password):
+        """Return a bcrypt hash (str) of password at the configured cost."""
+        hashed = self._run(bcrypt.hashpw, password.encode('utf-8'), bcrypt.gensalt(rounds=self.rounds))
+        return hashed.decode('utf-8')
+
+    def verify(self, password, hashed):
+        if isinstance(hashed, str):
+            hashed = hashed.encode('utf-8')
+        return self._run(bcrypt.checkpw, password.encode('utf-8'), hashed)
+
+    def needs_rehash(self, hashed):
+        """True if the hash was made with a different cost than configured."""
+        if isinstance(hashed, bytes):
+            hashed = hashed.decode('utf-8')
+        # Format: $2b$<cost>$<salt+hash>
+        parts = hashed.split('$')
+        try:
+            return int(parts[2]) != self.rounds
+        except (IndexError, ValueError):
+            return True
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise HasherBusy("Too many password checks in progress")
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future.result()
+
+    def _get_executor(self):
+        # Threads do not survive a fork, so each worker builds its own pool.
+        pid = os.getpid()
+        if self._executor is None or self._executor_pid != pid:
+            with self._lock:
+                if self._executor is None or self._executor_pid != pid:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.max_concurrency, thread_name_prefix="bcrypt"
+                    )
+                    self._executor_pid = pid
+        return self._executor
+
+
+hasher = PasswordHasher(
+    rounds=int(os.getenv("BCRYPT_ROUNDS", 12)),
+    max_concurrency=int(os.getenv("BCRYPT_MAX_CONCURRENCY", 2)),
+    max_queue=int(os.getenv("BCRYPT_MAX_QUEUE", 8)),
+)
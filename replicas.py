@@ -0,0 +1,251 @@
+"""
+StockFlow Read Replicas
+-----------------------
+Sends read-only requests to MySQL replicas and everything else to the
+primary.
+
+Replicas are listed in DB_REPLICAS as host[:port] pairs and use the
+primary's user, password and database. Each worker keeps a connection pool
+per replica and a checker thread that runs every REPLICA_CHECK_INTERVAL
+seconds:
+
+  1. read the heartbeat row on the primary (replica_heartbeat, id 1)
+  2. read the same row on every replica; the difference is that replica's
+     lag, accurate to about one check interval
+  3. advance the primary's heartbeat to the primary's current time
+
+A replica is used only while its last check succeeded, is recent, and
+showed at most REPLICA_MAX_LAG seconds of lag. Healthy replicas take turns
+(round robin). With none available, reads go to the primary. Views opt in
+with @read_replica in server.py; auth, writes and anything that must see
+its own data stay on the primary.
+
+Read-your-writes: a successful write response carries an X-Last-Write
+header and cookie. A client that sends either back within
+READ_YOUR_WRITES_SECONDS reads from the primary, so it sees what it just
+wrote. Keep that window above REPLICA_MAX_LAG. Reads are not monotonic
+across replicas with different lag.
+"""
+
+import logging
+import os
+import random
+import threading
+import time
+
+from db import ConnectionPool, PoolTimeout, connect, dialect, get_background_pool, is_sqlite
+
+log = logging.getLogger("stockflow.replicas")
+
+
+def _env_float(name, default):
+    value = os.getenv(name)
+    return float(value) if value else default
+
+
+REPLICA_MAX_LAG = _env_float("REPLICA_MAX_LAG", 3.0)
+REPLICA_CHECK_INTERVAL = _env_float("REPLICA_CHECK_INTERVAL", 1.0)
+READ_YOUR_WRITES_SECONDS = _env_float("READ_YOUR_WRITES_SECONDS", 5.0)
+REPLICA_CONNECT_TIMEOUT = _env_float("REPLICA_CONNECT_TIMEOUT", 2.0)
+LAST_WRITE_COOKIE = "sf_last_write"
+LAST_WRITE_HEADER = "X-Last-Write"
+
+
+def replica_hosts():
+    """(host, port) pairs from DB_REPLICAS; none with the SQLite backend."""
+    if is_sqlite():
+        return []
+    hosts = []
+    for entry in os.getenv("DB_REPLICAS", "").split(","):
+        entry = entry.strip()
+        if entry:
+            host, _, port = entry.partition(":")
+            hosts.append((host, int(port) if port else 3306))
+    return hosts
+
+
+def _replica_pool(host, port):
+    return ConnectionPool(
+        lambda: connect(host=host, port=port, timeout=REPLICA_CONNECT_TIMEOUT),
+        size=int(_env_float("DB_POOL_SIZE", 5)),
+        timeout=_env_float("DB_POOL_TIMEOUT", 10.0),
+        recycle=_env_float("DB_POOL_RECYCLE", 1800.0),
+        ping_after=_env_float("DB_POOL_PING_AFTER", 30.0),
+    )
+
+
+def wrote_recently(last_write, now=None):
+    """True if `last_write` (ms since the epoch, as sent by the client) is inside the window."""
+    try:
+        written = float(last_write) / 1000.0
+    except (TypeError, ValueError):
+        return False
+    now = time.time() if now is None else now
+    return now - READ_YOUR_WRITES_SECONDS < written <= now + 1.0
+
+
+class Replica:
+    def __init__(self, name, pool):
+        self.name = name
+        self.pool = pool
+        self.lag = None
+        self.checked_at = None
+        self.healthy = False
+        self.reads = 0
+        self.failures = 0
+        self.last_error = None
+
+    def stats(self):
+        return {
+            "name": self.name,
+            "healthy": self.healthy,
+            "lag": self.lag,
+            "checked_ago": round(time.monotonic() - self.checked_at, 3) if self.checked_at else None,
+            "reads": self.reads,
+            "failures": self.failures,
+            "last_error": self.last_error,
+            "pool": self.pool.stats(),
+        }
+
+
+class ReplicaRouter:
+    """Health-checks a worker's replicas and hands out connections to them round robin."""
+
+    def __init__(self, make_replicas, primary_acquire, interval=1.0, max_lag=3.0):
+        self._make_replicas = make_replicas
+        self._primary_acquire = primary_acquire
+        self.interval = interval
+        self.max_lag = max_lag
+        self._replicas = None
+        self._pid = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._turn = 0
+        self.primary_reads = 0
+        self.last_error = None
+
+    @property
+    def replicas(self):
+        pid = os.getpid()
+        if self._pid != pid:
+            with self._lock:
+                if self._pid != pid:
+                    self._replicas = self._make_replicas()
+                    self._thread = None
+                    self._pid = pid
+        return self._replicas
+
+    @property
+    def enabled(self):
+        return bool(self.replicas)
+
+    def ensure_started(self):
+        """Start this process's checker thread (once per worker, after fork)."""
+        if not self.interval or not self.replicas or self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="replica-checker", daemon=True)
+                self._thread.start()
+
+    def _loop(self):
+        while True:
+            try:
+                self.check()
+            except Exception as err:
+                self.last_error = str(err)
+                log.warning("Replica check failed: %s", err)
+            time.sleep(self.interval * random.uniform(0.8, 1.0))
+
+    def check(self):
+        """Measure every replica's lag against the primary's heartbeat, then advance it."""
+        conn = self._primary_acquire()
+        cur = conn.cursor()
+        try:
+            cur.execute("SELECT beat_at FROM replica_heartbeat WHERE id = 1")
+            row = cur.fetchone()
+            beat = row[0] if row else None
+            for replica in self.replicas:
+                self._check_replica(replica, beat)
+            cur.execute(
+                "INSERT INTO replica_heartbeat (id, beat_at) VALUES (1, %s) "
+                "ON DUPLICATE KEY UPDATE beat_at = GREATEST(beat_at, VALUES(beat_at))",
+                (dialect().now(cur),)
+            )
+            conn.commit()
+        finally:
+            cur.close()
+            conn.close()
+
+    def _check_replica(self, replica, beat):
+        try:
+            conn = replica.pool.acquire()
+            try:
+                cur = conn.cursor()
+                cur.execute("SELECT beat_at FROM replica_heartbeat WHERE id = 1")
+                row = cur.fetchone()
+                cur.close()
+            finally:
+                conn.close()
+        except Exception as err:
+            replica.healthy = False
+            replica.failures += 1
+            replica.last_error = str(err)
+            replica.checked_at = time.monotonic()
+            return
+        if beat is None:
+            # First check ever: nothing to compare with until the primary has a beat.
+            replica.lag = None
+        elif row is None:
+            replica.lag = None
+            replica.last_error = "No heartbeat replicated yet"
+        else:
+            replica.lag = max(0.0, (beat - row[0]).total_seconds())
+        replica.healthy = replica.lag is not None and replica.lag <= self.max_lag
+        replica.checked_at = time.monotonic()
+
+    def _usable(self, replica, now):
+        # A checker that stopped reporting is as good as a failed check.
+        return (replica.healthy and replica.checked_at is not None
+                and now - replica.checked_at < 3 * self.interval)
+
+    def acquire(self):
+        """A connection to the next usable replica, or None (use the primary)."""
+        replicas = self.replicas
+        now = time.monotonic()
+        for _ in range(len(replicas)):
+            with self._lock:
+                replica = replicas[self._turn % len(replicas)]
+                self._turn += 1
+            if not self._usable(replica, now):
+                continue
+            try:
+                conn = replica.pool.acquire()
+            except PoolTimeout:
+                continue
+            except Exception as err:
+                replica.healthy = False
+                replica.failures += 1
+                replica.last_error = str(err)
+                continue
+            replica.reads += 1
+            return replica.name, conn
+        self.primary_reads += 1
+        return None
+
+    def stats(self):
+        return {
+            "max_lag": self.max_lag,
+            "interval": self.interval,
+            "primary_reads": self.primary_reads,
+            "last_error": self.last_error,
+            "replicas": [replica.stats() for replica in self.replicas],
+        }
+
+
+router = ReplicaRouter(
+    lambda: [Replica(f"{host}:{port}", _replica_pool(host, port)) for host, port in replica_hosts()],
+    lambda: get_background_pool().acquire(),
+    interval=REPLICA_CHECK_INTERVAL,
+    max_lag=REPLICA_MAX_LAG,
+)
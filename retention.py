@@ -0,0 +1,162 @@
+"""
+StockFlow Retention
+-------------------
+Deletes rows that have outlived their retention period, so the append-only
+and expiring tables don't grow forever.
+
+Each module registers its own tables at import time:
+
+    register("sync_tombstones", "deleted_at", TOMBSTONE_RETENTION)
+
+and a background RetentionSweeper deletes the rows whose `column` is older
+than `now - keep` (optionally only those matching `where`), in batches of
+RETENTION_SWEEP_BATCH, one short transaction each. Workers coordinate
+through a named lock, so only one of them sweeps at a time.
+"""
+
+import logging
+import os
+import random
+import threading
+import time
+from datetime import datetime
+
+from db import dialect, get_background_pool
+
+log = logging.getLogger(__name__)
+
+# (table, column, keep, where) in registration order.
+POLICIES = []
+
+
+def _env_float(name, default):
+    value = os.getenv(name)
+    return float(value) if value else default
+
+
+def register(table, column, keep, where=None):
+    """Purge rows of `table` whose `column` is more than `keep` (a timedelta) old.
+
+    `column` should lead an index on `table`; `where` is extra SQL that the
+    purged rows must also match.
+    """
+    POLICIES.append((table, column, keep, where))
+
+
+class RetentionSweeper:
+    """Periodically purges every registered table in small batches."""
+
+    LOCK_NAME = 'stockflow_retention_sweep'
+
+    def __init__(self, acquire, policies, interval=300.0, batch_size=500, pause=0.05):
+        self._acquire = acquire
+        self.policies = policies
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pause = pause
+        self._thread = None
+        self._thread_pid = None
+        self._lock = threading.Lock()
+        self.runs = 0
+        self.skipped = 0
+        self.purged_total = 0
+        self.purged_by_table = {}
+        self.last_purged = 0
+        self.last_duration = 0.0
+        self.last_run_at = None
+        self.last_error = None
+
+    def ensure_started(self):
+        """Start this process's sweeper thread (once per worker, after fork)."""
+        if not self.interval:
+            return
+        pid = os.getpid()
+        if self._thread_pid == pid:
+            return
+        with self._lock:
+            if self._thread_pid == pid:
+                return
+            self._thread = threading.Thread(target=self._loop, name="retention-sweeper", daemon=True)
+            self._thread_pid = pid
+            self._thread.start()
+
+    def _loop(self):
+        while True:
+            # Jitter so workers started together don't all wake at once.
+            time.sleep(self.interval * random.uniform(0.5, 1.0))
+            try:
+                self.sweep()
+            except Exception as err:
+                self.last_error = str(err)
+                log.warning("Retention sweep failed: %s", err)
+
+    def sweep(self):
+        """Run one sweep if no other worker is sweeping. Returns rows purged."""
+        conn = self._acquire()
+        cur = conn.cursor()
+        try:
+            if not dialect().try_lock(cur, self.LOCK_NAME):
+                self.skipped += 1
+                return 0
+            try:
+                started = time.monotonic()
+                now = datetime.now()
+                purged = 0
+                for table, column, keep, where in self.policies:
+                    count = self._purge(conn, cur, table, column, now - keep, where)
+                    self.purged_by_table[table] = self.purged_by_table.get(table, 0) + count
+                    purged += count
+            finally:
+                dialect().release_lock(cur, self.LOCK_NAME)
+            self.runs += 1
+            self.last_purged = purged
+            self.purged_total += purged
+            self.last_duration = time.monotonic() - started
+            self.last_run_at = now.isoformat()
+            self.last_error = None
+            return purged
+        finally:
+            cur.close()
+            conn.close()
+
+    def _purge(self, conn, cur, table, column, cutoff, where=None):
+        # Select ids first and delete by primary key, one short transaction per batch.
+        purged = 0
+        condition = f"{where} AND {column} < %s" if where else f"{column} < %s"
+        while True:
+            cur.execute(
+                f"SELECT id FROM {table} WHERE {condition} ORDER BY {column} LIMIT %s",
+                (cutoff, self.batch_size)
+            )
+            ids = [row[0] for row in cur.fetchall()]
+            if not ids:
+                return purged
+            cur.execute(
+                f"DELETE FROM {table} WHERE id IN ({', '.join(['%s'] * len(ids))})", ids
+            )
+            conn.commit()
+            purged += len(ids)
+            if len(ids) < self.batch_size:
+                return purged
+            time.sleep(self.pause)
+
+    def stats(self):
+        return {
+            "runs": self.runs,
+            "skipped": self.skipped,
+            "rows_purged": self.purged_total,
+            "rows_purged_by_table": dict(self.purged_by_table),
+            "last_purged": self.last_purged,
+            "last_duration_seconds": round(self.last_duration, 4),
+            "last_run_at": self.last_run_at,
+            "last_error": self.last_error,
+        }
+
+
+# SESSION_SWEEP_* are the names from before the sweeper covered other tables.
+sweeper = RetentionSweeper(
+    lambda: get_background_pool().acquire(),
+    POLICIES,
+    interval=_env_float("RETENTION_SWEEP_INTERVAL", _env_float("SESSION_SWEEP_INTERVAL", 300.0)),
+    batch_size=int(_env_float("RETENTION_SWEEP_BATCH", _env_float("SESSION_SWEEP_BATCH", 500))),
+)
@@ -7,7 +7,12 @@ USE stockflow;
 CREATE TABLE IF NOT EXISTS folders (
     id INT AUTO_INCREMENT PRIMARY KEY,
     name VARCHAR(255) NOT NULL,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6),
+    -- Set while a deletion job removes the folder's contents (see jobs.py)
+    deleted_at TIMESTAMP NULL,
+    INDEX idx_folders_name (name),
+    INDEX idx_folders_updated (updated_at)
 );
 
 -- Fields table
@@ -17,7 +22,13 @@ CREATE TABLE IF NOT EXISTS fields (
     field_type VARCHAR(50) NOT NULL,
     folder_id INT NOT NULL,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (folder_id) REFERENCES folders(id) ON DELETE CASCADE
+    updated_at TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6),
+    deleted_at TIMESTAMP NULL,
+    FOREIGN KEY (folder_id) REFERENCES folders(id) ON DELETE CASCADE,
+    INDEX idx_fields_type_name (field_type, name),
+    INDEX idx_fields_folder_name (folder_id, name),
+    INDEX idx_fields_updated (updated_at),
+    INDEX idx_fields_deleted (deleted_at)
 );
 
 -- Products table
@@ -26,7 +37,12 @@ CREATE TABLE IF NOT EXISTS products (
     name VARCHAR(255) NOT NULL,
     folder_id INT NOT NULL,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (folder_id) REFERENCES folders(id) ON DELETE CASCADE
+    updated_at TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6),
+    FOREIGN KEY (folder_id) REFERENCES folders(id) ON DELETE CASCADE,
+    -- Keyset pagination by name / creation time (InnoDB appends id to both)
+    INDEX idx_products_folder_name (folder_id, name),
+    INDEX idx_products_folder_created (folder_id, created_at),
+    INDEX idx_products_updated (updated_at)
 );
 
 -- Field values table
@@ -35,10 +51,156 @@ CREATE TABLE IF NOT EXISTS field_values (
     product_id INT NOT NULL,
     field_id INT NOT NULL,
     value TEXT,
+    -- Typed copy of value for number fields (NULL otherwise)
+    num_value DECIMAL(30,4) NULL,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6),
     FOREIGN KEY (product_id) REFERENCES products(id) ON DELETE CASCADE,
     FOREIGN KEY (field_id) REFERENCES fields(id) ON DELETE CASCADE,
-    UNIQUE KEY unique_product_field (product_id, field_id)
+    UNIQUE KEY unique_product_field (product_id, field_id),
+    INDEX idx_field_num (field_id, num_value),
+    INDEX idx_field_values_updated (updated_at)
+);
+
+-- Deleted folders, fields and products, for delta sync (see sync.py).
+-- Field values are implied by their product's or field's tombstone.
+CREATE TABLE IF NOT EXISTS sync_tombstones (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    entity VARCHAR(16) NOT NULL,
+    entity_id INT NOT NULL,
+    deleted_at TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6),
+    INDEX idx_tombstones_deleted (deleted_at)
+);
+
+-- Background jobs (chunked folder/field deletion), see jobs.py
+CREATE TABLE IF NOT EXISTS jobs (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    kind VARCHAR(32) NOT NULL,
+    target_id INT NOT NULL,
+    status VARCHAR(16) NOT NULL DEFAULT 'pending',
+    rows_deleted BIGINT NOT NULL DEFAULT 0,
+    attempts INT NOT NULL DEFAULT 0,
+    error TEXT NULL,
+    owner VARCHAR(128) NULL,
+    heartbeat_at TIMESTAMP(6) NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    finished_at TIMESTAMP NULL,
+    INDEX idx_jobs_status (status, heartbeat_at),
+    INDEX idx_jobs_finished (status, finished_at)
+);
+
+-- Running totals per number field, maintained by the write routes
+-- (rebuild/verify with scripts/rebuild_aggregates.py)
+CREATE TABLE IF NOT EXISTS metric_aggregates (
+    field_id INT PRIMARY KEY,
+    folder_id INT NOT NULL,
+    value_sum DECIMAL(30,4) NOT NULL DEFAULT 0,
+    value_count INT NOT NULL DEFAULT 0,
+    value_min DECIMAL(30,4) NULL,
+    value_max DECIMAL(30,4) NULL,
+    FOREIGN KEY (field_id) REFERENCES fields(id) ON DELETE CASCADE,
+    FOREIGN KEY (folder_id) REFERENCES folders(id) ON DELETE CASCADE
+);
+
+-- Append-only log of number-field changes (see history.py); no foreign
+-- keys, so it outlives the products and fields it describes
+CREATE TABLE IF NOT EXISTS metric_history (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    field_id INT NOT NULL,
+    folder_id INT NOT NULL,
+    product_id INT NOT NULL,
+    old_value DECIMAL(30,4) NULL,
+    new_value DECIMAL(30,4) NULL,
+    recorded_at TIMESTAMP(6) NOT NULL,
+    INDEX idx_metric_history_recorded (recorded_at)
+);
+
+-- Hourly and daily per-field rollups of metric_history, maintained on write
+CREATE TABLE IF NOT EXISTS metric_rollups (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    grain VARCHAR(8) NOT NULL,
+    field_id INT NOT NULL,
+    bucket_start TIMESTAMP NOT NULL,
+    folder_id INT NOT NULL,
+    delta_sum DECIMAL(30,4) NOT NULL DEFAULT 0,
+    changes INT NOT NULL DEFAULT 0,
+    total_min DECIMAL(30,4) NOT NULL,
+    total_max DECIMAL(30,4) NOT NULL,
+    total_last DECIMAL(30,4) NOT NULL,
+    FOREIGN KEY (field_id) REFERENCES fields(id) ON DELETE CASCADE,
+    FOREIGN KEY (folder_id) REFERENCES folders(id) ON DELETE CASCADE,
+    UNIQUE KEY unique_rollup (grain, field_id, bucket_start),
+    INDEX idx_rollups_folder (folder_id),
+    INDEX idx_rollups_expiry (grain, bucket_start)
+);
+
+-- Threshold rules on number fields (see alerts.py); folder_id NULL = every folder
+CREATE TABLE IF NOT EXISTS alert_rules (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    metric VARCHAR(255) NOT NULL,
+    folder_id INT NULL,
+    operator VARCHAR(2) NOT NULL,
+    threshold DECIMAL(30,4) NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (folder_id) REFERENCES folders(id) ON DELETE CASCADE,
+    INDEX idx_alert_rules_metric (metric)
+);
+
+-- Current and recently resolved alerts, one row per rule, product and field.
+-- No foreign keys: a deleted product's alert stays, resolved, for GET /alerts.
+CREATE TABLE IF NOT EXISTS alerts (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    rule_id INT NOT NULL,
+    product_id INT NOT NULL,
+    field_id INT NOT NULL,
+    folder_id INT NOT NULL,
+    value DECIMAL(30,4) NULL,
+    active TINYINT(1) NOT NULL DEFAULT 1,
+    opened_at TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6),
+    resolved_at TIMESTAMP(6) NULL,
+    updated_at TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6),
+    UNIQUE KEY unique_alert (rule_id, product_id, field_id),
+    INDEX idx_alerts_product (product_id),
+    INDEX idx_alerts_field (field_id),
+    INDEX idx_alerts_folder (folder_id),
+    INDEX idx_alerts_updated (updated_at),
+    INDEX idx_alerts_resolved (active, resolved_at)
+);
+
+-- Inverted index behind GET /search (see search.py). field_id 0 is the
+-- product name. Binary collation so term ranges follow code point order.
+CREATE TABLE IF NOT EXISTS search_postings (
+    term VARCHAR(32) CHARACTER SET utf8mb4 COLLATE utf8mb4_bin NOT NULL,
+    product_id INT NOT NULL,
+    field_id INT NOT NULL,
+    folder_id INT NOT NULL,
+    PRIMARY KEY (term, product_id, field_id),
+    FOREIGN KEY (product_id) REFERENCES products(id) ON DELETE CASCADE,
+    INDEX idx_postings_product (product_id, field_id)
+);
+
+-- Every indexed term, and its trigrams for typo-tolerant lookups
+CREATE TABLE IF NOT EXISTS search_terms (
+    term VARCHAR(32) CHARACTER SET utf8mb4 COLLATE utf8mb4_bin PRIMARY KEY
+);
+
+CREATE TABLE IF NOT EXISTS search_trigrams (
+    trigram VARCHAR(3) CHARACTER SET utf8mb4 COLLATE utf8mb4_bin NOT NULL,
+    term_length INT NOT NULL,
+    term VARCHAR(32) CHARACTER SET utf8mb4 COLLATE utf8mb4_bin NOT NULL,
+    PRIMARY KEY (trigram, term_length, term)
+);
+
+-- Written on the primary every REPLICA_CHECK_INTERVAL; replicas' copies give their lag (see replicas.py)
+CREATE TABLE IF NOT EXISTS replica_heartbeat (
+    id INT PRIMARY KEY,
+    beat_at TIMESTAMP(6) NOT NULL
+);
+
+-- Version counters behind the ETag/response cache (global, folders, folder:<id>)
+CREATE TABLE IF NOT EXISTS data_versions (
+    scope VARCHAR(64) PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0
 );
 
 -- Admin users table
@@ -56,7 +218,16 @@ CREATE TABLE IF NOT EXISTS sessions (
     token VARCHAR(255) NOT NULL UNIQUE,
     expires_at TIMESTAMP NOT NULL,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (user_id) REFERENCES admin_users(id) ON DELETE CASCADE
+    FOREIGN KEY (user_id) REFERENCES admin_users(id) ON DELETE CASCADE,
+    INDEX idx_sessions_expires (expires_at)
+);
+
+-- Revoked tokens, polled by every worker to evict its session cache
+CREATE TABLE IF NOT EXISTS session_revocations (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    token VARCHAR(255) NOT NULL,
+    revoked_at TIMESTAMP NOT NULL,
+    INDEX idx_revoked_at (revoked_at)
 );
 
 -- Default admin user (username: admin, password: admin123)
@@ -0,0 +1,284 @@
+-- StockFlow Database Schema (SQLite)
+-- Same tables, keys and cascades as schema.sql, for DB_BACKEND=sqlite.
+-- Applied automatically on first connection. Foreign keys are enforced
+-- because every connection sets PRAGMA foreign_keys = ON.
+-- Timestamps default to local time with milliseconds, in the same text
+-- format the app's datetime adapter writes, so the naive datetime.now()
+-- values it compares against order correctly. Names use NOCASE to sort
+-- and prefix-match like MySQL's default case-insensitive collation.
+
+-- Folders table
+CREATE TABLE IF NOT EXISTS folders (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name VARCHAR(255) NOT NULL COLLATE NOCASE,
+    created_at TIMESTAMP DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime')),
+    updated_at TIMESTAMP DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime')),
+    -- Set while a deletion job removes the folder's contents (see jobs.py)
+    deleted_at TIMESTAMP NULL
+);
+CREATE INDEX IF NOT EXISTS idx_folders_name ON folders (name);
+CREATE INDEX IF NOT EXISTS idx_folders_updated ON folders (updated_at);
+
+-- Fields table
+CREATE TABLE IF NOT EXISTS fields (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name VARCHAR(255) NOT NULL COLLATE NOCASE,
+    field_type VARCHAR(50) NOT NULL,
+    folder_id INTEGER NOT NULL,
+    created_at TIMESTAMP DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime')),
+    updated_at TIMESTAMP DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime')),
+    deleted_at TIMESTAMP NULL,
+    FOREIGN KEY (folder_id) REFERENCES folders(id) ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS idx_fields_type_name ON fields (field_type, name);
+CREATE INDEX IF NOT EXISTS idx_fields_folder_name ON fields (folder_id, name);
+CREATE INDEX IF NOT EXISTS idx_fields_updated ON fields (updated_at);
+CREATE INDEX IF NOT EXISTS idx_fields_deleted ON fields (deleted_at);
+
+-- Products table
+CREATE TABLE IF NOT EXISTS products (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name VARCHAR(255) NOT NULL COLLATE NOCASE,
+    folder_id INTEGER NOT NULL,
+    created_at TIMESTAMP DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime')),
+    updated_at TIMESTAMP DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime')),
+    FOREIGN KEY (folder_id) REFERENCES folders(id) ON DELETE CASCADE
+);
+-- Keyset pagination by name / creation time (the rowid is appended to both).
+-- The first also serves the folder_id foreign key, which SQLite does not
+-- index by itself.
+CREATE INDEX IF NOT EXISTS idx_products_folder_name ON products (folder_id, name);
+CREATE INDEX IF NOT EXISTS idx_products_folder_created ON products (folder_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_products_updated ON products (updated_at);
+
+-- Field values table
+CREATE TABLE IF NOT EXISTS field_values (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    product_id INTEGER NOT NULL,
+    field_id INTEGER NOT NULL,
+    value TEXT,
+    -- Typed copy of value for number fields (NULL otherwise)
+    num_value DECIMAL(30,4) NULL,
+    created_at TIMESTAMP DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime')),
+    updated_at TIMESTAMP DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime')),
+    FOREIGN KEY (product_id) REFERENCES products(id) ON DELETE CASCADE,
+    FOREIGN KEY (field_id) REFERENCES fields(id) ON DELETE CASCADE,
+    CONSTRAINT unique_product_field UNIQUE (product_id, field_id)
+);
+CREATE INDEX IF NOT EXISTS idx_field_num ON field_values (field_id, num_value);
+CREATE INDEX IF NOT EXISTS idx_field_values_updated ON field_values (updated_at);
+
+-- updated_at is kept current by triggers, standing in for MySQL's ON UPDATE
+-- CURRENT_TIMESTAMP. The insert triggers only fire for files created before
+-- the column existed, where it was added without a default.
+CREATE TRIGGER IF NOT EXISTS folders_touch_insert AFTER INSERT ON folders
+WHEN NEW.updated_at IS NULL
+BEGIN
+    UPDATE folders SET updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime') WHERE id = NEW.id;
+END;
+CREATE TRIGGER IF NOT EXISTS folders_touch_update AFTER UPDATE ON folders
+WHEN NEW.updated_at IS OLD.updated_at
+BEGIN
+    UPDATE folders SET updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime') WHERE id = NEW.id;
+END;
+CREATE TRIGGER IF NOT EXISTS fields_touch_insert AFTER INSERT ON fields
+WHEN NEW.updated_at IS NULL
+BEGIN
+    UPDATE fields SET updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime') WHERE id = NEW.id;
+END;
+CREATE TRIGGER IF NOT EXISTS fields_touch_update AFTER UPDATE ON fields
+WHEN NEW.updated_at IS OLD.updated_at
+BEGIN
+    UPDATE fields SET updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime') WHERE id = NEW.id;
+END;
+CREATE TRIGGER IF NOT EXISTS products_touch_insert AFTER INSERT ON products
+WHEN NEW.updated_at IS NULL
+BEGIN
+    UPDATE products SET updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime') WHERE id = NEW.id;
+END;
+CREATE TRIGGER IF NOT EXISTS products_touch_update AFTER UPDATE ON products
+WHEN NEW.updated_at IS OLD.updated_at
+BEGIN
+    UPDATE products SET updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime') WHERE id = NEW.id;
+END;
+CREATE TRIGGER IF NOT EXISTS field_values_touch_insert AFTER INSERT ON field_values
+WHEN NEW.updated_at IS NULL
+BEGIN
+    UPDATE field_values SET updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime') WHERE id = NEW.id;
+END;
+CREATE TRIGGER IF NOT EXISTS field_values_touch_update AFTER UPDATE ON field_values
+WHEN NEW.updated_at IS OLD.updated_at
+BEGIN
+    UPDATE field_values SET updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime') WHERE id = NEW.id;
+END;
+
+-- Deleted folders, fields and products, for delta sync (see sync.py)
+CREATE TABLE IF NOT EXISTS sync_tombstones (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    entity VARCHAR(16) NOT NULL,
+    entity_id INTEGER NOT NULL,
+    deleted_at TIMESTAMP NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime'))
+);
+CREATE INDEX IF NOT EXISTS idx_tombstones_deleted ON sync_tombstones (deleted_at);
+
+-- Background jobs (chunked folder/field deletion), see jobs.py
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind VARCHAR(32) NOT NULL,
+    target_id INTEGER NOT NULL,
+    status VARCHAR(16) NOT NULL DEFAULT 'pending',
+    rows_deleted BIGINT NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT NULL,
+    owner VARCHAR(128) NULL,
+    heartbeat_at TIMESTAMP NULL,
+    created_at TIMESTAMP DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime')),
+    finished_at TIMESTAMP NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, heartbeat_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_finished ON jobs (status, finished_at);
+
+-- Running totals per number field, maintained by the write routes
+CREATE TABLE IF NOT EXISTS metric_aggregates (
+    field_id INTEGER PRIMARY KEY,
+    folder_id INTEGER NOT NULL,
+    value_sum DECIMAL(30,4) NOT NULL DEFAULT 0,
+    value_count INTEGER NOT NULL DEFAULT 0,
+    value_min DECIMAL(30,4) NULL,
+    value_max DECIMAL(30,4) NULL,
+    FOREIGN KEY (field_id) REFERENCES fields(id) ON DELETE CASCADE,
+    FOREIGN KEY (folder_id) REFERENCES folders(id) ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS idx_metric_aggregates_folder ON metric_aggregates (folder_id);
+
+-- Append-only log of number-field changes (see history.py); no foreign
+-- keys, so it outlives the products and fields it describes
+CREATE TABLE IF NOT EXISTS metric_history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    field_id INTEGER NOT NULL,
+    folder_id INTEGER NOT NULL,
+    product_id INTEGER NOT NULL,
+    old_value DECIMAL(30,4) NULL,
+    new_value DECIMAL(30,4) NULL,
+    recorded_at TIMESTAMP NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_metric_history_recorded ON metric_history (recorded_at);
+
+-- Hourly and daily per-field rollups of metric_history, maintained on write
+CREATE TABLE IF NOT EXISTS metric_rollups (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    grain VARCHAR(8) NOT NULL,
+    field_id INTEGER NOT NULL,
+    bucket_start TIMESTAMP NOT NULL,
+    folder_id INTEGER NOT NULL,
+    delta_sum DECIMAL(30,4) NOT NULL DEFAULT 0,
+    changes INTEGER NOT NULL DEFAULT 0,
+    total_min DECIMAL(30,4) NOT NULL,
+    total_max DECIMAL(30,4) NOT NULL,
+    total_last DECIMAL(30,4) NOT NULL,
+    FOREIGN KEY (field_id) REFERENCES fields(id) ON DELETE CASCADE,
+    FOREIGN KEY (folder_id) REFERENCES folders(id) ON DELETE CASCADE,
+    CONSTRAINT unique_rollup UNIQUE (grain, field_id, bucket_start)
+);
+CREATE INDEX IF NOT EXISTS idx_rollups_folder ON metric_rollups (folder_id);
+CREATE INDEX IF NOT EXISTS idx_rollups_expiry ON metric_rollups (grain, bucket_start);
+
+-- Threshold rules on number fields (see alerts.py); folder_id NULL = every folder
+CREATE TABLE IF NOT EXISTS alert_rules (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    metric VARCHAR(255) NOT NULL,
+    folder_id INTEGER NULL,
+    operator VARCHAR(2) NOT NULL,
+    threshold DECIMAL(30,4) NOT NULL,
+    created_at TIMESTAMP DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime')),
+    FOREIGN KEY (folder_id) REFERENCES folders(id) ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS idx_alert_rules_metric ON alert_rules (metric);
+CREATE INDEX IF NOT EXISTS idx_alert_rules_folder ON alert_rules (folder_id);
+
+-- Current and recently resolved alerts, one row per rule, product and field
+CREATE TABLE IF NOT EXISTS alerts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    rule_id INTEGER NOT NULL,
+    product_id INTEGER NOT NULL,
+    field_id INTEGER NOT NULL,
+    folder_id INTEGER NOT NULL,
+    value DECIMAL(30,4) NULL,
+    active INTEGER NOT NULL DEFAULT 1,
+    opened_at TIMESTAMP NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime')),
+    resolved_at TIMESTAMP NULL,
+    updated_at TIMESTAMP DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime')),
+    CONSTRAINT unique_alert UNIQUE (rule_id, product_id, field_id)
+);
+CREATE INDEX IF NOT EXISTS idx_alerts_product ON alerts (product_id);
+CREATE INDEX IF NOT EXISTS idx_alerts_field ON alerts (field_id);
+CREATE INDEX IF NOT EXISTS idx_alerts_folder ON alerts (folder_id);
+CREATE INDEX IF NOT EXISTS idx_alerts_updated ON alerts (updated_at);
+CREATE INDEX IF NOT EXISTS idx_alerts_resolved ON alerts (active, resolved_at);
+CREATE TRIGGER IF NOT EXISTS alerts_touch_update AFTER UPDATE ON alerts
+WHEN NEW.updated_at IS OLD.updated_at
+BEGIN
+    UPDATE alerts SET updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime') WHERE id = NEW.id;
+END;
+
+-- Inverted index behind GET /search (see search.py); field_id 0 is the product name
+CREATE TABLE IF NOT EXISTS search_postings (
+    term VARCHAR(32) NOT NULL,
+    product_id INTEGER NOT NULL,
+    field_id INTEGER NOT NULL,
+    folder_id INTEGER NOT NULL,
+    PRIMARY KEY (term, product_id, field_id),
+    FOREIGN KEY (product_id) REFERENCES products(id) ON DELETE CASCADE
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_postings_product ON search_postings (product_id, field_id);
+
+-- Every indexed term, and its trigrams for typo-tolerant lookups
+CREATE TABLE IF NOT EXISTS search_terms (
+    term VARCHAR(32) PRIMARY KEY
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS search_trigrams (
+    trigram VARCHAR(3) NOT NULL,
+    term_length INTEGER NOT NULL,
+    term VARCHAR(32) NOT NULL,
+    PRIMARY KEY (trigram, term_length, term)
+) WITHOUT ROWID;
+
+-- Version counters behind the ETag/response cache
+CREATE TABLE IF NOT EXISTS data_versions (
+    scope VARCHAR(64) PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0
+);
+
+-- Admin users table
+CREATE TABLE IF NOT EXISTS admin_users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username VARCHAR(100) NOT NULL UNIQUE,
+    password_hash VARCHAR(255) NOT NULL,
+    created_at TIMESTAMP DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime'))
+);
+
+-- Sessions table for token management
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    token VARCHAR(255) NOT NULL UNIQUE,
+    expires_at TIMESTAMP NOT NULL,
+    created_at TIMESTAMP DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime')),
+    updated_at TIMESTAMP DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime')),
+    FOREIGN KEY (user_id) REFERENCES admin_users(id) ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions (expires_at);
+CREATE INDEX IF NOT EXISTS idx_sessions_user ON sessions (user_id);
+
+-- Revoked tokens, polled by every worker to evict its session cache
+CREATE TABLE IF NOT EXISTS session_revocations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    token VARCHAR(255) NOT NULL,
+    revoked_at TIMESTAMP NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_revoked_at ON session_revocations (revoked_at);
+
+-- Default admin user (username: admin, password: admin123)
+INSERT OR IGNORE INTO admin_users (username, password_hash)
+VALUES ('admin', '$2b$12$LQv3c1yqBWVHxkd0LHAkCOYz6TtxMQJqhN8/LewY5GyYzNGxqKzPu');
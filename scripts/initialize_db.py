@@ -1,14 +1,137 @@
 
 import mysql.connector
 import os
+import sys
+import time
+import argparse
 from dotenv import load_dotenv
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from analytics import to_number
+from db import is_sqlite, connect
+
 load_dotenv()
 
-def setup_database():
+# Columns and indexes added after the first release. CREATE TABLE IF NOT EXISTS
+# in schema.sql does not touch existing tables, so they are applied here.
+COLUMN_MIGRATIONS = [
+    ("field_values", "num_value", "ALTER TABLE field_values ADD COLUMN num_value DECIMAL(30,4) NULL AFTER value"),
+] + [
+    (table, "updated_at",
+     f"ALTER TABLE {table} ADD COLUMN updated_at TIMESTAMP(6) NOT NULL "
+     "DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6) AFTER created_at")
+    for table in ("folders", "fields", "products", "field_values")
+] + [
+    (table, "deleted_at", f"ALTER TABLE {table} ADD COLUMN deleted_at TIMESTAMP NULL AFTER updated_at")
+    for table in ("folders", "fields")
+]
+INDEX_MIGRATIONS = [
+    ("fields", "idx_fields_type_name", "CREATE INDEX idx_fields_type_name ON fields (field_type, name)"),
+    ("fields", "idx_fields_folder_name", "CREATE INDEX idx_fields_folder_name ON fields (folder_id, name)"),
+    ("field_values", "idx_field_num", "CREATE INDEX idx_field_num ON field_values (field_id, num_value)"),
+    ("sessions", "idx_sessions_expires", "CREATE INDEX idx_sessions_expires ON sessions (expires_at)"),
+    ("folders", "idx_folders_name", "CREATE INDEX idx_folders_name ON folders (name)"),
+    ("products", "idx_products_folder_name", "CREATE INDEX idx_products_folder_name ON products (folder_id, name)"),
+    ("products", "idx_products_folder_created", "CREATE INDEX idx_products_folder_created ON products (folder_id, created_at)"),
+    ("folders", "idx_folders_updated", "CREATE INDEX idx_folders_updated ON folders (updated_at)"),
+    ("fields", "idx_fields_updated", "CREATE INDEX idx_fields_updated ON fields (updated_at)"),
+    ("fields", "idx_fields_deleted", "CREATE INDEX idx_fields_deleted ON fields (deleted_at)"),
+    ("products", "idx_products_updated", "CREATE INDEX idx_products_updated ON products (updated_at)"),
+    ("field_values", "idx_field_values_updated", "CREATE INDEX idx_field_values_updated ON field_values (updated_at)"),
+    ("jobs", "idx_jobs_finished", "CREATE INDEX idx_jobs_finished ON jobs (status, finished_at)"),
+]
+
+def column_exists(cursor, table, column):
+    cursor.execute("""
+        SELECT COUNT(*) FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s
+    """, (table, column))
+    return cursor.fetchone()[0] > 0
+
+def index_exists(cursor, table, index):
+    cursor.execute("""
+        SELECT COUNT(*) FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s
+    """, (table, index))
+    return cursor.fetchone()[0] > 0
+
+def apply_migrations(conn, cursor):
+    """Add missing columns and indexes. Both are online DDL on MySQL 8 and TiDB."""
+    for table, column, ddl in COLUMN_MIGRATIONS:
+        if not column_exists(cursor, table, column):
+            print(f"   ➕ Adding column {table}.{column}")
+            cursor.execute(ddl)
+    for table, index, ddl in INDEX_MIGRATIONS:
+        if not index_exists(cursor, table, index):
+            print(f"   ➕ Creating index {index} on {table}")
+            cursor.execute(ddl)
+    conn.commit()
+
+def backfill_numeric_values(conn, cursor, batch_size=5000, pause=0.0):
+    """Fill field_values.num_value for number fields, one id range per transaction.
+
+    Only rows whose num_value is still NULL are touched, so the backfill can be
+    interrupted and re-run, and live writes (which set num_value themselves)
+    are never overwritten.
+    """
+    cursor.execute("SELECT COALESCE(MIN(id), 0), COALESCE(MAX(id), 0) FROM field_values")
+    low, high = cursor.fetchone()
+    updated = 0
+    start = low
+    while start and start <= high:
+        end = start + batch_size - 1
+        cursor.execute("""
+            SELECT v.id, v.value
+            FROM field_values v
+            JOIN fields f ON f.id = v.field_id
+            WHERE v.id BETWEEN %s AND %s
+              AND f.field_type = 'number'
+              AND v.num_value IS NULL
+              AND v.value IS NOT NULL AND v.value <> ''
+        """, (start, end))
+        rows = [(row_id, to_number(value)) for row_id, value in cursor.fetchall()]
+        rows = [(row_id, number) for row_id, number in rows if number is not None]
+        if rows:
+            cases = " ".join(["WHEN %s THEN %s"] * len(rows))
+            params = [p for row in rows for p in row]
+            params += [row_id for row_id, _ in rows]
+            cursor.execute(
+                f"UPDATE field_values SET num_value = CASE id {cases} END "
+                f"WHERE id IN ({', '.join(['%s'] * len(rows))})",
+                params
+            )
+            conn.commit()
+            updated += len(rows)
+        print(f"   ⏳ Backfilled ids {start}-{min(end, high)} ({updated} values so far)")
+        start = end + 1
+        if pause:
+            time.sleep(pause)
+    return updated
+
+def setup_sqlite():
+    """Create the SQLite file from schema_sqlite.sql (a fresh file needs no migrations)."""
+    print(f"\n📦 Creating tables in SQLite file '{os.getenv('SQLITE_PATH', 'stockflow.db')}'...")
+    conn = connect()
+    cursor = conn.cursor()
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%%' ORDER BY name")
+    tables = [x[0] for x in cursor.fetchall()]
+    print("\n📊 Current Tables:")
+    for table in tables:
+        print(f"   - {table}")
+    cursor.close()
+    conn.close()
+    print("\n✅ Database Setup Complete!")
+    print("   (Default: admin / admin123)")
+
+def setup_database(batch_size=5000, pause=0.0):
     print("🔧 StockFlow Full Database Setup")
     print("=" * 50)
 
+    if is_sqlite():
+        setup_sqlite()
+        return
+
     try:
         # 1. Connect to Database
         print("\n📡 Connecting to MySQL (TiDB)...")
@@ -45,7 +168,15 @@ def setup_database():
         conn.commit()
         print("✅ Tables Created/Verified from schema.sql")
 
-        # 4. Final Verification
+        # 4. Online migrations for existing databases
+        print("\n🔁 Applying migrations...")
+        apply_migrations(conn, cursor)
+        updated = backfill_numeric_values(conn, cursor, batch_size, pause)
+        print(f"✅ Migrations applied ({updated} numeric values backfilled)")
+        if updated:
+            print("   Run scripts/rebuild_aggregates.py to refresh analytics totals.")
+
+        # 5. Final Verification
         cursor.execute("SHOW TABLES")
         tables = [x[0] for x in cursor.fetchall()]
         print(f"\n📊 Current Tables in '{os.getenv('MYSQL_DB')}':")
@@ -63,4 +194,8 @@ def setup_database():
         print(f"\n❌ Setup Failed: {e}")
 
 if __name__ == "__main__":
-    setup_database()
+    parser = argparse.ArgumentParser(description="Create/upgrade the StockFlow schema.")
+    parser.add_argument("--batch-size", type=int, default=5000, help="rows per backfill transaction")
+    parser.add_argument("--pause", type=float, default=0.0, help="seconds to sleep between backfill batches")
+    args = parser.parse_args()
+    setup_database(args.batch_size, args.pause)
@@ -0,0 +1,48 @@
+import os
+import sys
+import argparse
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import connect
+from analytics import compute_aggregates, find_drift, rebuild_aggregates
+
+load_dotenv()
+
+def main(verify_only):
+    print("🔧 StockFlow Analytics Aggregates")
+    print("=" * 50)
+
+    try:
+        conn = connect()
+
+        print("\n📊 Recomputing aggregates from field_values...")
+        expected = compute_aggregates(conn)
+        print(f"   {len(expected)} number fields with values")
+
+        drift = find_drift(conn, expected)
+        if drift:
+            print(f"\n⚠️  {len(drift)} drifted values:")
+            for d in drift:
+                print(f"   - field {d['field_id']} {d['key']}: stored={d['stored']} expected={d['expected']}")
+        else:
+            print("\n✅ Stored aggregates match field_values.")
+
+        if drift and not verify_only:
+            print("\n📦 Rebuilding metric_aggregates...")
+            rebuild_aggregates(conn)
+            print("✅ Rebuild complete.")
+
+        conn.close()
+        return 1 if drift and verify_only else 0
+
+    except Exception as e:
+        print(f"\n❌ Failed: {e}")
+        return 2
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recompute metric_aggregates and report drift.")
+    parser.add_argument("--verify", action="store_true", help="only report drift, do not rewrite the table")
+    args = parser.parse_args()
+    sys.exit(main(args.verify))
@@ -0,0 +1,35 @@
+import os
+import sys
+import argparse
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import connect
+from search import rebuild_search_index
+
+load_dotenv()
+
+def main(batch_size):
+    print("🔧 StockFlow Search Index")
+    print("=" * 50)
+
+    try:
+        conn = connect()
+
+        print("\n🔎 Re-indexing product names and text field values...")
+        indexed = rebuild_search_index(conn, batch_size)
+        print(f"✅ Indexed {indexed} products.")
+
+        conn.close()
+        return 0
+
+    except Exception as e:
+        print(f"\n❌ Failed: {e}")
+        return 2
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild the search index from products and field_values.")
+    parser.add_argument("--batch-size", type=int, default=1000, help="products per transaction")
+    args = parser.parse_args()
+    sys.exit(main(args.batch_size))
@@ -1,11 +1,16 @@
 
 import mysql.connector
 import os
-import bcrypt
+import sys
 from dotenv import load_dotenv
 
 load_dotenv()
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Imported after load_dotenv so BCRYPT_ROUNDS from .env is honoured
+from passwords import hasher
+
 def reset_password(username, new_password):
     print(f"🔧 Resetting password for user: '{username}'")
     
@@ -21,12 +26,12 @@ def reset_password(username, new_password):
         cursor = conn.cursor()
         
         # 2. Generate New Hash
-        hashed = bcrypt.hashpw(new_password.encode('utf-8'), bcrypt.gensalt())
+        hashed = hasher.hash(new_password)
         
         # 3. Update Database
         cursor.execute(
             "UPDATE admin_users SET password_hash = %s WHERE username = %s",
-            (hashed.decode('utf-8'), username)
+            (hashed, username)
         )
         conn.commit()
         
@@ -36,7 +41,7 @@ def reset_password(username, new_password):
             print(f"⚠️  User '{username}' not found. Creating user now...")
             cursor.execute(
                 "INSERT INTO admin_users (username, password_hash) VALUES (%s, %s)",
-                (username, hashed.decode('utf-8'))
+                (username, hashed)
             )
             conn.commit()
             print(f"✅ Created user '{username}' with password '{new_password}'.")
@@ -0,0 +1,330 @@
+"""
+StockFlow Search
+----------------
+An inverted index over product names and text field values, kept current by
+the write paths (through ChangeSet) and served by GET /search.
+
+    search_postings   (term, product_id, field_id) for every token of every
+                      indexed text; field_id 0 is the product name
+    search_terms      every term that has ever been indexed
+    search_trigrams   (trigram, term length, term) for those terms
+
+Text is lower-cased and split into word tokens. Each query token matches
+the terms it is a prefix of (the first MAX_PREFIX_TERMS of them, from a
+range scan of search_terms), whose postings are then read by primary key.
+A token of FUZZY_MIN_LENGTH or more characters that finds fewer than
+`limit` products also matches terms within one edit (two for tokens of
+eight or more characters); swapping two adjacent letters counts as one.
+Candidate terms come from shared trigrams and are checked with an
+edit-distance test. A product must match every query token: the longest
+token is looked up first, the others only among the products it matched.
+Postings of hidden fields are skipped; idx_fields_deleted keeps finding
+them a short index scan.
+
+Ranking sums, per query token, the best match the product has: exact term
+3, prefix 2, typo 1, doubled for a match in the name. Ties go to the lower
+product id. Each lookup reads at most SEARCH_CANDIDATES postings, so a query
+whose longest token is a very common prefix ranks from a sample rather than
+the whole catalogue.
+
+Terms and trigrams are only ever added. A term whose last posting is gone
+costs one wasted lookup; scripts/rebuild_search_index.py starts over.
+"""
+
+import heapq
+import os
+import re
+import unicodedata
+
+from db import insert_many
+
+NAME_FIELD = 0
+MAX_TERM_LENGTH = 32
+MAX_TERMS_PER_TEXT = 64
+MAX_QUERY_TOKENS = 8
+MAX_PREFIX_TERMS = 100
+FUZZY_MIN_LENGTH = 4
+
+SEARCH_CANDIDATES = int(os.getenv("SEARCH_CANDIDATES", 1000))
+SEARCH_DEFAULT_LIMIT = int(os.getenv("SEARCH_DEFAULT_LIMIT", 20))
+SEARCH_MAX_LIMIT = int(os.getenv("SEARCH_MAX_LIMIT", 100))
+
+_TOKEN = re.compile(r"\w+")
+EXACT, PREFIX, TYPO = 3, 2, 1
+
+
+def tokenize(text):
+    """Distinct lower-case word tokens of `text`, in order of first appearance."""
+    if not text:
+        return []
+    tokens = []
+    seen = set()
+    for token in _TOKEN.findall(unicodedata.normalize("NFKC", str(text)).lower()):
+        token = token[:MAX_TERM_LENGTH]
+        if token not in seen:
+            seen.add(token)
+            tokens.append(token)
+            if len(tokens) == MAX_TERMS_PER_TEXT:
+                break
+    return tokens
+
+
+def trigrams(term):
+    padded = f"${term}$"
+    return sorted({padded[i:i + 3] for i in range(len(padded) - 2)})
+
+
+# --- INDEXING ---
+def index_changes(db, changes):
+    """Re-index the (product_id, field_id) -> (folder_id, text) pairs in `changes`.
+
+    A text of None just removes the pair's postings. Runs in the caller's
+    transaction.
+    """
+    if not changes:
+        return
+    cur = db.cursor()
+    by_field = {}
+    for product_id, field_id in changes:
+        by_field.setdefault(field_id, []).append(product_id)
+    for field_id, product_ids in sorted(by_field.items()):
+        cur.execute(
+            "DELETE FROM search_postings WHERE field_id = %s AND product_id IN ("
+            + ", ".join(["%s"] * len(product_ids)) + ")",
+            [field_id] + sorted(product_ids)
+        )
+    _add_postings(cur, [
+        (product_id, field_id, folder_id, text)
+        for (product_id, field_id), (folder_id, text) in changes.items()
+    ])
+    cur.close()
+
+
+def _add_postings(cur, docs):
+    rows = []
+    terms = set()
+    for product_id, field_id, folder_id, text in docs:
+        for term in tokenize(text):
+            rows.append((term, product_id, field_id, folder_id))
+            terms.add(term)
+    if not rows:
+        return
+    insert_many(cur, "search_postings", ("term", "product_id", "field_id", "folder_id"), rows,
+                update=("folder_id",))
+
+    terms = sorted(terms)
+    known = set()
+    for start in range(0, len(terms), 500):
+        chunk = terms[start:start + 500]
+        cur.execute(
+            "SELECT term FROM search_terms WHERE term IN (" + ", ".join(["%s"] * len(chunk)) + ")",
+            chunk
+        )
+        known.update(row[0] for row in cur.fetchall())
+    new_terms = [term for term in terms if term not in known]
+    if new_terms:
+        insert_many(cur, "search_terms", ("term",), [(term,) for term in new_terms], update=("term",))
+        insert_many(cur, "search_trigrams", ("trigram", "term_length", "term"),
+                    [(gram, len(term), term) for term in new_terms for gram in trigrams(term)],
+                    update=("term",))
+
+
+def rebuild_search_index(db, batch_size=1000):
+    """Re-index every product, one id range per transaction. Returns products indexed.
+
+    The vocabulary is cleared first and refilled as products are indexed, so
+    searches can miss products until the rebuild finishes.
+    """
+    cur = db.cursor()
+    cur.execute("DELETE FROM search_trigrams")
+    cur.execute("DELETE FROM search_terms")
+    db.commit()
+    last_id, indexed = 0, 0
+    while True:
+        cur.execute(
+            "SELECT id, folder_id, name FROM products WHERE id > %s ORDER BY id LIMIT %s",
+            (last_id, batch_size)
+        )
+        products = cur.fetchall()
+        if not products:
+            break
+        ids = [row[0] for row in products]
+        marks = ", ".join(["%s"] * len(ids))
+        cur.execute(f"DELETE FROM search_postings WHERE product_id IN ({marks})", ids)
+        cur.execute(f"""
+            SELECT v.product_id, v.field_id, fl.folder_id, v.value
+            FROM field_values v
+            JOIN fields fl ON fl.id = v.field_id
+            WHERE v.product_id IN ({marks}) AND fl.field_type <> 'number'
+        """, ids)
+        docs = [(pid, NAME_FIELD, folder_id, name) for pid, folder_id, name in products]
+        docs += cur.fetchall()
+        _add_postings(cur, docs)
+        db.commit()
+        last_id = ids[-1]
+        indexed += len(ids)
+    cur.close()
+    return indexed
+
+
+# --- QUERYING ---
+def _successor(prefix):
+    """The smallest string greater than every string starting with prefix."""
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def within_edits(a, b, limit):
+    """True if a and b are at most `limit` edits apart.
+
+    Edits are insertions, deletions, substitutions and swaps of adjacent
+    characters (optimal string alignment distance).
+    """
+    if abs(len(a) - len(b)) > limit:
+        return False
+    before, previous = None, list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            cost = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb))
+            if i > 1 and j > 1 and ca == b[j - 2] and a[i - 2] == cb:
+                cost = min(cost, before[j - 2] + 1)
+            current.append(cost)
+        if min(current) > limit:
+            return False
+        before, previous = previous, current
+    return previous[-1] <= limit
+
+
+def _prefix_terms(cur, token):
+    cur.execute(
+        "SELECT term FROM search_terms WHERE term >= %s AND term < %s ORDER BY term LIMIT %s",
+        (token, _successor(token), MAX_PREFIX_TERMS)
+    )
+    return [row[0] for row in cur.fetchall()]
+
+
+def _similar_terms(cur, token):
+    edits = 1 if len(token) < 8 else 2
+    grams = trigrams(token)
+    # One edit changes at most four trigrams (a swap; others change three).
+    needed = max(1, len(grams) - 4 * edits)
+    cur.execute(
+        "SELECT term, COUNT(*) AS shared FROM search_trigrams WHERE trigram IN ("
+        + ", ".join(["%s"] * len(grams)) + ") AND term_length BETWEEN %s AND %s "
+        "GROUP BY term HAVING COUNT(*) >= %s ORDER BY shared DESC LIMIT 200",
+        grams + [len(token) - edits, len(token) + edits, needed]
+    )
+    return [row[0] for row in cur.fetchall() if row[0] != token and within_edits(token, row[0], edits)]
+
+
+def _collect(cur, hits, terms, token, typo, folder_id, hidden_fields, within):
+    where = ["term IN (" + ", ".join(["%s"] * len(terms)) + ")"]
+    params = list(terms)
+    if within is not None:
+        where.append("product_id IN (" + ", ".join(["%s"] * len(within)) + ")")
+        params += sorted(within)
+    if folder_id is not None:
+        where.append("folder_id = %s")
+        params.append(folder_id)
+    cur.execute(
+        f"SELECT term, product_id, field_id FROM search_postings WHERE {' AND '.join(where)} LIMIT %s",
+        params + [SEARCH_CANDIDATES]
+    )
+    for term, product_id, field_id in cur.fetchall():
+        if field_id in hidden_fields:
+            continue
+        score = TYPO if typo else (EXACT if term == token else PREFIX)
+        if field_id == NAME_FIELD:
+            score *= 2
+        best = hits.get(product_id)
+        if best is None:
+            hits[product_id] = [score, {field_id}]
+        else:
+            if score > best[0]:
+                best[0] = score
+            best[1].add(field_id)
+
+
+def search_products(db, query, limit=SEARCH_DEFAULT_LIMIT, folder_id=None):
+    """Ranked products matching every token of `query`, at most `limit` of them."""
+    # Longest token first: it is usually the most selective, and the others
+    # are only looked up among the products it matched.
+    tokens = sorted(tokenize(query)[:MAX_QUERY_TOKENS], key=len, reverse=True)
+    if not tokens:
+        return []
+    cur = db.cursor()
+    try:
+        cur.execute("SELECT id FROM fields WHERE deleted_at IS NOT NULL")
+        hidden_fields = {row[0] for row in cur.fetchall()}
+        matched = None
+        for token in tokens:
+            hits = {}
+            terms = _prefix_terms(cur, token)
+            if terms:
+                _collect(cur, hits, terms, token, False, folder_id, hidden_fields, matched)
+            if len(hits) < limit and len(token) >= FUZZY_MIN_LENGTH:
+                similar = _similar_terms(cur, token)
+                if similar:
+                    _collect(cur, hits, similar, token, True, folder_id, hidden_fields, matched)
+            if matched is None:
+                matched = hits
+            else:
+                matched = {
+                    pid: [score + hits[pid][0], fields | hits[pid][1]]
+                    for pid, (score, fields) in matched.items() if pid in hits
+                }
+            if not matched:
+                return []
+    finally:
+        cur.close()
+
+    ranking = [(-score, pid, fields) for pid, (score, fields) in matched.items()]
+    # Products in folders being deleted drop out when loaded, so read a little
+    # past the limit, and rank the rest only if that was not enough.
+    ranked = heapq.nsmallest(limit * 2, ranking)
+    cur = db.cursor(dictionary=True)
+    try:
+        results = _load_results(cur, ranked)
+        if len(results) < limit and len(ranking) > len(ranked):
+            ranked = sorted(ranking)[len(ranked):]
+            for start in range(0, len(ranked), limit * 2):
+                results += _load_results(cur, ranked[start:start + limit * 2])
+                if len(results) >= limit:
+                    break
+    finally:
+        cur.close()
+    return results[:limit]
+
+
+def _load_results(cur, ranked):
+    ids = [pid for _, pid, _ in ranked]
+    marks = ", ".join(["%s"] * len(ids))
+    cur.execute(f"""
+        SELECT p.id, p.name, p.folder_id, f.name AS folder
+        FROM products p
+        JOIN folders f ON f.id = p.folder_id
+        WHERE p.id IN ({marks}) AND f.deleted_at IS NULL
+    """, ids)
+    products = {row['id']: row for row in cur.fetchall()}
+    cur.execute(f"""
+        SELECT v.product_id, v.field_id, fl.name, v.value
+        FROM field_values v
+        JOIN fields fl ON fl.id = v.field_id
+        WHERE v.product_id IN ({marks}) AND fl.field_type <> 'number'
+    """, ids)
+    values = {(row['product_id'], row['field_id']): row for row in cur.fetchall()}
+
+    results = []
+    for negated_score, pid, fields in ranked:
+        product = products.get(pid)
+        if product is None:
+            continue
+        product['score'] = -negated_score
+        product['matches'] = [
+            {"field_id": field_id, "field": values[(pid, field_id)]['name'], "value": values[(pid, field_id)]['value']}
+            for field_id in sorted(fields)
+            if field_id != NAME_FIELD and (pid, field_id) in values
+        ]
+        results.append(product)
+    return results
+
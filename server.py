@@ -5,77 +5,283 @@ A Flask-based REST API for the StockFlow inventory management system.
 Handles authentication, product management, and analytics queries.
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g
+from flask.json.provider import DefaultJSONProvider
 
 from flask_cors import CORS
-import mysql.connector
 from dotenv import load_dotenv
 import os
-import bcrypt
 import secrets
+import time
 from datetime import datetime, timedelta
+from concurrent.futures import TimeoutError as FutureTimeout
 from functools import wraps
 
+# Load .env before the local modules below read their settings
 load_dotenv()
 
+from db import get_pool, get_background_pool, insert_many, PoolTimeout
+from analytics import dashboard, metric_chart
+from history import history_series, HistoryError
+from changes import ChangeSet, load_fields
+from versions import (GLOBAL, FOLDERS, folder_scope, bump_versions, read_versions,
+                      make_etag, cache as response_cache)
+from bulk import (ProductImporter, ProductBatchUpdater, RecordError, BATCH_UPDATE_MAX_ITEMS, decode_lines,
+                  iter_csv, iter_ndjson, iter_products, export_csv, export_ndjson)
+from adjust import (apply_adjustments, parse_adjustment, sum_adjustments, buffer as adjust_buffer,
+                    ADJUST_MAX_ITEMS, ADJUST_ACK_TIMEOUT)
+from pagination import PageRequest, PageError, keyset_page, name_prefix_clause, product_page
+from alerts import alerts_since, list_rules, create_rule, delete_rule, RuleError, ALERT_PAGE_SIZE
+from search import search_products, SEARCH_DEFAULT_LIMIT, SEARCH_MAX_LIMIT
+from sync import changes_since, tombstone_products, SyncCursorError, SyncReset, SYNC_PAGE_SIZE
+from jobs import hide_folder, hide_field, get_job, runner as job_runner
+from replicas import (router as replica_router, wrote_recently, LAST_WRITE_COOKIE, LAST_WRITE_HEADER,
+                      READ_YOUR_WRITES_SECONDS)
+from passwords import hasher, HasherBusy
+from sessions import lookup_session, revoke_session, enforce_session_cap, stats as session_stats
+from retention import sweeper as retention_sweeper
+from metrics import begin_request, end_request, timing, registry as metrics_registry
+from compression import compress_response
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """Counts JSON encoding towards the request's `serialize` timing."""
+
+    def dumps(self, obj, **kwargs):
+        with timing("serialize"):
+            return super().dumps(obj, **kwargs)
+
 app = Flask(__name__)
-CORS(app)
+app.json = TimedJSONProvider(app)
+CORS(app, expose_headers=[LAST_WRITE_HEADER, "X-Read-From"])
 
 def get_db():
-    return mysql.connector.connect(
-        host=os.getenv("MYSQL_HOST"),
-        user=os.getenv("MYSQL_USER"),
-        password=os.getenv("MYSQL_PASSWORD"),
-        database=os.getenv("MYSQL_DB"),
-        port=os.getenv("MYSQL_PORT")
-    )
+    """Borrow a pooled connection for the current request.
+
+    The same connection is reused for the rest of the request (so the auth
+    check and the handler share it) and is returned to the pool on teardown.
+    GET requests to @read_replica views may get a replica instead.
+    """
+    if 'db' not in g:
+        with timing("connect"):
+            g.db = _acquire_for_request()
+    return g.db
+
+def _acquire_for_request():
+    if g.get('read_replica') and replica_router.enabled and not _wrote_recently():
+        routed = replica_router.acquire()
+        if routed is not None:
+            g.read_from, conn = routed
+            return conn
+    g.read_from = 'primary'
+    return get_pool().acquire()
+
+def _wrote_recently():
+    return (wrote_recently(request.headers.get(LAST_WRITE_HEADER))
+            or wrote_recently(request.cookies.get(LAST_WRITE_COOKIE)))
+
+def _route_label():
+    return request.url_rule.rule if request.url_rule is not None else "unmatched"
+
+@app.before_request
+def start_request_timing():
+    begin_request(_route_label())
+
+@app.after_request
+def finish_request_timing(response):
+    timings = end_request()
+    if timings is not None:
+        elapsed = timings.elapsed()
+        response.headers['Server-Timing'] = timings.server_timing(elapsed)
+        metrics_registry.observe(request.method, _route_label(), response.status_code, elapsed, timings)
+    return response
+
+@app.after_request
+def mark_writes(response):
+    # Read-your-writes for replica routing: the client echoes the stamp back
+    # (header or cookie) and reads from the primary for a while. Logging in
+    # or out changes no data.
+    if replica_router.enabled:
+        if (request.method in ("POST", "PUT", "PATCH", "DELETE") and response.status_code < 400
+                and request.endpoint not in ("login", "logout")):
+            stamp = str(int(time.time() * 1000))
+            response.headers[LAST_WRITE_HEADER] = stamp
+            response.set_cookie(LAST_WRITE_COOKIE, stamp, max_age=int(READ_YOUR_WRITES_SECONDS) + 1,
+                                httponly=True, samesite='Lax')
+        if 'read_from' in g:
+            response.headers['X-Read-From'] = g.read_from
+    return response
+
+@app.after_request
+def compress(response):
+    return compress_response(response, request.accept_encodings, response_cache)
+
+@app.before_request
+def start_background_tasks():
+    # Started lazily so each gunicorn worker runs its own threads after fork.
+    retention_sweeper.ensure_started()
+    job_runner.ensure_started()
+    replica_router.ensure_started()
+    adjust_buffer.ensure_started()
+
+@app.teardown_appcontext
+def release_db(exc):
+    db = g.pop('db', None)
+    if db is not None:
+        db.close()
+
+@app.errorhandler(HasherBusy)
+def handle_hasher_busy(err):
+    response = jsonify({"error": "Too many logins in progress, please retry", "code": "AUTH_BUSY"})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+@app.errorhandler(PoolTimeout)
+def handle_pool_timeout(err):
+    return jsonify({"error": "Database busy, please retry", "code": "DB_POOL_TIMEOUT"}), 503
+
+# --- DIAGNOSTICS ---
+@app.route("/stats/pool", methods=["GET"])
+def pool_stats():
+    stats = get_pool().stats()
+    if get_background_pool() is not get_pool():
+        stats["background"] = get_background_pool().stats()
+    return jsonify(stats)
+
+@app.route("/stats/sessions", methods=["GET"])
+def sessions_stats():
+    return jsonify(session_stats())
+
+@app.route("/stats/retention", methods=["GET"])
+def retention_stats():
+    return jsonify(retention_sweeper.stats())
+
+@app.route("/stats/cache", methods=["GET"])
+def cache_stats():
+    return jsonify(response_cache.stats())
+
+@app.route("/stats/jobs", methods=["GET"])
+def job_stats():
+    return jsonify(job_runner.stats())
+
+@app.route("/stats/adjust", methods=["GET"])
+def adjust_stats():
+    return jsonify(adjust_buffer.stats())
+
+@app.route("/stats/replicas", methods=["GET"])
+def replica_stats():
+    return jsonify(replica_router.stats())
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    gauges = {
+        f"stockflow_db_pool_{key}": (f"Connection pool {key} (this worker).", value)
+        for key, value in get_pool().stats().items() if isinstance(value, (int, float))
+    }
+    cache = response_cache.stats()
+    gauges["stockflow_response_cache_hits"] = ("Response cache hits (this worker).", cache["hits"])
+    gauges["stockflow_response_cache_misses"] = ("Response cache misses (this worker).", cache["misses"])
+    return app.response_class(metrics_registry.render(gauges), mimetype="text/plain; version=0.0.4")
 
 # --- AUTHENTICATION MIDDLEWARE ---
+def get_request_token():
+    """Return the bearer token sent with the request, if any"""
+    token = request.headers.get('Authorization')
+    # Remove 'Bearer ' prefix if present
+    if token and token.startswith('Bearer '):
+        token = token[7:]
+    return token or None
+
+def check_admin():
+    """Validate the request's token. Returns an error response, or None if authorised."""
+    token = get_request_token()
+    if not token:
+        return jsonify({"error": "Authentication required", "code": "AUTH_REQUIRED"}), 401
+
+    db = get_db()
+    with timing("auth"):
+        session = lookup_session(db, token)
+    if not session:
+        return jsonify({"error": "Invalid or expired token", "code": "INVALID_TOKEN"}), 401
+
+    # Add user info to request context
+    request.user = session
+    return None
+
 def require_admin(f):
     """Decorator to require admin authentication for write operations"""
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        token = request.headers.get('Authorization')
-        
-        if not token:
-            return jsonify({"error": "Authentication required", "code": "AUTH_REQUIRED"}), 401
-        
-        # Remove 'Bearer ' prefix if present
-        if token.startswith('Bearer '):
-            token = token[7:]
-        
-        db = get_db()
-        cur = db.cursor(dictionary=True)
-        
-        # Check if token is valid and not expired
-        cur.execute("""
-            SELECT s.*, u.username 
-            FROM sessions s 
-            JOIN admin_users u ON s.user_id = u.id 
-            WHERE s.token = %s AND s.expires_at > NOW()
-        """, (token,))
-        
-        session = cur.fetchone()
-        cur.close()
-        db.close()
-        
-        if not session:
-            return jsonify({"error": "Invalid or expired token", "code": "INVALID_TOKEN"}), 401
-        
-        # Add user info to request context
-        request.user = session
+        denied = check_admin()
+        if denied:
+            return denied
         return f(*args, **kwargs)
     
     return decorated_function
 
 
+# --- READ ROUTING ---
+def read_replica(f):
+    """Let GET requests to this view read from a replica (see replicas.py).
+
+    Goes above @cached_response, so the ETag versions come from the same
+    server as the body.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if request.method == "GET":
+            g.read_replica = True
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+# --- RESPONSE CACHE ---
+def _folder_arg_scopes(kwargs):
+    folder_id = kwargs.get('folder_id') or request.args.get('folder_id', type=int)
+    return [folder_scope(folder_id)] if folder_id else [GLOBAL]
+
+def cached_response(scopes):
+    """Serve GET responses from the versioned cache, with ETag/If-None-Match support.
+
+    `scopes` is a list of version scopes, or a callable taking the view kwargs
+    and returning one. Other methods pass straight through to the view.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if request.method != "GET":
+                return f(*args, **kwargs)
+
+            view_scopes = scopes(kwargs) if callable(scopes) else scopes
+            versions = read_versions(get_db(), view_scopes)
+            etag = make_etag(request.full_path, versions)
+
+            # Weak comparison: compressed responses carry the ETag as W/"...".
+            if request.if_none_match.contains_weak(etag):
+                response = app.response_class(status=304)
+            else:
+                entry = response_cache.get(etag)
+                if entry is not None:
+                    body, mimetype = entry
+                    response = app.response_class(body, mimetype=mimetype)
+                else:
+                    response = app.make_response(f(*args, **kwargs))
+                    if response.status_code != 200:
+                        return response
+                    response_cache.put(etag, response.get_data(), response.mimetype)
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
+        return decorated_function
+    return decorator
+
+
 # --- TEMPORARY RESET ROUTE ---
 @app.route("/reset-admin", methods=["GET"])
 def reset_admin_password():
+    password = 'admin123'
+    hashed = hasher.hash(password)
     db = get_db()
     cur = db.cursor()
-    password = 'admin123'
-    hashed = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
     
     # Update or Create Admin
     cur.execute("SELECT * FROM admin_users WHERE username = 'admin'")
@@ -86,7 +292,6 @@ def reset_admin_password():
         
     db.commit()
     cur.close()
-    db.close()
     return jsonify({"message": "Admin password reset to 'admin123' using server-side bcrypt."})
 
 # --- AUTHENTICATION ROUTES ---
@@ -107,16 +312,25 @@ def login():
     cur.execute("SELECT * FROM admin_users WHERE username = %s", (username,))
     user = cur.fetchone()
     
+    cur.close()
     if not user:
-        cur.close()
-        db.close()
         return jsonify({"error": "Invalid credentials"}), 401
     
+    # Don't hold a pooled connection while bcrypt runs
+    release_db(None)
+    
     # Verify password
-    if not bcrypt.checkpw(password.encode('utf-8'), user['password_hash'].encode('utf-8')):
-        cur.close()
-        db.close()
-        return jsonify({"error": "Invalid credentials"}), 401
+    with timing("auth"):
+        if not hasher.verify(password, user['password_hash']):
+            return jsonify({"error": "Invalid credentials"}), 401
+    
+        # Transparently upgrade hashes made with an old BCRYPT_ROUNDS
+        new_hash = hasher.hash(password) if hasher.needs_rehash(user['password_hash']) else None
+    
+    db = get_db()
+    cur = db.cursor()
+    if new_hash:
+        cur.execute("UPDATE admin_users SET password_hash = %s WHERE id = %s", (new_hash, user['id']))
     
     # Generate session token
     token = secrets.token_urlsafe(32)
@@ -127,9 +341,9 @@ def login():
         "INSERT INTO sessions (user_id, token, expires_at) VALUES (%s, %s, %s)",
         (user['id'], token, expires_at)
     )
+    enforce_session_cap(db, user['id'])
     db.commit()
     cur.close()
-    db.close()
     
     return jsonify({
         "token": token,
@@ -139,44 +353,23 @@ def login():
 
 @app.route("/auth/logout", methods=["POST"])
 def logout():
-    token = request.headers.get('Authorization')
-    
-    if token and token.startswith('Bearer '):
-        token = token[7:]
+    token = get_request_token()
     
     if token:
-        db = get_db()
-        cur = db.cursor()
-        cur.execute("DELETE FROM sessions WHERE token = %s", (token,))
-        db.commit()
-        cur.close()
-        db.close()
+        revoke_session(get_db(), token)
     
     return jsonify({"message": "Logged out successfully"}), 200
 
 @app.route("/auth/verify", methods=["GET"])
 def verify_token():
-    token = request.headers.get('Authorization')
+    token = get_request_token()
     
     if not token:
         return jsonify({"valid": False}), 200
     
-    if token.startswith('Bearer '):
-        token = token[7:]
-    
     db = get_db()
-    cur = db.cursor(dictionary=True)
-    
-    cur.execute("""
-        SELECT s.*, u.username 
-        FROM sessions s 
-        JOIN admin_users u ON s.user_id = u.id 
-        WHERE s.token = %s AND s.expires_at > NOW()
-    """, (token,))
-    
-    session = cur.fetchone()
-    cur.close()
-    db.close()
+    with timing("auth"):
+        session = lookup_session(db, token)
     
     if session:
         return jsonify({
@@ -190,141 +383,198 @@ def verify_token():
 
 # --- ANALYTICS ---
 @app.route("/analytics/metrics", methods=["GET"])
+@read_replica
+@cached_response([GLOBAL])
 def get_analytics_metrics():
     db = get_db()
     cur = db.cursor(dictionary=True)
-    cur.execute("SELECT DISTINCT name FROM fields WHERE field_type = 'number'")
+    cur.execute("SELECT DISTINCT name FROM fields WHERE field_type = 'number' AND deleted_at IS NULL")
     metrics = [row['name'] for row in cur.fetchall()]
     cur.close()
-    db.close()
     return jsonify(metrics)
 
 @app.route("/analytics/data", methods=["GET"])
+@read_replica
+@cached_response([GLOBAL])
 def get_analytics_data():
     metric_name = request.args.get('metric')
     if not metric_name:
         return jsonify({"labels": [], "values": [], "total": 0})
 
-    db = get_db()
-    cur = db.cursor(dictionary=True)
-    
-    # Sum up the value for every folder that has this metric
-    query = """
-        SELECT 
-            f.name as label, 
-            COALESCE(SUM(CAST(NULLIF(v.value, '') AS DECIMAL(10,2))), 0) as value
-        FROM folders f
-        JOIN fields fl ON f.id = fl.folder_id
-        JOIN products p ON f.id = p.folder_id
-        LEFT JOIN field_values v ON p.id = v.product_id AND v.field_id = fl.id
-        WHERE fl.name = %s AND fl.field_type = 'number'
-        GROUP BY f.id
-    """
-    cur.execute(query, (metric_name,))
-    data = cur.fetchall()
-    
-    # Format for Charts (Lists are easier for Bar/Line charts)
-    labels = []
-    values = []
-    total = 0.0
-
-    for row in data:
-        val = float(row['value'])
-        labels.append(row['label'])
-        values.append(val)
-        total += val
-    
+    cur = get_db().cursor(dictionary=True)
+    # Per-folder totals are maintained on write in metric_aggregates
+    chart = metric_chart(cur, metric_name)
     cur.close()
-    db.close()
-    return jsonify({
-        "labels": labels, 
-        "values": values, 
-        "total": total
-    })
+    return jsonify(chart)
+
+@app.route("/analytics/dashboard", methods=["GET"])
+@read_replica
+@cached_response(_folder_arg_scopes)
+def get_analytics_dashboard():
+    """Every number metric's chart in one response, globally or for ?folder_id="""
+    folder_id = request.args.get('folder_id', type=int)
+    cur = get_db().cursor(dictionary=True)
+    charts = dashboard(cur, folder_id)
+    cur.close()
+    return jsonify({"metrics": sorted(charts), "data": charts})
 
 # --- FOLDER-SPECIFIC ANALYTICS ---
 @app.route("/analytics/folder/<int:folder_id>/metrics", methods=["GET"])
+@read_replica
+@cached_response(_folder_arg_scopes)
 def get_folder_analytics_metrics(folder_id):
     db = get_db()
     cur = db.cursor(dictionary=True)
-    cur.execute("SELECT DISTINCT name FROM fields WHERE folder_id = %s AND field_type = 'number'", (folder_id,))
+    cur.execute(
+        "SELECT DISTINCT name FROM fields WHERE folder_id = %s AND field_type = 'number' AND deleted_at IS NULL",
+        (folder_id,)
+    )
     metrics = [row['name'] for row in cur.fetchall()]
     cur.close()
-    db.close()
     return jsonify(metrics)
 
 @app.route("/analytics/folder/<int:folder_id>/data", methods=["GET"])
+@read_replica
+@cached_response(_folder_arg_scopes)
 def get_folder_analytics_data(folder_id):
     metric_name = request.args.get('metric')
     if not metric_name:
         return jsonify({"labels": [], "values": [], "total": 0})
 
-    db = get_db()
-    cur = db.cursor(dictionary=True)
-    
-    # Sum up the value for every product in this folder for the specified metric
-    query = """
-        SELECT 
-            p.name as label, 
-            COALESCE(CAST(NULLIF(v.value, '') AS DECIMAL(10,2)), 0) as value
-        FROM products p
-        JOIN fields fl ON p.folder_id = fl.folder_id
-        LEFT JOIN field_values v ON p.id = v.product_id AND v.field_id = fl.id
-        WHERE p.folder_id = %s AND fl.name = %s AND fl.field_type = 'number'
-    """
-    cur.execute(query, (folder_id, metric_name))
-    data = cur.fetchall()
-    
-    # Format for Charts
-    labels = []
-    values = []
-    total = 0.0
-
-    for row in data:
-        val = float(row['value'])
-        labels.append(row['label'])
-        values.append(val)
-        total += val
-    
+    cur = get_db().cursor(dictionary=True)
+    chart = metric_chart(cur, metric_name, folder_id)
     cur.close()
-    db.close()
-    return jsonify({
-        "labels": labels, 
-        "values": values, 
-        "total": total
-    })
+    return jsonify(chart)
+
+# Not behind the response cache: without ?to= the window ends at the current time.
+@app.route("/analytics/history", methods=["GET"])
+@read_replica
+def get_analytics_history():
+    """A metric's totals over time (?grain=hour|day&from=&to=[&folder_id=]), from the rollups"""
+    metric_name = request.args.get('metric')
+    if not metric_name:
+        return jsonify({"error": "metric is required"}), 400
+    cur = get_db().cursor(dictionary=True)
+    try:
+        return jsonify(history_series(cur, metric_name, request.args, request.args.get('folder_id', type=int)))
+    except HistoryError as err:
+        return jsonify({"error": str(err)}), 400
+    finally:
+        cur.close()
 
 
 # --- CRUD ROUTES ---
+def _int_or_none(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def _bump_field_folder(db, field_id):
+    cur = db.cursor()
+    cur.execute("SELECT folder_id FROM fields WHERE id=%s", (field_id,))
+    row = cur.fetchone()
+    cur.close()
+    bump_versions(db, *([folder_scope(row[0])] if row else []))
+
+PRODUCT_COLUMNS = ("id", "name", "created_at", "updated_at")
+
+def _iso(stamp):
+    return stamp.isoformat() if stamp is not None else None
+
+def fetch_products(cur, folder_id, page, columnar=False):
+    """Load one page of a folder's products with their field values attached.
+
+    Uses three queries regardless of how many products the page holds: the
+    folder's fields, the products, and their values. Each product gets a
+    `values` list with one {id, name, value} entry per field (value is None
+    when unset), in field order. Returns (products, next_cursor); an
+    unpaginated PageRequest returns the whole folder.
+
+    With `columnar`, returns ({fields, columns, products}, next_cursor)
+    instead: the fields once, and each product as a list of its
+    PRODUCT_COLUMNS followed by one value per field, in field order.
+    Timestamps there are ISO 8601 strings, which also spares the JSON
+    encoder its per-datetime fallback.
+    """
+    cur.execute(
+        "SELECT id, name, field_type FROM fields WHERE folder_id = %s AND deleted_at IS NULL ORDER BY id",
+        (folder_id,)
+    )
+    fields = cur.fetchall()
+
+    products, next_cursor = product_page(cur, folder_id, page, {f['id']: f for f in fields})
+    values = {}
+    if products and page.paginated:
+        ids = [p['id'] for p in products]
+        cur.execute(
+            "SELECT product_id, field_id, value FROM field_values WHERE product_id IN ("
+            + ", ".join(["%s"] * len(ids)) + ")",
+            ids
+        )
+        values = {(row['product_id'], row['field_id']): row['value'] for row in cur.fetchall()}
+    elif products:
+        cur.execute("""
+            SELECT v.product_id, v.field_id, v.value
+            FROM field_values v
+            JOIN products p ON p.id = v.product_id
+            WHERE p.folder_id = %s
+        """, (folder_id,))
+        values = {(row['product_id'], row['field_id']): row['value'] for row in cur.fetchall()}
+
+    if columnar:
+        field_ids = [f['id'] for f in fields]
+        rows = [
+            [p['id'], p['name'], _iso(p['created_at']), _iso(p['updated_at'])]
+            + [values.get((p['id'], fid)) for fid in field_ids]
+            for p in products
+        ]
+        return {"fields": fields, "columns": list(PRODUCT_COLUMNS), "products": rows}, next_cursor
+
+    for p in products:
+        p['values'] = [
+            {"id": f['id'], "name": f['name'], "value": values.get((p['id'], f['id']))}
+            for f in fields
+        ]
+    return products, next_cursor
+
+def list_response(rows, page, next_cursor):
+    """A plain list for unpaginated requests, {items, next_cursor} otherwise."""
+    if page.paginated:
+        return jsonify({"items": rows, "next_cursor": next_cursor})
+    return jsonify(rows)
+
 @app.route("/folders", methods=["GET", "POST"])
+@read_replica
+@cached_response([FOLDERS])
 def manage_folders():
     db = get_db()
     cur = db.cursor(dictionary=True)
     if request.method == "POST":
         # Check authentication for POST
-        token = request.headers.get('Authorization')
-        if not token or not token.startswith('Bearer '):
-            return jsonify({"error": "Authentication required", "code": "AUTH_REQUIRED"}), 401
-        
-        token = token[7:]
-        cur.execute("""
-            SELECT s.* FROM sessions s 
-            WHERE s.token = %s AND s.expires_at > NOW()
-        """, (token,))
-        if not cur.fetchone():
+        denied = check_admin()
+        if denied:
             cur.close()
-            db.close()
-            return jsonify({"error": "Invalid or expired token", "code": "INVALID_TOKEN"}), 401
+            return denied
         
         data = request.json
         cur.execute("INSERT INTO folders (name) VALUES (%s)", (data['name'],))
+        bump_versions(db, FOLDERS, folder_scope(cur.lastrowid))
         db.commit()
         return jsonify({"message": "Created"}), 201
-    cur.execute("SELECT * FROM folders")
-    res = cur.fetchall()
+    try:
+        page = PageRequest(request.args, sorts=("id", "name"), prefix=True)
+    except PageError as err:
+        cur.close()
+        return jsonify({"error": str(err)}), 400
+    where, params = ["deleted_at IS NULL"], []
+    if page.prefix:
+        clause, pattern = name_prefix_clause("name", page.prefix)
+        where.append(clause)
+        params.append(pattern)
+    res, next_cursor = keyset_page(cur, "SELECT * FROM folders", where, params, page)
     cur.close()
-    db.close()
-    return jsonify(res)
+    return list_response(res, page, next_cursor)
 
 @app.route("/folders/<int:id>", methods=["PUT"])
 @require_admin
@@ -333,21 +583,56 @@ def update_folders(id):
     db = get_db()
     cur = db.cursor()
     cur.execute("UPDATE folders SET name=%s WHERE id=%s", (data['name'], id))
+    bump_versions(db, FOLDERS, folder_scope(id))
     db.commit()
     cur.close()
-    db.close()
     return jsonify({"message": "Folder updated"})
 
 @app.route("/folders/<int:id>", methods=["DELETE"])
 @require_admin
 def delete_folder(id):
+    """Hide the folder now; its products and fields are deleted by a background job."""
     db = get_db()
-    cur = db.cursor()
-    cur.execute("DELETE FROM folders WHERE id=%s", (id,))
+    job_id = hide_folder(db, id)
+    if job_id is None:
+        return jsonify({"error": "Folder not found"}), 404
     db.commit()
+    job_runner.wake()
+    return jsonify({"message": "Folder deleted", "job_id": job_id}), 202
+
+@app.route("/folders/<int:id>/export", methods=["GET"])
+@read_replica
+def export_folder(id):
+    """Stream every product in a folder as CSV (one column per field) or NDJSON."""
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in ('csv', 'ndjson'):
+        return jsonify({"error": "format must be csv or ndjson"}), 400
+
+    db = get_db()
+    cur = db.cursor(dictionary=True)
+    cur.execute("SELECT id, name FROM folders WHERE id=%s AND deleted_at IS NULL", (id,))
+    folder = cur.fetchone()
+    cur.execute("SELECT id, name FROM fields WHERE folder_id=%s AND deleted_at IS NULL ORDER BY id", (id,))
+    fields = cur.fetchall()
     cur.close()
-    db.close()
-    return jsonify({"message": "Folder deleted"})
+    if not folder:
+        return jsonify({"error": "Folder not found"}), 404
+
+    # The stream outlives the request context, so it gets its own connection.
+    # iter_products closes it when it ends or is closed (the callbacks close
+    # it even if the encoder around it is dropped), and conn.close covers a
+    # response closed before the stream started.
+    conn = _acquire_for_request()
+    products = iter_products(conn, id)
+    if fmt == 'csv':
+        body, mimetype = export_csv(products, fields), 'text/csv'
+    else:
+        body, mimetype = export_ndjson(products, fields), 'application/x-ndjson'
+    response = app.response_class(body, mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="folder-{id}.{fmt}"'
+    response.call_on_close(products.close)
+    response.call_on_close(conn.close)
+    return response
 
 @app.route("/fields/<int:id>", methods=["PUT"])
 @require_admin
@@ -356,100 +641,261 @@ def update_field(id):
     db = get_db()
     cur = db.cursor()
     cur.execute("UPDATE fields SET name=%s WHERE id=%s", (data['name'], id))
+    _bump_field_folder(db, id)
     db.commit()
     cur.close()
-    db.close()
     return jsonify({"message": "Field updated"})
 
 @app.route("/fields/<int:id>", methods=["DELETE"])
 @require_admin
 def delete_field(id):
+    """Hide the field now; its values are deleted by a background job."""
     db = get_db()
-    cur = db.cursor()
-    cur.execute("DELETE FROM fields WHERE id=%s", (id,))
+    job_id = hide_field(db, id)
+    if job_id is None:
+        return jsonify({"error": "Field not found"}), 404
     db.commit()
-    cur.close()
-    db.close()
-    return jsonify({"message": "Field deleted"})
+    job_runner.wake()
+    return jsonify({"message": "Field deleted", "job_id": job_id}), 202
+
+@app.route("/jobs/<int:id>", methods=["GET"])
+@require_admin
+def job_status(id):
+    """Status and progress of a background job (status: pending, running, done or failed)."""
+    job = get_job(get_db(), id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
 
 @app.route("/fields", methods=["GET", "POST"])
+@read_replica
+@cached_response(_folder_arg_scopes)
 def manage_fields():
     db = get_db()
     cur = db.cursor(dictionary=True)
     folder_id = request.args.get('folder_id')
     if request.method == "POST":
         # Check authentication for POST
-        token = request.headers.get('Authorization')
-        if not token or not token.startswith('Bearer '):
-            return jsonify({"error": "Authentication required", "code": "AUTH_REQUIRED"}), 401
-        
-        token = token[7:]
-        cur.execute("""
-            SELECT s.* FROM sessions s 
-            WHERE s.token = %s AND s.expires_at > NOW()
-        """, (token,))
-        if not cur.fetchone():
+        denied = check_admin()
+        if denied:
             cur.close()
-            db.close()
-            return jsonify({"error": "Invalid or expired token", "code": "INVALID_TOKEN"}), 401
+            return denied
         
         data = request.json
+        # Locked so a concurrent hide_folder also hides the new field.
+        cur.execute("SELECT id FROM folders WHERE id = %s AND deleted_at IS NULL FOR UPDATE",
+                    (data['folder_id'],))
+        if not cur.fetchall():
+            cur.close()
+            return jsonify({"error": "Folder not found"}), 404
         cur.execute("INSERT INTO fields (name, field_type, folder_id) VALUES (%s, %s, %s)",
                     (data['name'], data['type'], data['folder_id']))
+        bump_versions(db, folder_scope(data['folder_id']))
         db.commit()
         return jsonify({"message": "Created"}), 201
-    cur.execute("SELECT * FROM fields WHERE folder_id = %s", (folder_id,))
-    res = cur.fetchall()
+    try:
+        page = PageRequest(request.args, sorts=("id", "name"), prefix=True)
+    except PageError as err:
+        cur.close()
+        return jsonify({"error": str(err)}), 400
+    where, params = ["folder_id = %s", "deleted_at IS NULL"], [folder_id]
+    if page.prefix:
+        clause, pattern = name_prefix_clause("name", page.prefix)
+        where.append(clause)
+        params.append(pattern)
+    res, next_cursor = keyset_page(cur, "SELECT * FROM fields", where, params, page)
     cur.close()
-    db.close()
-    return jsonify(res)
+    return list_response(res, page, next_cursor)
 
 @app.route("/products", methods=["GET", "POST"])
+@read_replica
+@cached_response(_folder_arg_scopes)
 def manage_products():
     db = get_db()
     cur = db.cursor(dictionary=True)
     
     if request.method == "POST":
         # Check authentication for POST
-        token = request.headers.get('Authorization')
-        if not token or not token.startswith('Bearer '):
-            return jsonify({"error": "Authentication required", "code": "AUTH_REQUIRED"}), 401
-        
-        token = token[7:]
-        cur.execute("""
-            SELECT s.* FROM sessions s 
-            WHERE s.token = %s AND s.expires_at > NOW()
-        """, (token,))
-        if not cur.fetchone():
+        denied = check_admin()
+        if denied:
             cur.close()
-            db.close()
-            return jsonify({"error": "Invalid or expired token", "code": "INVALID_TOKEN"}), 401
+            return denied
         
         data = request.json
+        # Product inserts into a folder take its row lock; see bulk.insert_products.
+        # A folder being deleted takes no new products.
+        cur.execute("SELECT id FROM folders WHERE id = %s AND deleted_at IS NULL FOR UPDATE",
+                    (data['folder_id'],))
+        if not cur.fetchall():
+            cur.close()
+            return jsonify({"error": "Folder not found"}), 404
         cur.execute("INSERT INTO products (name, folder_id) VALUES (%s, %s)", (data['name'], data['folder_id']))
         pid = cur.lastrowid
+        changes = ChangeSet(load_fields(db, data['folder_id']))
+        changes.record_name(pid, data['folder_id'], data['name'])
+        rows = []
         for fid, val in data.get('values', {}).items():
-            cur.execute("INSERT INTO field_values (product_id, field_id, value) VALUES (%s, %s, %s)", (pid, fid, val))
+            rows.append((pid, fid, val, changes.num_value(fid, val)))
+            changes.record(pid, fid, None, val)
+        insert_many(cur, "field_values", ("product_id", "field_id", "value", "num_value"), rows)
+        changes.apply(db)
+        bump_versions(db, folder_scope(data['folder_id']))
         db.commit()
+        cur.close()
         return jsonify({"message": "Saved"}), 201
 
     folder_id = request.args.get('folder_id')
-    cur.execute("SELECT * FROM products WHERE folder_id = %s", (folder_id,))
-    products = cur.fetchall()
-    
-    # Attach values
-    for p in products:
-        cur.execute("""
-            SELECT f.id, f.name, v.value 
-            FROM fields f 
-            LEFT JOIN field_values v ON f.id = v.field_id AND v.product_id = %s
-            WHERE f.folder_id = %s
-        """, (p['id'], folder_id))
-        p['values'] = cur.fetchall()
+    fmt = request.args.get('format', 'objects')
+    if fmt not in ('objects', 'columnar'):
+        cur.close()
+        return jsonify({"error": "format must be objects or columnar"}), 400
+    columnar = fmt == 'columnar'
+    try:
+        page = PageRequest(request.args, sorts=("id", "name", "created_at"),
+                           field_sort=True, prefix=True, ranges=True)
+        # A folder being deleted is empty as far as readers are concerned.
+        cur.execute("SELECT id FROM folders WHERE id = %s AND deleted_at IS NULL", (folder_id,))
+        if cur.fetchone() is None:
+            cur.close()
+            if columnar:
+                return jsonify({"fields": [], "columns": list(PRODUCT_COLUMNS), "products": [],
+                                "next_cursor": None})
+            return list_response([], page, None)
+        products, next_cursor = fetch_products(cur, folder_id, page, columnar)
+    except PageError as err:
+        cur.close()
+        return jsonify({"error": str(err)}), 400
+    cur.close()
+    if columnar:
+        products['next_cursor'] = next_cursor
+        return jsonify(products)
+    return list_response(products, page, next_cursor)
+
+@app.route("/products/import", methods=["POST"])
+@require_admin
+def import_products():
+    """Bulk-create products from a streamed CSV or NDJSON body.
 
+    CSV needs a header row with a `name` column; other columns are matched
+    to the folder's fields by name or id. NDJSON lines use the same keys, or
+    the POST /products shape with a `values` object.
+    """
+    folder_id = request.args.get('folder_id', type=int)
+    if not folder_id:
+        return jsonify({"error": "folder_id is required"}), 400
+
+    fmt = request.args.get('format')
+    if not fmt:
+        content_type = request.mimetype or ''
+        fmt = 'ndjson' if 'json' in content_type else 'csv'
+    if fmt not in ('csv', 'ndjson'):
+        return jsonify({"error": "format must be csv or ndjson"}), 400
+
+    db = get_db()
+    fields = list(load_fields(db, folder_id).values())
+    cur = db.cursor(dictionary=True)
+    cur.execute("SELECT id FROM folders WHERE id = %s AND deleted_at IS NULL", (folder_id,))
+    folder = cur.fetchone()
     cur.close()
-    db.close()
-    return jsonify(products)
+    if not folder:
+        return jsonify({"error": "Folder not found"}), 404
+
+    lines = decode_lines(request.stream)
+    records = iter_ndjson(lines) if fmt == 'ndjson' else iter_csv(lines)
+    return jsonify(ProductImporter(db, folder_id, fields).run(records)), 200
+
+@app.route("/products/batch", methods=["PUT"])
+@require_admin
+def update_products_batch():
+    """Apply name/value changes to many products in a few transactions.
+
+    Body: {"products": [{"id": 1, "name": "...", "values": {"<field_id>": "..."}}, ...]}
+    Results come back per item, in request order; a bad item does not stop
+    the others.
+    """
+    data = request.get_json(silent=True)
+    items = data.get('products') if isinstance(data, dict) else None
+    if not isinstance(items, list):
+        return jsonify({"error": "Body must be {\"products\": [...]}"}), 400
+    if len(items) > BATCH_UPDATE_MAX_ITEMS:
+        return jsonify({
+            "error": f"At most {BATCH_UPDATE_MAX_ITEMS} products per batch",
+            "code": "BATCH_TOO_LARGE"
+        }), 413
+
+    summary = ProductBatchUpdater(get_db()).run(items)
+    return jsonify(summary), 200
+
+@app.route("/products/adjust", methods=["POST"])
+@require_admin
+def adjust_products():
+    """Add deltas to number fields atomically; see adjust.py.
+
+    Body: {"adjustments": [{"product_id": 1, "field_id": 2, "delta": -1}, ...],
+           "coalesce": false}
+    Results come back per adjustment, in request order, with the value it
+    left behind. With "coalesce", the adjustments are merged with other
+    requests' into the next flush, and the response waits for it to commit.
+    """
+    data = request.get_json(silent=True)
+    items = data.get('adjustments') if isinstance(data, dict) else None
+    if not isinstance(items, list):
+        return jsonify({"error": "Body must be {\"adjustments\": [...]}"}), 400
+    if len(items) > ADJUST_MAX_ITEMS:
+        return jsonify({
+            "error": f"At most {ADJUST_MAX_ITEMS} adjustments per request",
+            "code": "BATCH_TOO_LARGE"
+        }), 413
+
+    results = [None] * len(items)
+    parsed = []
+    for index, item in enumerate(items):
+        try:
+            parsed.append((index, parse_adjustment(item)))
+        except RecordError as err:
+            results[index] = {"status": "error", "error": str(err)}
+
+    coalesce = bool(data.get('coalesce')) and adjust_buffer.enabled
+    if coalesce and parsed:
+        futures = adjust_buffer.submit([adjustment for _, adjustment in parsed])
+        # Don't hold a pooled connection while the flush runs.
+        release_db(None)
+        deadline = time.monotonic() + ADJUST_ACK_TIMEOUT
+        outcomes = []
+        for future in futures:
+            try:
+                outcomes.append(("applied", future.result(max(0.0, deadline - time.monotonic()))))
+            except RecordError as err:
+                outcomes.append(("error", str(err)))
+            except FutureTimeout:
+                outcomes.append(("pending", None))
+            except Exception as err:
+                outcomes.append(("failed", str(err)))
+    elif parsed:
+        db = get_db()
+        values, errors = apply_adjustments(db, sum_adjustments(adjustment for _, adjustment in parsed))
+        db.commit()
+        outcomes = [
+            ("applied", values[(pid, fid)]) if (pid, fid) in values else ("error", errors[(pid, fid)])
+            for _, (pid, fid, _) in parsed
+        ]
+    else:
+        outcomes = []
+
+    for (index, (product_id, field_id, delta)), (status, detail) in zip(parsed, outcomes):
+        result = {"product_id": product_id, "field_id": field_id, "delta": float(delta), "status": status}
+        if status == "applied":
+            result["value"] = detail
+        elif detail is not None:
+            result["error"] = detail
+        results[index] = result
+    if any(result['status'] in ("failed", "pending") for result in results):
+        # Nothing is known to be lost, but retrying a pending one could apply it twice.
+        return jsonify({"error": "Adjustments could not all be confirmed", "code": "ADJUST_UNCONFIRMED",
+                        "results": results}), 503
+    applied = sum(1 for result in results if result['status'] == 'applied')
+    return jsonify({"applied": applied, "failed": len(results) - applied, "coalesced": coalesce,
+                    "results": results}), 200
 
 @app.route("/products/<int:id>", methods=["PUT"])
 @require_admin
@@ -457,24 +903,42 @@ def update_product(id):
     data = request.json
     db = get_db()
     cur = db.cursor()
+    cur.execute("SELECT folder_id FROM products WHERE id=%s", (id,))
+    product = cur.fetchone()
+    if product:
+        # As for inserts: a folder being deleted takes no more writes.
+        cur.execute("SELECT id FROM folders WHERE id = %s AND deleted_at IS NULL FOR UPDATE", (product[0],))
+        if not cur.fetchall():
+            product = None
+    if not product:
+        cur.close()
+        return jsonify({"error": "Product not found"}), 404
+    changes = ChangeSet(load_fields(db, product[0]))
     
     # Update product name if provided
     if 'name' in data:
         cur.execute("UPDATE products SET name=%s WHERE id=%s", (data['name'], id))
+        changes.record_name(id, product[0], data['name'])
     
     # Update field values if provided
     if 'values' in data:
+        # Lock the current values so concurrent updates see each other's results
+        cur.execute("SELECT field_id, value FROM field_values WHERE product_id=%s FOR UPDATE", (id,))
+        old_values = dict(cur.fetchall())
+
         for field_id, value in data['values'].items():
             # Check if value exists, update or insert
             cur.execute("""
-                INSERT INTO field_values (product_id, field_id, value) 
-                VALUES (%s, %s, %s)
-                ON DUPLICATE KEY UPDATE value=%s
-            """, (id, field_id, value, value))
+                INSERT INTO field_values (product_id, field_id, value, num_value) 
+                VALUES (%s, %s, %s, %s)
+                ON DUPLICATE KEY UPDATE value=VALUES(value), num_value=VALUES(num_value)
+            """, (id, field_id, value, changes.num_value(field_id, value)))
+            changes.record(id, field_id, old_values.get(_int_or_none(field_id)), value)
+    changes.apply(db)
     
+    bump_versions(db, folder_scope(product[0]))
     db.commit()
     cur.close()
-    db.close()
     return jsonify({"message": "Product updated"})
 
 @app.route("/products/<int:id>", methods=["DELETE"])
@@ -482,11 +946,95 @@ def update_product(id):
 def delete_product(id):
     db = get_db()
     cur = db.cursor()
-    cur.execute("DELETE FROM products WHERE id=%s", (id,))
+    cur.execute("SELECT folder_id FROM products WHERE id=%s", (id,))
+    product = cur.fetchone()
+    if product:
+        changes = ChangeSet(load_fields(db, product[0]))
+        cur.execute("SELECT field_id, value FROM field_values WHERE product_id=%s FOR UPDATE", (id,))
+        for field_id, value in cur.fetchall():
+            changes.record(id, field_id, value, None)
+        tombstone_products(cur, [id])
+        cur.execute("DELETE FROM products WHERE id=%s", (id,))
+        changes.apply(db)
+        bump_versions(db, folder_scope(product[0]))
     db.commit()
     cur.close()
-    db.close()
     return jsonify({"message": "Deleted"})
 
+@app.route("/search", methods=["GET"])
+@read_replica
+@cached_response(_folder_arg_scopes)
+def search_catalog():
+    """Products whose name or text values match ?q= (prefix and typo tolerant), best first; see search.py."""
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({"error": "q is required"}), 400
+    limit = request.args.get('limit', SEARCH_DEFAULT_LIMIT, type=int)
+    if not 1 <= limit <= SEARCH_MAX_LIMIT:
+        return jsonify({"error": f"limit must be between 1 and {SEARCH_MAX_LIMIT}"}), 400
+    results = search_products(get_db(), query, limit, request.args.get('folder_id', type=int))
+    return jsonify({"query": query, "results": results})
+
+@app.route("/sync", methods=["GET"])
+def sync_changes():
+    """Changes since ?cursor= (everything when absent); see sync.py."""
+    try:
+        limit = min(int(request.args.get('limit') or SYNC_PAGE_SIZE), SYNC_PAGE_SIZE)
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    if limit < 1:
+        return jsonify({"error": "limit must be at least 1"}), 400
+    try:
+        return jsonify(changes_since(get_db(), request.args.get('cursor'), limit))
+    except SyncCursorError as err:
+        return jsonify({"error": str(err)}), 400
+    except SyncReset as err:
+        return jsonify({"error": str(err), "code": "SYNC_RESET"}), 410
+
+@app.route("/alerts", methods=["GET"])
+def alert_feed():
+    """Active low-stock alerts, then changes to them since ?cursor=; see alerts.py."""
+    try:
+        limit = min(int(request.args.get('limit') or ALERT_PAGE_SIZE), ALERT_PAGE_SIZE)
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    if limit < 1:
+        return jsonify({"error": "limit must be at least 1"}), 400
+    try:
+        return jsonify(alerts_since(get_db(), request.args.get('cursor'), limit))
+    except SyncCursorError as err:
+        return jsonify({"error": str(err)}), 400
+    except SyncReset as err:
+        return jsonify({"error": str(err), "code": "SYNC_RESET"}), 410
+
+@app.route("/alerts/rules", methods=["GET", "POST"])
+def alert_rules():
+    """Low-stock threshold rules; POST {metric, operator, threshold, folder_id?} adds one."""
+    db = get_db()
+    if request.method == "POST":
+        denied = check_admin()
+        if denied:
+            return denied
+        try:
+            rule_id = create_rule(db, request.json or {})
+        except RuleError as err:
+            db.rollback()
+            return jsonify({"error": str(err)}), 400
+        db.commit()
+        return jsonify({"message": "Rule created", "id": rule_id}), 201
+    rules = list_rules(db)
+    for rule in rules:
+        rule['threshold'] = float(rule['threshold'])
+    return jsonify(rules)
+
+@app.route("/alerts/rules/<int:id>", methods=["DELETE"])
+@require_admin
+def delete_alert_rule(id):
+    db = get_db()
+    if not delete_rule(db, id):
+        return jsonify({"error": "Rule not found"}), 404
+    db.commit()
+    return jsonify({"message": "Rule deleted"})
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000, debug=True)
\ No newline at end of file
@@ -4,15 +4,29 @@ const API_URL = process.env.EXPO_PUBLIC_API_URL || 'http://10.77.100.174:5000';
 
 const api = axios.create({ baseURL: API_URL });
 
+// Stamp of this client's last write. Sending it back keeps reads on the
+// primary database for a few seconds, so they include that write.
+let lastWrite = null;
+
 // Add token to requests automatically
 api.interceptors.request.use(async (config) => {
   const token = await AsyncStorage.getItem('auth_token');
   if (token) {
     config.headers.Authorization = `Bearer ${token}`;
   }
+  if (lastWrite) {
+    config.headers['X-Last-Write'] = lastWrite;
+  }
   return config;
 });
 
+api.interceptors.response.use((response) => {
+  if (response.headers['x-last-write']) {
+    lastWrite = response.headers['x-last-write'];
+  }
+  return response;
+});
+
 // --- AUTHENTICATION ---
 export const login = async (username, password) => {
   const response = await api.post('/auth/login', { username, password });
@@ -64,6 +78,16 @@ export const getChartData = async (metricName) => {
   const response = await api.get(`/analytics/data?metric=${metricName}`);
   return response.data;
 };
+// All metrics' chart data in one request: { metrics: [...], data: { name: { labels, values, total } } }
+export const getDashboard = async (folderId) => {
+  const query = folderId ? `?folder_id=${folderId}` : '';
+  const response = await api.get(`/analytics/dashboard${query}`);
+  return response.data;
+};
+// A metric's totals over time. params: { grain: 'hour'|'day', from, to, folder_id };
+// returns { series: [{ folder_id, folder, points: [{ start, sum, changes, min, max, last }] }] }
+export const getMetricHistory = async (metricName, params = {}) =>
+  (await api.get('/analytics/history', { params: { metric: metricName, ...params } })).data;
 export const saveMetricPreference = async (metric) => {
   await AsyncStorage.setItem('selected_metric', metric);
 };
@@ -77,9 +101,9 @@ export const createFolder = async (name) => (await api.post('/folders', { name }
 export const updateFolder = async (id, name) => {
   await api.put(`/folders/${id}`, { name });
 };
-export const deleteFolder = async (id) => {
-  await api.delete(`/folders/${id}`);
-};
+// Folders and fields disappear at once; their contents are removed by a
+// background job. Both return { job_id } for getJob.
+export const deleteFolder = async (id) => (await api.delete(`/folders/${id}`)).data;
 
 // --- FIELDS ---
 export const getFields = async (folderId) => (await api.get(`/fields?folder_id=${folderId}`)).data;
@@ -87,19 +111,62 @@ export const createField = async (data) => (await api.post('/fields', data)).dat
 export const updateField = async (id, name) => {
   await api.put(`/fields/${id}`, { name });
 };
-export const deleteField = async (id) => {
-  await api.delete(`/fields/${id}`);
-};
+export const deleteField = async (id) => (await api.delete(`/fields/${id}`)).data;
+// returns { id, kind, status: pending|running|done|failed, rows_deleted, ... }
+export const getJob = async (id) => (await api.get(`/jobs/${id}`)).data;
 
 // --- PRODUCTS ---
 export const getProducts = async (folderId) => (await api.get(`/products?folder_id=${folderId}`)).data;
+// The same products in the compact format: { fields, columns, products: [[...columns, ...values]], next_cursor }.
+// Each row holds the `columns` (id, name, created_at, updated_at), then one value per field, in `fields` order.
+export const getProductsColumnar = async (folderId, params = {}) =>
+  (await api.get('/products', { params: { folder_id: folderId, format: 'columnar', ...params } })).data;
+// Expands a columnar response into the getProducts shape.
+export const expandColumnar = ({ fields, columns, products }) =>
+  products.map((row) => {
+    const product = {};
+    columns.forEach((column, i) => { product[column] = row[i]; });
+    product.values = fields.map((f, i) => ({ id: f.id, name: f.name, value: row[columns.length + i] }));
+    return product;
+  });
+// params: { limit, cursor, sort, prefix, field, min, max }; returns { items, next_cursor }
+export const getProductsPage = async (folderId, params = {}) =>
+  (await api.get('/products', { params: { folder_id: folderId, limit: 50, ...params } })).data;
 export const createProduct = async (data) => (await api.post('/products', data)).data;
 export const updateProduct = async (id, data) => {
   await api.put(`/products/${id}`, data);
 };
+// items: [{ id, name?, values?: { [fieldId]: value } }]; returns per-item results
+export const updateProductsBatch = async (items) => (await api.put('/products/batch', { products: items })).data;
+// Relative stock changes, applied atomically: items [{ product_id, field_id, delta }].
+// With coalesce, the server merges rapid adjustments into one write and answers once it
+// has committed. Returns { applied, failed, results: [{ ..., status, value }] }.
+export const adjustStock = async (adjustments, { coalesce = false } = {}) =>
+  (await api.post('/products/adjust', { adjustments, coalesce })).data;
 export const deleteProduct = async (id) => {
   await api.delete(`/products/${id}`);
 };
+// Search names and text values across folders. params: { limit, folder_id };
+// returns { query, results: [{ id, name, folder_id, folder, score, matches }] }
+export const searchProducts = async (query, params = {}) =>
+  (await api.get('/search', { params: { q: query, ...params } })).data;
+
+// Delta sync: pass the cursor from the previous call (none for a full sync) and
+// repeat while has_more. Returns { folders, fields, products, values, deleted,
+// cursor, has_more }; a 410 SYNC_RESET means start over without a cursor.
+export const syncChanges = async (cursor) =>
+  (await api.get('/sync', { params: cursor ? { cursor } : {} })).data;
+
+// Low-stock alerts: like syncChanges, no cursor returns the active alerts and
+// later calls return changes ({ alerts: [{ ..., active }], cursor, has_more }).
+export const getAlerts = async (cursor) =>
+  (await api.get('/alerts', { params: cursor ? { cursor } : {} })).data;
+export const getAlertRules = async () => (await api.get('/alerts/rules')).data;
+// rule: { metric, operator: '<'|'<='|'>'|'>=', threshold, folder_id? }
+export const createAlertRule = async (rule) => (await api.post('/alerts/rules', rule)).data;
+export const deleteAlertRule = async (id) => {
+  await api.delete(`/alerts/rules/${id}`);
+};
 
 // Folder-specific analytics
 export const getFolderMetrics = async (folderId) => {
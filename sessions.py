@@ -0,0 +1,181 @@
+"""
+StockFlow Sessions
+------------------
+Validates bearer tokens against the `sessions` table, with a bounded
+in-process cache in front of it, and keeps the table from growing forever.
+
+Each gunicorn worker keeps its own cache. Logouts are recorded in
+`session_revocations`; every worker polls that table for new rows at most
+once per SESSION_REVOCATION_POLL seconds and drops the revoked tokens, so a
+logout on one worker is honoured by the others within that interval. Cache
+entries also expire after SESSION_CACHE_TTL seconds and never outlive the
+session's own `expires_at`.
+
+Each user may hold at most SESSION_MAX_PER_USER live sessions; logging in
+beyond that revokes the oldest. Expired sessions and old revocations are
+deleted by the retention sweeper (see retention.py).
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from retention import register as register_retention
+
+
+def _env_float(name, default):
+    value = os.getenv(name)
+    return float(value) if value else default
+
+
+class TokenCache:
+    """LRU cache of validated sessions with a per-entry time-to-live."""
+
+    def __init__(self, max_entries=1024, ttl=60.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token):
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                self.misses += 1
+                return None
+            cached_until, session = entry
+            if time.monotonic() >= cached_until or session['expires_at'] <= datetime.now():
+                del self._entries[token]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(token)
+            self.hits += 1
+            return session
+
+    def put(self, token, session):
+        with self._lock:
+            self._entries[token] = (time.monotonic() + self.ttl, session)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, token):
+        with self._lock:
+            self._entries.pop(token, None)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+cache = TokenCache(
+    max_entries=int(_env_float("SESSION_CACHE_SIZE", 1024)),
+    ttl=_env_float("SESSION_CACHE_TTL", 60.0),
+)
+
+REVOCATION_POLL = _env_float("SESSION_REVOCATION_POLL", 2.0)
+REVOCATION_RETENTION = timedelta(hours=1)
+MAX_SESSIONS_PER_USER = int(_env_float("SESSION_MAX_PER_USER", 10))
+
+register_retention("sessions", "expires_at", timedelta(0))
+register_retention("session_revocations", "revoked_at", REVOCATION_RETENTION)
+
+_revocation_lock = threading.Lock()
+_last_revocation_id = None
+_next_poll = 0.0
+_evicted_over_cap = 0
+
+
+def _sync_revocations(cur):
+    """Drop tokens that other workers revoked since the last poll."""
+    global _last_revocation_id, _next_poll
+    now = time.monotonic()
+    if now < _next_poll:
+        return
+    with _revocation_lock:
+        if now < _next_poll:
+            return
+        if _last_revocation_id is None:
+            # Nothing is cached yet, so older revocations are irrelevant.
+            cur.execute("SELECT COALESCE(MAX(id), 0) AS last_id FROM session_revocations")
+            _last_revocation_id = cur.fetchone()['last_id']
+        else:
+            cur.execute(
+                "SELECT id, token FROM session_revocations WHERE id > %s ORDER BY id",
+                (_last_revocation_id,)
+            )
+            for row in cur.fetchall():
+                cache.invalidate(row['token'])
+                _last_revocation_id = row['id']
+        _next_poll = now + REVOCATION_POLL
+
+
+def lookup_session(db, token):
+    """Return the session row (with username) for a token, or None."""
+    cur = db.cursor(dictionary=True)
+    try:
+        _sync_revocations(cur)
+        session = cache.get(token)
+        if session is not None:
+            return session
+
+        cur.execute("""
+            SELECT s.*, u.username
+            FROM sessions s
+            JOIN admin_users u ON s.user_id = u.id
+            WHERE s.token = %s AND s.expires_at > %s
+        """, (token, datetime.now()))
+        session = cur.fetchone()
+        if session:
+            cache.put(token, session)
+        return session
+    finally:
+        cur.close()
+
+
+def _revoke_tokens(cur, tokens):
+    """Delete sessions and record the revocations for the other workers."""
+    now = datetime.now()
+    for token in tokens:
+        cache.invalidate(token)
+    placeholders = ", ".join(["%s"] * len(tokens))
+    cur.execute(f"DELETE FROM sessions WHERE token IN ({placeholders})", list(tokens))
+    cur.execute(
+        "INSERT INTO session_revocations (token, revoked_at) VALUES "
+        + ", ".join(["(%s, %s)"] * len(tokens)),
+        [p for token in tokens for p in (token, now)]
+    )
+
+
+def revoke_session(db, token):
+    """Delete a session and tell the other workers to forget it."""
+    cur = db.cursor()
+    _revoke_tokens(cur, [token])
+    db.commit()
+    cur.close()
+
+
+def enforce_session_cap(db, user_id, limit=MAX_SESSIONS_PER_USER):
+    """Revoke a user's oldest live sessions beyond `limit`. Returns how many."""
+    global _evicted_over_cap
+    if not limit:
+        return 0
+    cur = db.cursor()
+    cur.execute(
+        "SELECT token FROM sessions WHERE user_id = %s AND expires_at > %s ORDER BY id DESC",
+        (user_id, datetime.now())
+    )
+    excess = [row[0] for row in cur.fetchall()[limit:]]
+    if excess:
+        _revoke_tokens(cur, excess)
+        _evicted_over_cap += len(excess)
+    cur.close()
+    return len(excess)
+
+
+def stats():
+    return {"cache": cache.stats(), "evicted_over_cap": _evicted_over_cap}
@@ -0,0 +1,173 @@
+"""
+StockFlow Delta Sync
+--------------------
+Lets the app fetch only what changed since its last sync instead of
+refetching whole lists.
+
+Folders, fields, products and field_values carry an `updated_at` that the
+database maintains on insert and update. Deletes leave a row in
+`sync_tombstones`, written when a row is deleted or hidden for deletion,
+including one per field and product removed along with a folder. Field values
+have no delete of their own: they disappear with their product or field, so
+clients drop them when they see that tombstone.
+
+GET /sync walks each entity in (updated_at, id) order from the positions in
+the client's cursor and returns at most SYNC_PAGE_SIZE rows in total, plus a
+new cursor. The first sync (no cursor) pages through everything.
+
+Only rows stamped at least SYNC_SETTLE_SECONDS ago (by the database clock)
+are returned. A transaction's rows become visible at commit, which can be
+later than their timestamps, and the settle window keeps a later commit with
+an earlier stamp from slipping behind a cursor. It must be longer than the
+slowest write transaction. Tombstones are kept for SYNC_TOMBSTONE_DAYS; a
+cursor older than that gets a reset and must start over.
+"""
+
+import base64
+import json
+import os
+from datetime import datetime, timedelta
+
+from db import dialect
+from retention import register as register_retention
+
+SYNC_PAGE_SIZE = int(os.getenv("SYNC_PAGE_SIZE", 500))
+SYNC_SETTLE_SECONDS = float(os.getenv("SYNC_SETTLE_SECONDS", 5))
+TOMBSTONE_RETENTION = timedelta(days=int(os.getenv("SYNC_TOMBSTONE_DAYS", 30)))
+
+register_retention("sync_tombstones", "deleted_at", TOMBSTONE_RETENTION)
+
+# (response key, query, position column, filter), in the order the client
+# applies them. Folders and fields being deleted (see jobs.py) already have
+# their tombstones.
+ENTITIES = (
+    ("folders", "SELECT id, name, created_at, updated_at FROM folders", "updated_at", "deleted_at IS NULL"),
+    ("fields", "SELECT id, name, field_type, folder_id, created_at, updated_at FROM fields", "updated_at",
+     "deleted_at IS NULL"),
+    ("products", "SELECT id, name, folder_id, created_at, updated_at FROM products", "updated_at", None),
+    ("values", "SELECT id, product_id, field_id, value, updated_at FROM field_values", "updated_at", None),
+    ("deleted", "SELECT id, entity, entity_id, deleted_at FROM sync_tombstones", "deleted_at", None),
+)
+TOMBSTONE_KEYS = {"folder": "folders", "field": "fields", "product": "products"}
+
+
+class SyncCursorError(ValueError):
+    """The cursor could not be decoded."""
+
+
+class SyncReset(Exception):
+    """The cursor predates the oldest kept tombstone; the client must resync from scratch."""
+
+
+def _tombstone(cur, entity, table, where, params):
+    cur.execute(
+        f"INSERT INTO sync_tombstones (entity, entity_id) SELECT %s, id FROM {table} WHERE {where}",
+        [entity] + list(params)
+    )
+
+
+def tombstone_folder(cur, folder_id):
+    """Tombstones for a folder and its visible fields.
+
+    Its products get theirs from the deletion job, one batch at a time (see jobs.py).
+    """
+    _tombstone(cur, "field", "fields", "folder_id = %s AND deleted_at IS NULL", (folder_id,))
+    _tombstone(cur, "folder", "folders", "id = %s", (folder_id,))
+
+
+def tombstone_field(cur, field_id):
+    _tombstone(cur, "field", "fields", "id = %s", (field_id,))
+
+
+def tombstone_products(cur, product_ids):
+    if product_ids:
+        _tombstone(cur, "product", "products",
+                   "id IN (" + ", ".join(["%s"] * len(product_ids)) + ")", product_ids)
+
+
+def encode_cursor(positions, issued):
+    """Opaque cursor for {name: [stamp, id]} positions (shared with alerts.py)."""
+    payload = json.dumps({"p": positions, "t": issued.isoformat(" ")}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def _parse_stamp(stamp):
+    """A cursor timestamp: naive, like the database clock it came from."""
+    moment = datetime.fromisoformat(stamp)
+    if moment.tzinfo is not None:
+        raise ValueError("cursor timestamps carry no UTC offset")
+    return moment
+
+
+def decode_cursor(token):
+    if not token:
+        return {}, None
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        positions = {
+            name: (_parse_stamp(stamp), int(row_id))
+            for name, (stamp, row_id) in data["p"].items()
+        }
+        return positions, _parse_stamp(data["t"])
+    except (ValueError, TypeError, KeyError, AttributeError):
+        raise SyncCursorError("Invalid cursor")
+
+
+def changes_since(db, token, limit=SYNC_PAGE_SIZE):
+    """One page of changes after `token`. Raises SyncCursorError or SyncReset."""
+    positions, issued = decode_cursor(token)
+    cur = db.cursor()
+    try:
+        now = dialect().now(cur)
+    finally:
+        cur.close()
+
+    cur = db.cursor(dictionary=True)
+    try:
+        if issued is not None and issued < now - TOMBSTONE_RETENTION:
+            raise SyncReset("Cursor is older than the tombstone retention period")
+        horizon = now - timedelta(seconds=SYNC_SETTLE_SECONDS)
+
+        result = {name: [] for name, _, _, _ in ENTITIES}
+        remaining = limit
+        has_more = False
+        for name, select, column, visible in ENTITIES:
+            if remaining <= 0:
+                has_more = True
+                break
+            where, params = [f"{column} <= %s"], [horizon]
+            if visible:
+                where.append(visible)
+            if name in positions:
+                where.append(f"({column}, id) > (%s, %s)")
+                params += list(positions[name])
+            cur.execute(
+                f"{select} WHERE {' AND '.join(where)} ORDER BY {column}, id LIMIT %s",
+                params + [remaining + 1]
+            )
+            rows = cur.fetchall()
+            if len(rows) > remaining:
+                rows = rows[:remaining]
+                has_more = True
+            if rows:
+                positions[name] = (rows[-1][column], rows[-1]['id'])
+            remaining -= len(rows)
+            result[name] = rows
+            if has_more:
+                break
+    finally:
+        cur.close()
+
+    deleted = {key: [] for key in TOMBSTONE_KEYS.values()}
+    for row in result.pop("deleted"):
+        key = TOMBSTONE_KEYS.get(row['entity'])
+        if key:
+            deleted[key].append(row['entity_id'])
+    result["deleted"] = deleted
+    result["cursor"] = encode_cursor(
+        {name: [stamp.isoformat(" "), row_id] for name, (stamp, row_id) in positions.items()},
+        horizon
+    )
+    result["has_more"] = has_more
+    return result
@@ -0,0 +1,38 @@
+"""Runs the app against a throwaway SQLite file, with background threads off."""
+
+import os
+import sys
+import tempfile
+
+_tmp = tempfile.mkdtemp()
+os.environ.update(DB_BACKEND="sqlite", SQLITE_PATH=os.path.join(_tmp, "stockflow.db"), BCRYPT_ROUNDS="4",
+                  RETENTION_SWEEP_INTERVAL="0", JOB_POLL_INTERVAL="0", ADJUST_FLUSH_MS="0")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import server
+from db import get_pool
+from passwords import hasher
+
+
+@pytest.fixture(scope="session")
+def client():
+    return server.app.test_client()
+
+
+@pytest.fixture(scope="session")
+def auth(client):
+    """Authorization header for the admin user."""
+    conn = get_pool().acquire()
+    cur = conn.cursor()
+    cur.execute("SELECT id FROM admin_users WHERE username = 'admin'")
+    if cur.fetchone():
+        cur.execute("UPDATE admin_users SET password_hash = %s WHERE username = 'admin'", (hasher.hash("pw"),))
+    else:
+        cur.execute("INSERT INTO admin_users (username, password_hash) VALUES ('admin', %s)", (hasher.hash("pw"),))
+    conn.commit()
+    cur.close()
+    conn.close()
+    token = client.post("/auth/login", json={"username": "admin", "password": "pw"}).get_json()["token"]
+    return {"Authorization": f"Bearer {token}"}
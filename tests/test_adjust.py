@@ -0,0 +1,49 @@
+"""Coalesced stock adjustments must resolve every request, even when a flush fails."""
+
+from decimal import Decimal
+
+import pytest
+
+from adjust import AdjustmentBuffer
+from db import PoolTimeout, get_background_pool
+
+
+@pytest.fixture(scope="module")
+def stock_value(client, auth):
+    client.post("/folders", json={"name": "Adjust"}, headers=auth)
+    folder_id = max(f["id"] for f in client.get("/folders").get_json() if f["name"] == "Adjust")
+    client.post("/fields", json={"name": "Stock", "type": "number", "folder_id": folder_id}, headers=auth)
+    field_id = client.get(f"/fields?folder_id={folder_id}").get_json()[0]["id"]
+    client.post("/products", json={"name": "Widget", "folder_id": folder_id,
+                                   "values": {str(field_id): "10"}}, headers=auth)
+    product_id = client.get(f"/products?folder_id={folder_id}").get_json()[0]["id"]
+    return product_id, field_id
+
+
+def _flaky_acquire(failures):
+    def acquire():
+        if failures:
+            failures.pop()
+            raise PoolTimeout("no connection")
+        return get_background_pool().acquire()
+    return acquire
+
+
+def test_failed_acquire_resolves_the_batch(stock_value):
+    product_id, field_id = stock_value
+    buffer = AdjustmentBuffer(_flaky_acquire([1]), window=0)
+    futures = buffer.submit([(product_id, field_id, Decimal(1)), (product_id, field_id, Decimal(2))])
+
+    assert buffer.flush_once()
+    assert all(future.done() for future in futures)
+    with pytest.raises(PoolTimeout):
+        futures[0].result(0)
+    assert buffer.stats()["pending"] == 0 and buffer.failed == 1
+
+
+def test_flusher_survives_a_failed_flush(stock_value):
+    product_id, field_id = stock_value
+    buffer = AdjustmentBuffer(_flaky_acquire([1]), window=0.01)
+    with pytest.raises(PoolTimeout):
+        buffer.submit([(product_id, field_id, Decimal(1))])[0].result(5)
+    assert buffer.submit([(product_id, field_id, Decimal(5))])[0].result(5) == "15"
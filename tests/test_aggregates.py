@@ -0,0 +1,40 @@
+"""rebuild_aggregates() must leave metric_aggregates equal to a fresh computation."""
+
+from analytics import compute_aggregates, find_drift, rebuild_aggregates
+from db import get_pool
+
+
+def test_rebuild_repairs_drift(client, auth):
+    client.post("/folders", json={"name": "Aggregates"}, headers=auth)
+    folder_id = max(f["id"] for f in client.get("/folders").get_json() if f["name"] == "Aggregates")
+    for name in ("Stock", "Reorder"):
+        client.post("/fields", json={"name": name, "type": "number", "folder_id": folder_id}, headers=auth)
+    fields = {f["name"]: f["id"] for f in client.get(f"/fields?folder_id={folder_id}").get_json()}
+    field_id, empty_id = fields["Stock"], fields["Reorder"]
+    for quantity in ("4", "9", "2.5"):
+        client.post("/products", json={"name": f"P{quantity}", "folder_id": folder_id,
+                                       "values": {str(field_id): quantity}}, headers=auth)
+
+    conn = get_pool().acquire()
+    try:
+        cur = conn.cursor()
+        cur.execute("UPDATE metric_aggregates SET value_sum = 0, value_min = NULL WHERE field_id = %s", (field_id,))
+        # An aggregate for a field without values must go.
+        cur.execute("INSERT INTO metric_aggregates (field_id, folder_id, value_sum, value_count) "
+                    "VALUES (%s, %s, 5, 1)", (empty_id, folder_id))
+        conn.commit()
+        cur.close()
+        assert find_drift(conn, compute_aggregates(conn))
+
+        rebuild_aggregates(conn)
+
+        assert find_drift(conn, compute_aggregates(conn)) == []
+        cur = conn.cursor()
+        cur.execute("SELECT value_sum, value_count, value_min, value_max FROM metric_aggregates WHERE field_id = %s",
+                    (field_id,))
+        assert [float(v) for v in cur.fetchone()] == [15.5, 3, 2.5, 9]
+        cur.execute("SELECT COUNT(*) FROM metric_aggregates WHERE field_id = %s", (empty_id,))
+        assert cur.fetchone()[0] == 0
+        cur.close()
+    finally:
+        conn.close()
@@ -0,0 +1,19 @@
+"""Low-stock rule validation."""
+
+import pytest
+
+
+@pytest.mark.parametrize("threshold", ["1e40", "-1e26", "NaN", "Infinity", "ten", None, True])
+def test_bad_threshold_is_rejected(client, auth, threshold):
+    response = client.post("/alerts/rules", json={"metric": "Stock", "operator": "<", "threshold": threshold},
+                           headers=auth)
+    assert response.status_code == 400
+    assert "threshold" in response.get_json()["error"]
+
+
+def test_rule_is_created(client, auth):
+    response = client.post("/alerts/rules", json={"metric": "Stock", "operator": "<", "threshold": "9.5"},
+                           headers=auth)
+    assert response.status_code == 201
+    rules = client.get("/alerts/rules").get_json()
+    assert any(float(rule["threshold"]) == 9.5 for rule in rules)
@@ -0,0 +1,59 @@
+"""Folder exports return their connection however the stream ends."""
+
+from bulk import iter_products
+
+
+class _UnreadCursor:
+    """Mimics an unbuffered mysql.connector cursor that still has rows."""
+
+    def __init__(self, rows):
+        self._rows = rows
+
+    def execute(self, sql, params=None):
+        pass
+
+    def fetchmany(self, size):
+        rows, self._rows = self._rows[:size], self._rows[size:]
+        return rows
+
+    def close(self):
+        if self._rows:
+            raise RuntimeError("Unread result found")
+
+
+class _Conn:
+    def __init__(self, rows):
+        self.cur = _UnreadCursor(rows)
+        self.closed = False
+
+    def cursor(self, buffered=True):
+        return self.cur
+
+    def close(self):
+        self.closed = True
+
+
+def test_disconnect_mid_export_releases_connection():
+    conn = _Conn([(pid, f"P{pid}", None, None, None) for pid in range(10)])
+    products = iter_products(conn, 1, chunk_size=2)
+    next(products)
+    products.close()
+    assert conn.closed
+
+
+def test_finished_export_releases_connection():
+    conn = _Conn([(1, "P1", None, 7, "x")])
+    assert [p[0] for p in iter_products(conn, 1)] == [1]
+    assert conn.closed
+
+
+def test_streamed_export(client, auth):
+    client.post("/folders", json={"name": "Export"}, headers=auth)
+    folder_id = max(f["id"] for f in client.get("/folders").get_json() if f["name"] == "Export")
+    for n in range(3):
+        client.post("/products", json={"name": f"E{n}", "folder_id": folder_id}, headers=auth)
+    response = client.get(f"/folders/{folder_id}/export?format=ndjson", buffered=False)
+    first = next(iter(response.response))
+    response.close()
+    assert b'"E0"' in first
+    assert client.get(f"/folders/{folder_id}/export?format=csv").data.count(b"\n") == 4
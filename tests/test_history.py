@@ -0,0 +1,27 @@
+"""GET /analytics/history time range parsing."""
+
+from datetime import datetime, timezone
+
+import pytest
+
+from history import _parse_time
+
+
+@pytest.mark.parametrize("query", [
+    "from=2026-10-01T00:00:00%2B00:00",
+    "from=2026-10-01T00:00:00%2B00:00&to=2026-10-02T12:00:00-05:00&grain=hour",
+    "from=2026-10-01&to=2026-10-02T00:00:00%2B02:00",
+])
+def test_offsets_are_accepted(client, query):
+    response = client.get(f"/analytics/history?metric=Stock&{query}")
+    assert response.status_code == 200, response.get_json()
+
+
+def test_offsets_become_local_time():
+    utc = datetime(2026, 10, 1, tzinfo=timezone.utc)
+    assert _parse_time("2026-10-01T00:00:00+00:00", "from") == utc.astimezone().replace(tzinfo=None)
+
+
+def test_bad_time_is_rejected(client):
+    response = client.get("/analytics/history?metric=Stock&from=yesterday")
+    assert response.status_code == 400
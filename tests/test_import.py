@@ -0,0 +1,51 @@
+"""POST /products/import must attach every value to the product on its own row."""
+
+from bulk import IMPORT_BATCH_SIZE
+
+
+
+def _folder(client, auth, name):
+    client.post("/folders", json={"name": name}, headers=auth)
+    folder_id = max(f["id"] for f in client.get("/folders").get_json() if f["name"] == name)
+    client.post("/fields", json={"name": "Quantity", "type": "number", "folder_id": folder_id}, headers=auth)
+    return folder_id
+
+
+def test_import_values_follow_their_rows(client, auth):
+    folder_id = _folder(client, auth, "Import A")
+    other = _folder(client, auth, "Import B")
+    # Products in another folder between batches must not be picked up.
+    client.post("/products", json={"name": "Elsewhere", "folder_id": other, "values": {}}, headers=auth)
+
+    body = "name,Quantity\n" + "".join(f"Item {i},{i}\n" for i in range(25))
+    response = client.post(f"/products/import?folder_id={folder_id}", data=body,
+                           content_type="text/csv", headers=auth)
+    assert response.status_code == 200
+    assert response.get_json()["imported"] == 25
+
+    products = client.get(f"/products?folder_id={folder_id}").get_json()
+    assert len(products) == 25
+    for product in products:
+        assert product["values"][0]["value"] == product["name"].split()[1]
+
+
+def test_import_into_missing_folder(client, auth):
+    response = client.post("/products/import?folder_id=99999", data="name\nX\n",
+                           content_type="text/csv", headers=auth)
+    assert response.status_code == 404
+
+
+def test_import_stopped_by_bad_bytes_reports_committed_rows(client, auth):
+    folder_id = _folder(client, auth, "Import C")
+    rows = IMPORT_BATCH_SIZE + 5
+    body = ("name,Quantity\n" + "".join(f"Item {i},{i}\n" for i in range(rows))).encode() + b"Bad \xff,1\nLate,2\n"
+    response = client.post(f"/products/import?folder_id={folder_id}", data=body,
+                           content_type="text/csv", headers=auth)
+    assert response.status_code == 200
+    summary = response.get_json()
+    # The committed batch and the rows parsed after it are both kept and counted.
+    assert summary["imported"] == rows
+    assert summary["aborted"]["row"] == rows + 1
+    assert "Could not parse upload" in summary["aborted"]["error"]
+    assert summary["errors"] == [summary["aborted"]]
+    assert len(client.get(f"/products?folder_id={folder_id}").get_json()) == rows
@@ -0,0 +1,57 @@
+"""Folder deletion jobs, run chunk by chunk on borrowed connections."""
+
+from datetime import datetime, timedelta
+
+from db import get_background_pool
+from jobs import runner
+from retention import sweeper
+
+
+def test_delete_folder_job(client, auth, monkeypatch):
+    client.post("/folders", json={"name": "Doomed"}, headers=auth)
+    folder_id = max(f["id"] for f in client.get("/folders").get_json() if f["name"] == "Doomed")
+    for n in range(7):
+        client.post("/products", json={"name": f"D{n}", "folder_id": folder_id}, headers=auth)
+    job_id = client.delete(f"/folders/{folder_id}", headers=auth).get_json()["job_id"]
+
+    monkeypatch.setattr(runner, "batch_size", 3)
+    monkeypatch.setattr(runner, "pause", 0)
+    while runner.run_once():
+        pass
+
+    job = client.get(f"/jobs/{job_id}", headers=auth).get_json()
+    assert job["status"] == "done" and job["rows_deleted"] == 7
+
+    conn = get_background_pool().acquire()
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT COUNT(*) FROM products WHERE folder_id = %s", (folder_id,))
+        assert cur.fetchone()[0] == 0
+        # Finished jobs are purged once past their retention.
+        cur.execute("UPDATE jobs SET finished_at = %s WHERE id = %s", (datetime.now() - timedelta(days=365), job_id))
+        conn.commit()
+        sweeper.sweep()
+        cur.execute("SELECT COUNT(*) FROM jobs WHERE id = %s", (job_id,))
+        assert cur.fetchone()[0] == 0
+        cur.close()
+    finally:
+        conn.close()
+
+
+def test_hidden_folder_takes_no_writes(client, auth):
+    client.post("/folders", json={"name": "Hidden"}, headers=auth)
+    folder_id = max(f["id"] for f in client.get("/folders").get_json() if f["name"] == "Hidden")
+    client.post("/fields", json={"name": "Qty", "type": "number", "folder_id": folder_id}, headers=auth)
+    assert client.post("/products", json={"name": "Kept", "folder_id": folder_id}, headers=auth).status_code == 201
+    product_id = client.get(f"/products?folder_id={folder_id}").get_json()[0]["id"]
+
+    # Hidden, with its deletion job not yet run.
+    assert client.delete(f"/folders/{folder_id}", headers=auth).status_code == 202
+    new_product = client.post("/products", json={"name": "Late", "folder_id": folder_id}, headers=auth)
+    new_field = client.post("/fields", json={"name": "Late", "type": "text", "folder_id": folder_id}, headers=auth)
+    update = client.put(f"/products/{product_id}", json={"name": "Renamed"}, headers=auth)
+    assert (new_product.status_code, new_field.status_code, update.status_code) == (404, 404, 404)
+
+    while runner.run_once():
+        pass
+    assert client.put(f"/products/{product_id}", json={"name": "Gone"}, headers=auth).status_code == 404
@@ -0,0 +1,24 @@
+"""The slow-query log must not leak session tokens or password hashes."""
+
+import logging
+
+import metrics
+
+
+def test_slow_query_log_redacts_credentials(client, auth, monkeypatch, caplog):
+    monkeypatch.setattr(metrics, "SLOW_QUERY_SECONDS", 0.0)
+    token = auth["Authorization"].split()[1]
+    with caplog.at_level(logging.WARNING, logger="stockflow.slow_query"):
+        assert client.get("/folders", headers=auth).status_code == 200
+        assert client.post("/auth/login", json={"username": "admin", "password": "pw"}).status_code == 200
+
+    text = caplog.text
+    assert "FROM sessions" in text and "admin_users" in text
+    assert token not in text
+    assert "$2b$" not in text
+    assert f"<str:{len(token)}>" in text
+
+
+def test_other_parameters_are_logged():
+    assert metrics.format_params("SELECT * FROM products WHERE id = %s", (7,)) == "(7,)"
+    assert metrics.format_params("DELETE FROM sessions WHERE token = %s", ("abc", 3)) == "['<str:3>', '<int>']"
@@ -0,0 +1,73 @@
+"""Field-sorted product pages and their cursors."""
+
+import pytest
+
+from pagination import encode_cursor
+
+
+@pytest.fixture(scope="module")
+def sorted_folder(client, auth):
+    client.post("/folders", json={"name": "Paging"}, headers=auth)
+    folder_id = max(f["id"] for f in client.get("/folders").get_json() if f["name"] == "Paging")
+    client.post("/fields", json={"name": "Qty", "type": "number", "folder_id": folder_id}, headers=auth)
+    field_id = client.get(f"/fields?folder_id={folder_id}").get_json()[0]["id"]
+    for n in (5, 1, 3, 4, 2):
+        client.post("/products", json={"name": f"P{n}", "folder_id": folder_id,
+                                       "values": {str(field_id): str(n)}}, headers=auth)
+    client.post("/products", json={"name": "Unset", "folder_id": folder_id}, headers=auth)
+    return folder_id, field_id
+
+
+def test_field_sort_pages(client, sorted_folder):
+    folder_id, field_id = sorted_folder
+    names, cursor = [], None
+    while True:
+        url = f"/products?folder_id={folder_id}&sort=field:{field_id}&limit=2"
+        body = client.get(url + (f"&cursor={cursor}" if cursor else "")).get_json()
+        names += [p["name"] for p in body["items"]]
+        cursor = body["next_cursor"]
+        if not cursor:
+            break
+    assert names == ["P1", "P2", "P3", "P4", "P5", "Unset"]
+
+
+@pytest.mark.parametrize("key", ["abc", "NaN", "1e40", None, [1]])
+def test_bad_field_cursor_is_rejected(client, sorted_folder, key):
+    folder_id, field_id = sorted_folder
+    sort = f"field:{field_id}"
+    response = client.get(f"/products?folder_id={folder_id}&sort={sort}"
+                          f"&cursor={encode_cursor(sort, 'v', key, 1)}")
+    assert response.status_code == 400
+    assert response.get_json()["error"] == "Invalid cursor"
+
+
+def test_name_sort_pages(client, sorted_folder):
+    folder_id, _ = sorted_folder
+    first = client.get(f"/products?folder_id={folder_id}&sort=name&limit=4").get_json()
+    rest = client.get(f"/products?folder_id={folder_id}&sort=name&limit=4&cursor={first['next_cursor']}").get_json()
+    assert [p["name"] for p in first["items"] + rest["items"]] == ["P1", "P2", "P3", "P4", "P5", "Unset"]
+
+
+@pytest.mark.parametrize("path", ["/products?folder_id={folder_id}&", "/folders?", "/fields?folder_id={folder_id}&"])
+@pytest.mark.parametrize("sort, phase, key, row_id", [
+    ("name", "k", [1], 1),
+    ("name", "k", {"a": 1}, 1),
+    ("name", "k", "P1", None),
+    ("name", "v", "P1", 1),
+    ("id", "k", "7", 7),
+    ("-name", "k", 5, 1),
+])
+def test_forged_cursor_is_rejected(client, sorted_folder, path, sort, phase, key, row_id):
+    folder_id, _ = sorted_folder
+    cursor = encode_cursor(sort, phase, key, row_id)
+    response = client.get(path.format(folder_id=folder_id) + f"sort={sort}&cursor={cursor}")
+    assert response.status_code == 400
+    assert response.get_json()["error"] == "Invalid cursor"
+
+
+@pytest.mark.parametrize("key", ["2026-10-01 00:00:00+00:00", 5, ["2026-10-01"]])
+def test_forged_created_at_cursor_is_rejected(client, sorted_folder, key):
+    folder_id, _ = sorted_folder
+    cursor = encode_cursor("created_at", "k", key, 1)
+    response = client.get(f"/products?folder_id={folder_id}&sort=created_at&cursor={cursor}")
+    assert response.status_code == 400
@@ -0,0 +1,54 @@
+"""GET /products must load a folder in a fixed number of queries (no N+1)."""
+
+import re
+
+import pytest
+
+from db import get_pool, insert_many
+
+FIELDS = (("Quantity", "number"), ("Price", "number"), ("Supplier", "text"))
+
+
+def _seed_folder(products):
+    """A folder with FIELDS and `products` products, each with every value set."""
+    conn = get_pool().acquire()
+    cur = conn.cursor()
+    try:
+        cur.execute("INSERT INTO folders (name) VALUES (%s)", (f"Folder {products}",))
+        folder_id = cur.lastrowid
+        field_ids = []
+        for name, field_type in FIELDS:
+            cur.execute("INSERT INTO fields (name, field_type, folder_id) VALUES (%s, %s, %s)",
+                        (name, field_type, folder_id))
+            field_ids.append(cur.lastrowid)
+        insert_many(cur, "products", ("name", "folder_id"),
+                    [(f"Product {i}", folder_id) for i in range(products)])
+        cur.execute("SELECT id FROM products WHERE folder_id = %s", (folder_id,))
+        product_ids = [row[0] for row in cur.fetchall()]
+        insert_many(cur, "field_values", ("product_id", "field_id", "value"),
+                    [(pid, fid, "1") for pid in product_ids for fid in field_ids])
+        conn.commit()
+    finally:
+        cur.close()
+        conn.close()
+    return folder_id
+
+
+def _query_count(client, path):
+    response = client.get(path)
+    assert response.status_code == 200
+    match = re.search(r'desc="(\d+) queries"', response.headers["Server-Timing"])
+    return int(match.group(1)), response.get_json()
+
+
+@pytest.mark.parametrize("query", ["", "&limit=50", "&format=columnar"])
+def test_query_count_does_not_grow_with_products(client, query):
+    small, large = _seed_folder(20), _seed_folder(200)
+
+    small_queries, small_body = _query_count(client, f"/products?folder_id={small}{query}")
+    large_queries, large_body = _query_count(client, f"/products?folder_id={large}{query}")
+
+    assert small_queries == large_queries
+    if query == "":
+        assert len(small_body) == 20 and len(large_body) == 200
+        assert all(len(product["values"]) == len(FIELDS) for product in large_body)
@@ -0,0 +1,42 @@
+"""The retention sweeper purges every registered table, and only old rows."""
+
+from datetime import datetime, timedelta
+
+from db import get_pool
+from retention import sweeper
+
+
+def _count(cur, table, where, params):
+    cur.execute(f"SELECT COUNT(*) FROM {table} WHERE {where}", params)
+    return cur.fetchone()[0]
+
+
+def test_sweep_purges_expired_rows(auth):
+    now = datetime.now()
+    old, recent = now - timedelta(days=365), now - timedelta(minutes=1)
+    conn = get_pool().acquire()
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT id FROM admin_users WHERE username = 'admin'")
+        user_id = cur.fetchone()[0]
+        cur.execute("INSERT INTO sessions (user_id, token, expires_at) VALUES (%s, 'expired-token', %s)",
+                    (user_id, recent))
+        for stamp in (old, recent):
+            cur.execute("INSERT INTO sync_tombstones (entity, entity_id, deleted_at) VALUES ('product', 9999, %s)",
+                        (stamp,))
+            cur.execute("INSERT INTO metric_history (field_id, folder_id, product_id, new_value, recorded_at) "
+                        "VALUES (9999, 9999, 9999, 1, %s)", (stamp,))
+        conn.commit()
+
+        before = sweeper.stats()["rows_purged_by_table"]
+        assert sweeper.sweep() >= 3
+        purged = sweeper.stats()["rows_purged_by_table"]
+        for table in ("sessions", "sync_tombstones", "metric_history"):
+            assert purged[table] - before.get(table, 0) >= 1
+
+        assert _count(cur, "sessions", "token = %s", ("expired-token",)) == 0
+        assert _count(cur, "sync_tombstones", "entity_id = %s", (9999,)) == 1
+        assert _count(cur, "metric_history", "product_id = %s", (9999,)) == 1
+        cur.close()
+    finally:
+        conn.close()
@@ -0,0 +1,28 @@
+"""Delta sync and alert cursors."""
+
+import base64
+import json
+
+import pytest
+
+
+def _token(payload):
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip("=")
+
+
+def test_cursor_round_trip(client):
+    body = client.get("/sync").get_json()
+    assert client.get(f"/sync?cursor={body['cursor']}").status_code == 200
+
+
+@pytest.mark.parametrize("path", ["/sync", "/alerts"])
+@pytest.mark.parametrize("payload", [
+    {"p": {}, "t": "2026-10-01 00:00:00+00:00"},
+    {"p": {"products": ["2026-10-01T00:00:00+02:00", 1]}, "t": "2026-10-01 00:00:00"},
+    {"p": {}, "t": 1790000000},
+    {"p": {"products": [None, 1]}, "t": "2026-10-01 00:00:00"},
+])
+def test_bad_cursor_is_rejected(client, path, payload):
+    response = client.get(f"{path}?cursor={_token(payload)}")
+    assert response.status_code == 400
+    assert response.get_json()["error"] == "Invalid cursor"
@@ -0,0 +1,110 @@
+"""
+StockFlow Data Versions
+-----------------------
+Version counters for cached reads, stored in `data_versions` so every
+gunicorn worker sees the same numbers.
+
+Scopes:
+    global       - bumped by every data write
+    folders      - bumped when the folder list changes (create/rename/delete)
+    folder:<id>  - bumped by any write to that folder's fields or products
+
+Write routes call bump_versions() inside their transaction. Read routes
+derive their ETag from the versions of the scopes they depend on, and the
+per-worker ResponseCache stores serialised bodies under that ETag.
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+GLOBAL = 'global'
+FOLDERS = 'folders'
+
+
+def folder_scope(folder_id):
+    return f"folder:{int(folder_id)}"
+
+
+def bump_versions(db, *scopes):
+    """Increment the given scopes (and always `global`) in the current transaction."""
+    scopes = sorted(set(scopes) | {GLOBAL})
+    cur = db.cursor()
+    cur.execute(
+        "INSERT INTO data_versions (scope, version) VALUES "
+        + ", ".join(["(%s, 1)"] * len(scopes))
+        + " ON DUPLICATE KEY UPDATE version = version + 1",
+        scopes
+    )
+    cur.close()
+
+
+def read_versions(db, scopes):
+    """Return {scope: version} for the given scopes (0 if never bumped)."""
+    cur = db.cursor()
+    cur.execute(
+        "SELECT scope, version FROM data_versions WHERE scope IN ("
+        + ", ".join(["%s"] * len(scopes)) + ")",
+        list(scopes)
+    )
+    versions = dict(cur.fetchall())
+    cur.close()
+    return {scope: versions.get(scope, 0) for scope in scopes}
+
+
+def make_etag(key, versions):
+    digest = hashlib.sha1(key.encode('utf-8'))
+    for scope in sorted(versions):
+        digest.update(f"|{scope}={versions[scope]}".encode('utf-8'))
+    return digest.hexdigest()
+
+
+class ResponseCache:
+    """Bounded LRU of serialised response bodies keyed by ETag."""
+
+    def __init__(self, max_entries=512, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, etag):
+        with self._lock:
+            entry = self._entries.get(etag)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(etag)
+            self.hits += 1
+            return entry
+
+    def put(self, etag, body, mimetype):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            if etag in self._entries:
+                return
+            self._entries[etag] = (body, mimetype)
+            self._bytes += len(body)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (old_body, _) = self._entries.popitem(last=False)
+                self._bytes -= len(old_body)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+cache = ResponseCache(
+    max_entries=int(os.getenv("RESPONSE_CACHE_ENTRIES", 512)),
+    max_bytes=int(os.getenv("RESPONSE_CACHE_BYTES", 64 * 1024 * 1024)),
+)